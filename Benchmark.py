@@ -0,0 +1,443 @@
+"""
+Benchmarks the tokenizer, the parser and the whole analyzer.
+
+The benchmark runs on a synthetic corpus of Jack classes, generated from a
+seed in one of several shapes (many subroutines, long expressions, deep
+nesting, heavy comments, long string constants, and nesting thousands of
+levels deep, which only the iterative parser handles), or on the .jack files
+of a directory. Every phase is timed on the whole corpus a few times and the best
+run is kept; peak memory is measured on a separate run, under tracemalloc.
+The results are printed (or written) as JSON, so they can be tracked over
+time:
+
+    python Benchmark.py --shape deep_nesting --files 50 --output nesting.json
+"""
+import argparse
+import datetime
+import io
+import json
+import os
+import platform
+import random
+import sys
+import time
+import tracemalloc
+import typing
+from CompilationEngine import CompilationEngine, IterativeCompilationEngine
+from JackAnalyzer import analyze_file, list_jack_files
+from JackTokenizer import JackTokenizer, StreamingJackTokenizer
+
+RESULTS_VERSION = 1
+BINARY_OPS = "+-*/&|<>="
+WORDS = ("alpha", "beta", "gamma", "delta", "token", "parse", "stack",
+         "value", "index", "count", "pixel", "screen", "memory", "output")
+# levels of indentation beyond which nested code is not indented any further,
+# so that the size of very deeply nested classes stays linear in their depth
+MAX_INDENT = 64
+
+
+class CorpusShape(typing.NamedTuple):
+    """The size and shape of every class of a synthetic corpus."""
+    # subroutines per class
+    subroutines: int = 8
+    # statements per subroutine body (not counting nested ones)
+    statements: int = 12
+    # terms per expression
+    expression_terms: int = 3
+    # how deeply if and while statements are nested
+    nesting: int = 2
+    # how deeply a term of every subroutine nests parentheses, unary
+    # operators, array entries and calls
+    term_nesting: int = 0
+    # comment lines before every statement
+    comments: int = 0
+    # characters per string constant
+    string_length: int = 12
+
+
+SHAPES = {
+    "balanced": CorpusShape(),
+    "many_subroutines": CorpusShape(subroutines=200, statements=4),
+    "long_expressions": CorpusShape(expression_terms=60),
+    "deep_nesting": CorpusShape(statements=4, nesting=40),
+    "heavy_comments": CorpusShape(comments=6),
+    "long_strings": CorpusShape(string_length=2000),
+    "extreme_nesting": CorpusShape(subroutines=1, statements=0,
+                                   expression_terms=1, nesting=20000,
+                                   term_nesting=20000),
+}  # type: typing.Dict[str, CorpusShape]
+
+
+class ClassGenerator:
+    """Writes a random (but valid) Jack class of a given shape."""
+
+    def __init__(self, name: str, shape: CorpusShape, seed: int) -> None:
+        self.name = name
+        self.shape = shape
+        self.random = random.Random(seed)
+        self.lines = []  # type: typing.List[str]
+
+    def generate(self) -> str:
+        """
+        Returns:
+            str: the source of the class.
+        """
+        self.lines = ["class %s {" % self.name,
+                      "    field int width, height;",
+                      "    static int count;"]
+        for index in range(self.shape.subroutines):
+            self.subroutine(index)
+        self.lines.append("}")
+        return "\n".join(self.lines) + "\n"
+
+    def subroutine(self, index: int) -> None:
+        indent = "    "
+        self.lines.append("%sfunction int run%d(int a, int b) {"
+                          % (indent, index))
+        self.lines.append("%s    var int x, y, z;" % indent)
+        self.lines.append("%s    var String text;" % indent)
+        if self.shape.nesting > 0:
+            # a single chain as deep as the shape allows
+            self.nested(self.shape.nesting, 2)
+        if self.shape.term_nesting > 0:
+            self.lines.append("%s    let x = %s;" % (
+                indent, self.nested_term(self.shape.term_nesting)))
+        for _ in range(self.shape.statements):
+            self.statement(1, 2)
+        self.lines.append("%s    return x;" % indent)
+        self.lines.append("%s}" % indent)
+
+    def nested(self, depth: int, level: int) -> None:
+        # a loop rather than recursion, as the chain may be very deep
+        indents = []
+        for ind in range(depth):
+            indent = "    " * min(level + ind, MAX_INDENT)
+            keyword = self.random.choice(("if", "while"))
+            self.lines.append("%s%s (%s) {" % (indent, keyword,
+                                              self.expression()))
+            indents.append(indent)
+        self.statement(self.shape.nesting, level + depth)
+        for indent in reversed(indents):
+            self.lines.append("%s}" % indent)
+
+    def statement(self, depth: int, level: int) -> None:
+        indent = "    " * min(level, MAX_INDENT)
+        for _ in range(self.shape.comments):
+            self.comment(indent)
+        choice = self.random.random()
+        if choice < 0.2 and depth < self.shape.nesting:
+            self.lines.append("%sif (%s) {" % (indent, self.expression()))
+            self.statement(depth + 1, level + 1)
+            self.lines.append("%s} else {" % indent)
+            self.statement(depth + 1, level + 1)
+            self.lines.append("%s}" % indent)
+        elif choice < 0.3 and depth < self.shape.nesting:
+            self.lines.append("%swhile (%s) {" % (indent, self.expression()))
+            self.statement(depth + 1, level + 1)
+            self.lines.append("%s}" % indent)
+        elif choice < 0.4:
+            self.lines.append('%slet text = "%s";' % (indent, self.string()))
+        elif choice < 0.5:
+            self.lines.append("%sdo Output.printInt(%s);"
+                              % (indent, self.expression()))
+        else:
+            self.lines.append("%slet %s = %s;" % (
+                indent, self.random.choice("xyz"), self.expression()))
+
+    def expression(self) -> str:
+        terms = [self.term() for _ in range(self.shape.expression_terms)]
+        return "".join(
+            term if ind == 0 else
+            " %s %s" % (self.random.choice(BINARY_OPS), term)
+            for ind, term in enumerate(terms))
+
+    def term(self) -> str:
+        choice = self.random.random()
+        if choice < 0.3:
+            return str(self.random.randint(0, 32767))
+        if choice < 0.7:
+            return self.random.choice(("a", "b", "x", "y", "z", "count"))
+        if choice < 0.75:
+            return "~(%s + %d)" % (self.random.choice("abxyz"),
+                                   self.random.randint(0, 99))
+        if choice < 0.8:
+            return "-%s" % self.random.choice("abxyz")
+        if choice < 0.9:
+            return "%s.run0(%s, %s)" % (self.name, self.random.choice("xy"),
+                                        self.random.choice("ab"))
+        return self.random.choice(("true", "false", "null"))
+
+    def nested_term(self, depth: int) -> str:
+        opening = []
+        closing = []
+        for _ in range(depth):
+            choice = self.random.random()
+            if choice < 0.25:
+                opening.append("(")
+                closing.append(")")
+            elif choice < 0.5:
+                opening.append(self.random.choice("-~"))
+                closing.append("")
+            elif choice < 0.75:
+                opening.append("a[")
+                closing.append("]")
+            else:
+                opening.append("%s.run0(x, " % self.name)
+                closing.append(")")
+        return "".join(opening) + "x" + "".join(reversed(closing))
+
+    def string(self) -> str:
+        words = []
+        length = 0
+        while length < self.shape.string_length:
+            word = self.random.choice(WORDS)
+            words.append(word)
+            length += len(word) + 1
+        return " ".join(words)[:self.shape.string_length]
+
+    def comment(self, indent: str) -> None:
+        text = " ".join(self.random.choice(WORDS) for _ in range(8))
+        if self.random.random() < 0.5:
+            self.lines.append("%s// %s" % (indent, text))
+        else:
+            self.lines.append("%s/** %s */" % (indent, text))
+
+
+def generate_corpus(shape: CorpusShape, files: int, seed: int = 0
+                    ) -> typing.Dict[str, str]:
+    """
+    Args:
+        shape (CorpusShape): the shape of every class.
+        files (int): how many classes to generate.
+        seed (int): the seed of the generator, the same seed always
+            generates the same corpus.
+
+    Returns:
+        typing.Dict[str, str]: maps the file name of every class to its
+        source.
+    """
+    corpus = {}
+    for index in range(files):
+        name = "Bench%d" % index
+        corpus[name + ".jack"] = ClassGenerator(
+            name, shape, seed * 1000003 + index).generate()
+    return corpus
+
+
+def write_corpus(corpus: typing.Dict[str, str], directory: str) -> None:
+    """Writes the classes of a corpus into a directory, e.g. to analyze them
+    with JackAnalyzer."""
+    os.makedirs(directory, exist_ok=True)
+    for filename, source in corpus.items():
+        with open(os.path.join(directory, filename), 'w') as output_file:
+            output_file.write(source)
+
+
+def read_corpus(directory: str) -> typing.Dict[str, str]:
+    """
+    Returns:
+        typing.Dict[str, str]: the sources of the .jack files of a directory.
+    """
+    corpus = {}
+    for path in list_jack_files(directory):
+        with open(path, 'r') as input_file:
+            corpus[os.path.basename(path)] = input_file.read()
+    return corpus
+
+
+def tokenize(source: str) -> int:
+    tokenizer = JackTokenizer(io.StringIO(source))
+    while tokenizer.has_more_tokens():
+        tokenizer.advance()
+    return tokenizer.num_tokens
+
+
+def tokenize_stream(source: str) -> None:
+    tokenizer = StreamingJackTokenizer(io.StringIO(source))
+    while tokenizer.has_more_tokens():
+        tokenizer.advance()
+
+
+def analyze_xml(source: str) -> None:
+    analyze_file(io.StringIO(source), io.StringIO())
+
+
+def analyze_vm(source: str) -> None:
+    analyze_file(io.StringIO(source), io.StringIO(), target="vm")
+
+
+def analyze_vm_optimized(source: str) -> None:
+    analyze_file(io.StringIO(source), io.StringIO(), target="vm",
+                 optimizing=True)
+
+
+def analyze_xml_iterative(source: str) -> None:
+    analyze_file(io.StringIO(source), io.StringIO(), iterative=True)
+
+
+def prepare_parse(source: str) -> CompilationEngine:
+    # the source is scanned here, so that only parsing is timed
+    return CompilationEngine(JackTokenizer(io.StringIO(source)), None)
+
+
+def prepare_parse_iterative(source: str) -> CompilationEngine:
+    return IterativeCompilationEngine(JackTokenizer(io.StringIO(source)),
+                                      None)
+
+
+def parse(engine: CompilationEngine) -> None:
+    engine.compile_class()
+
+
+# every phase, as a function of a prepared source and the (untimed)
+# preparation of a source
+PHASES = {
+    "tokenize": (tokenize, None),
+    "tokenize_stream": (tokenize_stream, None),
+    "parse": (parse, prepare_parse),
+    "parse_iterative": (parse, prepare_parse_iterative),
+    "analyze_xml": (analyze_xml, None),
+    "analyze_xml_iterative": (analyze_xml_iterative, None),
+    "analyze_vm": (analyze_vm, None),
+    "analyze_vm_optimized": (analyze_vm_optimized, None),
+}  # type: typing.Dict[str, typing.Tuple[typing.Callable, typing.Optional[typing.Callable]]]
+
+
+def run_phase(phase: str, sources: typing.List[str], repeat: int
+              ) -> typing.Tuple[float, int]:
+    """Times a phase on every source.
+
+    Args:
+        phase (str): a key of PHASES.
+        sources (typing.List[str]): the sources to run the phase on.
+        repeat (int): how many times to time the phase.
+
+    Returns:
+        typing.Tuple[float, int]: the best time of a run in seconds, and the
+        peak memory allocated while running the phase once, in bytes.
+    """
+    function, prepare = PHASES[phase]
+    best = float("inf")
+    for _ in range(repeat):
+        inputs = [prepare(source) for source in sources] if prepare \
+            else sources
+        start = time.perf_counter()
+        for argument in inputs:
+            function(argument)
+        best = min(best, time.perf_counter() - start)
+    inputs = [prepare(source) for source in sources] if prepare else sources
+    tracemalloc.start()
+    try:
+        for argument in inputs:
+            function(argument)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return best, peak
+
+
+def run_benchmarks(corpus: typing.Dict[str, str],
+                   phases: typing.Iterable[str] = tuple(PHASES),
+                   repeat: int = 3) -> typing.Dict[str, typing.Any]:
+    """Runs the given phases on a corpus.
+
+    Args:
+        corpus (typing.Dict[str, str]): maps file names to sources.
+        phases (typing.Iterable[str]): keys of PHASES.
+        repeat (int): see run_phase.
+
+    Returns:
+        typing.Dict[str, typing.Any]: the size of the corpus and the
+        results of every phase (or the error of a phase that fails on it,
+        e.g. a RecursionError), ready to be serialized as JSON.
+    """
+    sources = list(corpus.values())
+    tokens = sum(tokenize(source) for source in sources)
+    results = {}
+    for phase in phases:
+        try:
+            seconds, peak = run_phase(phase, sources, repeat)
+        except RecursionError:
+            # the corpus is nested too deeply for the recursive parser
+            results[phase] = {"error": "RecursionError"}
+            continue
+        results[phase] = {
+            "seconds": seconds,
+            "tokens_per_second": tokens / seconds if seconds else None,
+            "files_per_second": len(sources) / seconds if seconds else None,
+            "peak_memory_bytes": peak,
+        }
+    return {
+        "files": len(sources),
+        "bytes": sum(len(source.encode()) for source in sources),
+        "tokens": tokens,
+        "phases": results,
+    }
+
+
+def environment() -> typing.Dict[str, str]:
+    """
+    Returns:
+        typing.Dict[str, str]: what the benchmark ran on.
+    """
+    return {
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "machine": platform.machine(),
+        "system": platform.system(),
+        "timestamp": datetime.datetime.now(
+            datetime.timezone.utc).isoformat(timespec="seconds"),
+    }
+
+
+if "__main__" == __name__:
+    parser = argparse.ArgumentParser(
+        prog="Benchmark",
+        description="Benchmarks the Jack tokenizer, parser and analyzer on a "
+                    "synthetic corpus and prints the results as JSON.")
+    parser.add_argument("--shape", action="append", choices=sorted(SHAPES),
+                        help="the shape of the synthetic corpus, may be "
+                             "given more than once (default: all shapes)")
+    parser.add_argument("--corpus",
+                        help="benchmark the .jack files of this directory "
+                             "instead of a synthetic corpus")
+    parser.add_argument("--files", type=int, default=20,
+                        help="classes per synthetic corpus (default: 20)")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="seed of the corpus generator (default: 0)")
+    parser.add_argument("--phase", action="append", choices=list(PHASES),
+                        help="a phase to run, may be given more than once "
+                             "(default: all phases)")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="timed runs per phase, the best one is kept "
+                             "(default: 3)")
+    parser.add_argument("--write-corpus", metavar="DIR",
+                        help="also write the synthetic corpora into DIR, one "
+                             "subdirectory per shape")
+    parser.add_argument("--output",
+                        help="write the results into this file instead of "
+                             "printing them")
+    args = parser.parse_args()
+    phases = args.phase or list(PHASES)
+    runs = {}
+    if args.corpus:
+        runs[os.path.abspath(args.corpus)] = run_benchmarks(
+            read_corpus(args.corpus), phases, args.repeat)
+    else:
+        for shape_name in args.shape or sorted(SHAPES):
+            shape = SHAPES[shape_name]
+            corpus = generate_corpus(shape, args.files, args.seed)
+            if args.write_corpus:
+                write_corpus(corpus, os.path.join(args.write_corpus,
+                                                  shape_name))
+            runs[shape_name] = run_benchmarks(corpus, phases, args.repeat)
+            runs[shape_name]["shape"] = shape._asdict()
+            print("%s: done" % shape_name, file=sys.stderr)
+    results = {"version": RESULTS_VERSION, "environment": environment(),
+               "seed": args.seed, "runs": runs}
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(results, output_file, indent=2)
+            output_file.write("\n")
+    else:
+        print(json.dumps(results, indent=2))
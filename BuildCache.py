@@ -0,0 +1,172 @@
+"""
+A persistent, content-addressed cache of analyzer outputs.
+
+Outputs are stored under a key derived from the bytes of the source, the
+version of the analyzer and the output mode, so an entry is only ever reused
+for exactly the input (and the exact analyzer) that produced it. A JSON
+manifest records when every entry was last used, so the least recently used
+entries can be evicted once the cache grows past its size limit.
+"""
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+import typing
+
+MANIFEST_NAME = "manifest.json"
+MANIFEST_VERSION = 1
+DEFAULT_MAX_ENTRIES = 4096
+
+
+class BuildCache:
+    """An on-disk cache of output files, keyed by the hash of their source."""
+
+    def __init__(self, cache_dir: str,
+                 max_entries: int = DEFAULT_MAX_ENTRIES) -> None:
+        """Opens (or creates) the cache in the given directory.
+
+        Args:
+            cache_dir (str): the directory holding the cache.
+            max_entries (int): how many entries prune() keeps.
+        """
+        self.cache_dir = cache_dir
+        self.objects_dir = os.path.join(cache_dir, "objects")
+        self.manifest_path = os.path.join(cache_dir, MANIFEST_NAME)
+        self.max_entries = max_entries
+        self.entries = self.load_manifest()
+        self.hits = 0
+        self.misses = 0
+
+    def load_manifest(self) -> typing.Dict[str, typing.Dict]:
+        """
+        Returns:
+            typing.Dict[str, typing.Dict]: the entries of the manifest, or no
+            entries at all if it is missing, unreadable or of another version.
+        """
+        try:
+            with open(self.manifest_path, 'r') as manifest_file:
+                manifest = json.load(manifest_file)
+        except (OSError, ValueError):
+            return {}
+        if not isinstance(manifest, dict) or \
+                manifest.get("version") != MANIFEST_VERSION:
+            return {}
+        return manifest.get("entries", {})
+
+    @staticmethod
+    def key(source: bytes, analyzer_version: str, mode: str) -> str:
+        """
+        Args:
+            source (bytes): the contents of the source file.
+            analyzer_version (str): identifies the analyzer that compiles it.
+            mode (str): identifies the kind of output produced.
+
+        Returns:
+            str: the key of the output of that source.
+        """
+        digest = hashlib.sha256()
+        digest.update(analyzer_version.encode())
+        digest.update(b"\0")
+        digest.update(mode.encode())
+        digest.update(b"\0")
+        digest.update(source)
+        return digest.hexdigest()
+
+    def object_path(self, key: str) -> str:
+        return os.path.join(self.objects_dir, key[:2], key)
+
+    def restore(self, key: str, output_path: str) -> bool:
+        """Copies the cached output for key to output_path, if there is one.
+
+        Args:
+            key (str): the key of the output.
+            output_path (str): where the output should be written.
+
+        Returns:
+            bool: True if the output was restored, False on a cache miss.
+        """
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return False
+        try:
+            shutil.copyfile(self.object_path(key), output_path)
+        except OSError:
+            # the object was evicted (or deleted) behind the manifest's back
+            del self.entries[key]
+            self.misses += 1
+            return False
+        entry["last_used"] = time.time()
+        self.hits += 1
+        return True
+
+    def store(self, key: str, output_path: str, source_path: str,
+              metadata: typing.Optional[typing.Dict] = None) -> None:
+        """Adds a freshly produced output file to the cache.
+
+        Args:
+            key (str): the key of the output.
+            output_path (str): the output file to cache.
+            source_path (str): the file it was produced from, for reference.
+            metadata (typing.Optional[typing.Dict]): JSON-serializable facts
+                about the output, returned by metadata() on later hits.
+        """
+        object_path = self.object_path(key)
+        os.makedirs(os.path.dirname(object_path), exist_ok=True)
+        shutil.copyfile(output_path, object_path)
+        self.entries[key] = {
+            "source": source_path,
+            "size": os.path.getsize(object_path),
+            "last_used": time.time(),
+        }
+        if metadata is not None:
+            self.entries[key]["metadata"] = metadata
+
+    def metadata(self, key: str) -> typing.Optional[typing.Dict]:
+        """
+        Returns:
+            typing.Optional[typing.Dict]: the metadata stored with the output
+            for key, if any.
+        """
+        entry = self.entries.get(key)
+        return entry.get("metadata") if entry is not None else None
+
+    def prune(self, max_entries: typing.Optional[int] = None) -> int:
+        """Evicts the least recently used entries beyond the size limit.
+
+        Args:
+            max_entries (typing.Optional[int]): how many entries to keep,
+                defaults to the limit the cache was opened with.
+
+        Returns:
+            int: the number of evicted entries.
+        """
+        if max_entries is None:
+            max_entries = self.max_entries
+        if len(self.entries) <= max_entries:
+            return 0
+        by_age = sorted(self.entries,
+                        key=lambda key: self.entries[key]["last_used"])
+        evicted = by_age[:len(by_age) - max_entries]
+        for key in evicted:
+            del self.entries[key]
+            try:
+                os.remove(self.object_path(key))
+            except OSError:
+                pass
+        return len(evicted)
+
+    def save(self) -> None:
+        """Writes the manifest back to disk, atomically."""
+        os.makedirs(self.cache_dir, exist_ok=True)
+        manifest = {"version": MANIFEST_VERSION, "entries": self.entries}
+        descriptor, temp_path = tempfile.mkstemp(dir=self.cache_dir)
+        try:
+            with os.fdopen(descriptor, 'w') as manifest_file:
+                json.dump(manifest, manifest_file)
+            os.replace(temp_path, self.manifest_path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
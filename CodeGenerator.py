@@ -0,0 +1,329 @@
+"""
+Generates VM code from the parse tree built by the CompilationEngine.
+
+The generator is a backend of the engine, just like the XMLWriter: it is
+handed the class-level declarations as they are parsed, so every subroutine
+is translated right after it has been parsed and no intermediate output is
+ever produced.
+"""
+import typing
+from ParseTree import Node, Terminal
+from SymbolTable import SymbolTable
+from VMOptimizer import optimize
+from VMWriter import VMWriter
+
+# the VM segment of every kind of variable
+KIND_SEGMENTS = {"STATIC": "STATIC", "FIELD": "THIS", "ARG": "ARG",
+                 "VAR": "LOCAL"}
+BINARY_OPS = {"+": "ADD", "-": "SUB", "&": "AND", "|": "OR", "<": "LT",
+              ">": "GT", "=": "EQ"}
+BINARY_CALLS = {"*": "Math.multiply", "/": "Math.divide"}
+UNARY_OPS = {"-": "NEG", "~": "NOT", "^": "SHIFTLEFT", "#": "SHIFTRIGHT"}
+
+
+class CodeGenerator:
+    """Translates the class-level declarations of a parse tree into VM code.
+    """
+
+    def __init__(self, output_stream: typing.TextIO,
+                 optimizing: bool = False,
+                 live: typing.Optional[typing.AbstractSet[str]] = None
+                 ) -> None:
+        """Creates a new code generator writing VM code to the given stream.
+
+        Args:
+            output_stream (typing.TextIO): the stream to write to.
+            optimizing (bool): pass the code of every subroutine through the
+                VMOptimizer before it is written.
+            live (typing.Optional[typing.AbstractSet[str]]): if given, only
+                the subroutines with these full names (e.g. "Main.main") are
+                translated, and the rest are skipped (see ProgramIndex).
+        """
+        self.writer = VMWriter(output_stream)
+        self.symbols = SymbolTable()
+        self.optimizing = optimizing
+        self.class_name = None  # type: typing.Optional[str]
+        self.label_counts = {}  # type: typing.Dict[str, int]
+        # the number of commands generated, before and after optimization
+        self.command_count = 0
+        self.optimized_count = 0
+        self.live = live
+        # the number of subroutines, and the full names of those skipped
+        self.subroutine_count = 0
+        self.eliminated = []  # type: typing.List[str]
+
+    def write_class_children(self, tree: Node, children: typing.List[
+            typing.Union[Node, Terminal]]) -> None:
+        """Translates the given (newly parsed) children of a class.
+
+        Args:
+            tree (Node): the class.
+            children (typing.List[typing.Union[Node, Terminal]]): its children
+                which were not handed to the generator before.
+        """
+        for child in children:
+            if type(child) is Terminal:
+                if child.kind == "identifier" and self.class_name is None:
+                    self.class_name = child.token
+            elif child.kind == "classVarDec":
+                self.define_variables(child, child.children[0].token.upper())
+            elif child.kind == "subroutineDec":
+                self.subroutine_count += 1
+                full_name = self.class_name + "." + child.children[2].token
+                if self.live is not None and full_name not in self.live:
+                    self.eliminated.append(full_name)
+                    continue
+                self.compile_subroutine(child)
+                commands = self.writer.commands
+                self.command_count += len(commands)
+                if self.optimizing:
+                    commands[:] = optimize(commands)
+                self.optimized_count += len(commands)
+                self.writer.flush()
+
+    def finish_class(self, tree: Node) -> None:
+        """Writes out whatever is left once the whole class was parsed."""
+        self.writer.flush()
+
+    @property
+    def write_calls(self) -> int:
+        """The number of writes to the output stream so far."""
+        return self.writer.write_calls
+
+    def report(self) -> typing.Dict[str, typing.Any]:
+        """
+        Returns:
+            typing.Dict[str, typing.Any]: the name of the class, the number
+            of VM commands generated for it, before ("commands") and after
+            ("optimized") optimization, its number of subroutines and the
+            full names of those which were skipped ("eliminated").
+        """
+        return {"class": self.class_name, "commands": self.command_count,
+                "optimized": self.optimized_count,
+                "subroutines": self.subroutine_count,
+                "eliminated": self.eliminated}
+
+    def define_variables(self, declaration: Node, kind: str) -> None:
+        """Defines the variables of a classVarDec or a varDec."""
+        children = declaration.children
+        var_type = children[1].token
+        for child in children[2::2]:
+            self.symbols.define(child.token, var_type, kind)
+
+    def compile_subroutine(self, subroutine: Node) -> None:
+        children = subroutine.children
+        subroutine_kind = children[0].token
+        name = children[2].token
+        parameters = children[4].children
+        body = children[6].children
+        self.symbols.start_subroutine()
+        self.label_counts = {}
+        if subroutine_kind == "method":
+            self.symbols.define("this", self.class_name, "ARG")
+        for ind in range(0, len(parameters), 3):
+            self.symbols.define(parameters[ind + 1].token,
+                                parameters[ind].token, "ARG")
+        for child in body[1:-2]:
+            self.define_variables(child, "VAR")
+        self.writer.write_function(self.class_name + "." + name,
+                                   self.symbols.var_count("VAR"))
+        if subroutine_kind == "constructor":
+            self.writer.write_push("CONST", self.symbols.var_count("FIELD"))
+            self.writer.write_call("Memory.alloc", 1)
+            self.writer.write_pop("POINTER", 0)
+        elif subroutine_kind == "method":
+            self.writer.write_push("ARG", 0)
+            self.writer.write_pop("POINTER", 0)
+        self.compile_statements(body[-2])
+
+    def new_label(self, prefix: str) -> str:
+        """
+        Returns:
+            str: a fresh label, unique within the current subroutine.
+        """
+        count = self.label_counts.get(prefix, 0)
+        self.label_counts[prefix] = count + 1
+        return prefix + str(count)
+
+    def compile_statements(self, statements: Node) -> None:
+        for statement in statements.children:
+            kind = statement.kind
+            if kind == "letStatement":
+                self.compile_let(statement)
+            elif kind == "ifStatement":
+                self.compile_if(statement)
+            elif kind == "whileStatement":
+                self.compile_while(statement)
+            elif kind == "doStatement":
+                self.compile_do(statement)
+            elif kind == "returnStatement":
+                self.compile_return(statement)
+
+    def compile_let(self, statement: Node) -> None:
+        children = statement.children
+        name = children[1].token
+        if children[2].token == "[":
+            # let name[index] = value
+            self.push_variable(name)
+            self.compile_expression(children[3])
+            self.writer.write_arithmetic("ADD")
+            self.compile_expression(children[6])
+            self.writer.write_pop("TEMP", 0)
+            self.writer.write_pop("POINTER", 1)
+            self.writer.write_push("TEMP", 0)
+            self.writer.write_pop("THAT", 0)
+        else:
+            self.compile_expression(children[3])
+            var_type, kind, index = self.variable(name)
+            self.writer.write_pop(KIND_SEGMENTS[kind], index)
+
+    def compile_if(self, statement: Node) -> None:
+        children = statement.children
+        true_label = self.new_label("IF_TRUE")
+        false_label = self.new_label("IF_FALSE")
+        self.compile_expression(children[2])
+        self.writer.write_if(true_label)
+        self.writer.write_goto(false_label)
+        self.writer.write_label(true_label)
+        self.compile_statements(children[5])
+        if len(children) > 7:
+            # else
+            end_label = self.new_label("IF_END")
+            self.writer.write_goto(end_label)
+            self.writer.write_label(false_label)
+            self.compile_statements(children[9])
+            self.writer.write_label(end_label)
+        else:
+            self.writer.write_label(false_label)
+
+    def compile_while(self, statement: Node) -> None:
+        children = statement.children
+        start_label = self.new_label("WHILE_EXP")
+        end_label = self.new_label("WHILE_END")
+        self.writer.write_label(start_label)
+        self.compile_expression(children[2])
+        self.writer.write_arithmetic("NOT")
+        self.writer.write_if(end_label)
+        self.compile_statements(children[5])
+        self.writer.write_goto(start_label)
+        self.writer.write_label(end_label)
+
+    def compile_do(self, statement: Node) -> None:
+        # the call is everything between 'do' and ';'
+        self.compile_call(statement.children[1:-1])
+        self.writer.write_pop("TEMP", 0)
+
+    def compile_return(self, statement: Node) -> None:
+        children = statement.children
+        if len(children) > 2:
+            for expression in children[1:-1]:
+                self.compile_expression(expression)
+        else:
+            self.writer.write_push("CONST", 0)
+        self.writer.write_return()
+
+    def compile_expression(self, expression: Node) -> None:
+        """Compiles an expression: its terms and operators are applied from
+        left to right, as Jack has no operator precedence.
+        """
+        children = expression.children
+        self.compile_term(children[0])
+        for ind in range(1, len(children), 2):
+            self.compile_term(children[ind + 1])
+            self.compile_binary_op(children[ind].token)
+
+    def compile_binary_op(self, op: str) -> None:
+        if op in BINARY_OPS:
+            self.writer.write_arithmetic(BINARY_OPS[op])
+        else:
+            self.writer.write_call(BINARY_CALLS[op], 2)
+
+    def compile_term(self, term: Node) -> None:
+        children = term.children
+        first = children[0]
+        kind = first.kind
+        if kind == "integerConstant":
+            self.writer.write_push("CONST", int(first.token))
+        elif kind == "stringConstant":
+            self.compile_string(first.token)
+        elif kind == "keyword":
+            self.compile_keyword_constant(first.token)
+        elif kind == "identifier":
+            if len(children) == 1:
+                self.push_variable(first.token)
+            elif children[1].token == "[":
+                self.push_variable(first.token)
+                self.compile_expression(children[2])
+                self.writer.write_arithmetic("ADD")
+                self.writer.write_pop("POINTER", 1)
+                self.writer.write_push("THAT", 0)
+            else:
+                self.compile_call(children)
+        elif first.token == "(":
+            self.compile_expression(children[1])
+        else:
+            # unary operator
+            self.compile_term(children[1])
+            self.writer.write_arithmetic(UNARY_OPS[first.token])
+
+    def compile_string(self, string: str) -> None:
+        self.writer.write_push("CONST", len(string))
+        self.writer.write_call("String.new", 1)
+        for char in string:
+            self.writer.write_push("CONST", ord(char))
+            self.writer.write_call("String.appendChar", 2)
+
+    def compile_keyword_constant(self, keyword: str) -> None:
+        if keyword == "this":
+            self.writer.write_push("POINTER", 0)
+        else:
+            self.writer.write_push("CONST", 0)
+            if keyword == "true":
+                self.writer.write_arithmetic("NOT")
+
+    def compile_call(self, parts: typing.List[typing.Union[Node, Terminal]]
+                     ) -> None:
+        """Compiles a subroutine call, given as its terminals and its
+        expressionList: name '(' expressionList ')' or
+        (className | varName) '.' name '(' expressionList ')'.
+        """
+        n_args = 0
+        if parts[1].token == ".":
+            receiver = parts[0].token
+            entry = self.symbols.lookup(receiver)
+            if entry is not None:
+                # a method of an object
+                var_type, kind, index = entry
+                self.writer.write_push(KIND_SEGMENTS[kind], index)
+                n_args = 1
+                name = var_type + "." + parts[2].token
+            else:
+                # a function or constructor of a class
+                name = receiver + "." + parts[2].token
+            arguments = parts[4]
+        else:
+            # a method of this object
+            self.writer.write_push("POINTER", 0)
+            n_args = 1
+            name = self.class_name + "." + parts[0].token
+            arguments = parts[2]
+        for child in arguments.children:
+            if type(child) is Node:
+                self.compile_expression(child)
+                n_args += 1
+        self.writer.write_call(name, n_args)
+
+    def variable(self, name: str) -> typing.Tuple[str, str, int]:
+        """
+        Returns:
+            typing.Tuple[str, str, int]: the type, kind and index of a variable.
+        """
+        entry = self.symbols.lookup(name)
+        if entry is None:
+            raise ValueError("Undefined variable %r in class %s"
+                             % (name, self.class_name))
+        return entry
+
+    def push_variable(self, name: str) -> None:
+        var_type, kind, index = self.variable(name)
+        self.writer.write_push(KIND_SEGMENTS[kind], index)
@@ -5,65 +5,133 @@ was written by Aviv Yaish. It is an extension to the specifications given
 as allowed by the Creative Common Attribution-NonCommercial-ShareAlike 3.0
 Unported [License](https://creativecommons.org/licenses/by-nc-sa/3.0/).
 """
+import functools
 import typing
+from JackTokenizer import KEYWORD, SYMBOL, IDENTIFIER, INT_CONST, \
+    STRING_CONST, EOF
+from ParseTree import Node, Terminal, TERMINAL_KINDS, terminal_tables
+from XMLWriter import XMLWriter
+
+# Jack's operators. All binary operators have the same precedence.
+BINARY_OPS = frozenset("+-*/&|<>=")
+UNARY_OPS = frozenset("-~^#")
+
+# What strict mode expects of a token: a keyword or a symbol is expected by
+# its lexeme, any other kind of token by its kind, and a choice of these as a
+# frozenset.
+TYPES = frozenset(("int", "char", "boolean", IDENTIFIER))
+RETURN_TYPES = TYPES | {"void"}
+KEYWORD_CONSTANTS = frozenset(("true", "false", "null", "this"))
+# how tokens of every kind are described in diagnostics
+KIND_NAMES = ("a keyword", "a symbol", "an identifier",
+              "an integer constant", "a string constant", "end of input")
 
 
 class CompilationEngine:
-    """Gets input from a JackTokenizer and emits its parsed structure into an
-    output stream.
+    """Gets input from a JackTokenizer and parses it into a parse tree, which
+    a backend then emits into an output stream: as XML by default, or as VM
+    code with a CodeGenerator backend.
+
+    A backend is handed the children of the class as they are parsed, through
+    its write_class_children(tree, children) method, and is told that the
+    class is complete through its finish_class(tree) method.
     """
 
-    def __init__(self, input_stream: "JackTokenizer", output_stream) -> None:
+    def __init__(self, input_stream: "JackTokenizer", output_stream,
+                 keep_tree: bool = True, backend=None,
+                 terminals=None, strict: bool = False) -> None:
         """
         Creates a new compilation engine with the given input and output. The
         next routine called must be compileClass()
         :param input_stream: The input stream.
-        :param output_stream: The output stream.
+        :param output_stream: The output stream, or None to only build the
+            parse tree (for other backends to use).
+        :param keep_tree: If False, every class-level declaration is handed
+            to the backend and dropped from the tree as soon as it has been
+            parsed, so memory stays bounded however long the class is.
+        :param backend: The backend to emit the tree with, defaults to an
+            XMLWriter of the output stream.
+        :param terminals: Tables of the shared terminals (see
+            ParseTree.terminal_tables), to share them between engines.
+        :param strict: If True, every token is checked against the grammar,
+            and the first one which does not fit fails the compilation with
+            a ValueError naming it and its line. Otherwise only the end of
+            the input is checked for, which is enough to guarantee that
+            every loop of the parser makes progress.
         """
         self.output_file = output_stream
         self.tokenizer = input_stream
+        if backend is None and output_stream is not None:
+            backend = XMLWriter(output_stream)
+        self.backend = backend
+        self.keep_tree = keep_tree or backend is None
+        # the root of the parse tree, available once compile_class() returns
+        self.tree = Node("class")
+        self.current = self.tree
+        self.parents = []  # type: typing.List[Node]
+        self.terminals = terminals if terminals is not None \
+            else terminal_tables()
+        # the terminal table of every kind of token (the kinds of tokens are
+        # the indices of their terminal kinds)
+        self.terminal_kinds = [self.terminals[kind] for kind in TERMINAL_KINDS]
+        # adds the current token, given what the grammar expects of it
+        self.expect = self.add_expected_token if strict else self.add_token
+        self.strict = strict
+        # what to compile, by the keyword (or the kind of token) starting it
+        self.class_compilers = {
+            "static": self.compile_class_var_dec,
+            "field": self.compile_class_var_dec,
+            "constructor": self.compile_subroutine,
+            "function": self.compile_subroutine,
+            "method": self.compile_subroutine,
+        }
+        self.statement_compilers = {
+            "let": self.compile_let,
+            "if": self.compile_if,
+            "while": self.compile_while,
+            "do": self.compile_do,
+            "return": self.compile_return,
+        }
+        self.term_compilers = {
+            INT_CONST: self.add_token,
+            STRING_CONST: self.add_token,
+            KEYWORD: self.compile_keyword_constant,
+            IDENTIFIER: self.compile_identifier_term,
+            SYMBOL: self.compile_symbol_term,
+            EOF: self.add_token,
+        }
 
     def compile_class(self) -> None:
         """Compiles a complete class."""
-        self.output_file.write("<class>\n")
         self.tokenizer.advance()
-        # class
-        self.write_keyword()
-        # class name
-        self.write_identifier()
-        # {
-        self.write_symbol()
-        while self.tokenizer.curr_token == "static" or self.tokenizer.curr_token == "field" or self.tokenizer.curr_token == "constructor" or \
-                self.tokenizer.curr_token == "method" or self.tokenizer.curr_token == "function":
-            if self.tokenizer.curr_token == "static" or self.tokenizer.curr_token == "field":
-                self.compile_class_var_dec()
-            elif self.tokenizer.curr_token == "constructor" or \
-                    self.tokenizer.curr_token == "method" or self.tokenizer.curr_token == "function":
-                self.compile_subroutine()
+        # class name {
+        self.expect("class")
+        self.expect(IDENTIFIER)
+        self.expect("{")
+        compilers = self.class_compilers
+        tokenizer = self.tokenizer
+        compiler = compilers.get(tokenizer.curr_token)
+        while compiler is not None and tokenizer.curr_kind == KEYWORD:
+            compiler()
+            compiler = compilers.get(tokenizer.curr_token)
         # }
-        self.write_symbol()
-        self.output_file.write("</class>\n")
+        self.expect("}")
+        if self.strict and self.tokenizer.curr_kind != EOF:
+            raise self.error("Expected end of input")
+        if self.backend is not None:
+            self.emit_tree()
+            self.backend.finish_class(self.tree)
 
     def compile_class_var_dec(self) -> None:
         """Compiles a static declaration or a field declaration."""
-        self.output_file.write("<classVarDec>\n")
-        # static/field
-        self.write_keyword()
-        # var type
-        if self.tokenizer.token_type() == "IDENTIFIER":
-            self.write_identifier()
-        else:
-            self.write_keyword()
-        while self.tokenizer.curr_token != ';':
-            if self.tokenizer.token_type() == 'IDENTIFIER':
-                # var name
-                self.write_identifier()
-            else:
-                # ,
-                self.write_symbol()
-        # ;
-        self.write_symbol()
-        self.output_file.write("</classVarDec>\n")
+        self.open_node("classVarDec")
+        # static/field type name
+        self.add_token()
+        self.expect(TYPES)
+        self.expect(IDENTIFIER)
+        self.compile_more_names()
+        self.expect(";")
+        self.close_node()
 
     def compile_subroutine(self) -> None:
         """
@@ -71,183 +139,149 @@ class CompilationEngine:
         You can assume that classes with constructors have at least one field,
         you will understand why this is necessary in project 11.
         """
-        self.output_file.write("<subroutineDec>\n")
-        if self.tokenizer.curr_token == "constructor":
-            # constructor
-            self.write_keyword()
-            self.write_identifier()
-            self.write_identifier()
-        if self.tokenizer.curr_token == "function" or self.tokenizer.curr_token == "method":
-            self.write_keyword()
-            if self.tokenizer.token_type() == "KEYWORD":
-                self.write_keyword()
-            elif self.tokenizer.token_type() == "IDENTIFIER":
-                self.write_identifier()
-            self.write_identifier()
-        # (
-        self.write_symbol()
+        self.open_node("subroutineDec")
+        # constructor/function/method type name (
+        self.add_token()
+        self.expect(RETURN_TYPES)
+        self.expect(IDENTIFIER)
+        self.expect("(")
         self.compile_parameter_list()
-        self.output_file.write("</parameterList>\n")
-        # )
-        self.write_symbol()
-        self.output_file.write("<subroutineBody>\n")
-        self.write_symbol()
-
-        # defines variables
-        while self.tokenizer.curr_token == "var":
+        self.expect(")")
+        self.open_node("subroutineBody")
+        self.expect("{")
+        tokenizer = self.tokenizer
+        while tokenizer.curr_token == "var" and tokenizer.curr_kind == KEYWORD:
             self.compile_var_dec()
-            # self.tokenizer.advance()
         self.compile_statements()
-        # }
-        self.write_symbol()
-        self.output_file.write("</subroutineBody>\n")
-        self.output_file.write("</subroutineDec>\n")
+        self.expect("}")
+        self.close_node()
+        self.close_node()
 
     def compile_parameter_list(self) -> None:
         """Compiles a (possibly empty) parameter list, not including the 
         enclosing "()".
         """
-        self.output_file.write("<parameterList>\n")
-        while self.tokenizer.curr_token != ")":
-            if self.tokenizer.token_type() == "KEYWORD":
-                self.write_keyword()
-            if self.tokenizer.token_type() == "IDENTIFIER":
-                self.write_identifier()
-            if self.tokenizer.curr_token == ',':
-                self.write_symbol()
+        self.open_node("parameterList")
+        if not self.at_symbol(")"):
+            self.expect(TYPES)
+            self.expect(IDENTIFIER)
+            while self.at_symbol(","):
+                self.add_token()
+                self.expect(TYPES)
+                self.expect(IDENTIFIER)
+        self.close_node()
 
     def compile_var_dec(self) -> None:
         """Compiles a var declaration."""
-        self.output_file.write("<varDec>\n")
-        self.write_keyword()
-        if self.tokenizer.token_type() == "IDENTIFIER":
-            self.write_identifier()
-        elif self.tokenizer.token_type() == "KEYWORD":
-            self.write_keyword()
-        while self.tokenizer.curr_token != ";":
-            if self.tokenizer.token_type() == "SYMBOL":
-                self.write_symbol()
-            else:
-                self.write_identifier()
-        self.write_symbol()
-        self.output_file.write("</varDec>\n")
+        self.open_node("varDec")
+        # var type name
+        self.add_token()
+        self.expect(TYPES)
+        self.expect(IDENTIFIER)
+        self.compile_more_names()
+        self.expect(";")
+        self.close_node()
+
+    def compile_more_names(self) -> None:
+        """Compiles the rest of a comma-separated list of variable names."""
+        while self.at_symbol(","):
+            self.add_token()
+            self.expect(IDENTIFIER)
 
     def compile_statements(self) -> None:
         """Compiles a sequence of statements, not including the enclosing 
         "{}".
         """
-        self.output_file.write("<statements>\n")
-        while self.tokenizer.token_type() == "KEYWORD":
-
-            if self.tokenizer.curr_token == "do":
-                self.compile_do()
-            if self.tokenizer.curr_token == "let":
-                self.compile_let()
-            if self.tokenizer.curr_token == "while":
-                self.compile_while()
-            if self.tokenizer.curr_token == "return":
-                self.compile_return()
-            if self.tokenizer.curr_token == "if":
-                self.compile_if()
-        self.output_file.write("</statements>\n")
+        self.open_node("statements")
+        compilers = self.statement_compilers
+        tokenizer = self.tokenizer
+        compiler = compilers.get(tokenizer.curr_token)
+        while compiler is not None and tokenizer.curr_kind == KEYWORD:
+            compiler()
+            compiler = compilers.get(tokenizer.curr_token)
+        self.close_node()
 
     def compile_do(self) -> None:
         """Compiles a do statement."""
-        self.output_file.write("<doStatement>\n")
-        # do
-        self.write_keyword()
-        # func name
-        self.write_identifier()
-        if self.tokenizer.curr_token == ".":
-            self.write_symbol()
-            self.write_identifier()
-        # ( ) ;
-        self.write_symbol()
-        self.compile_expression_list()
-        self.write_symbol()
-        self.write_symbol()
-        self.output_file.write("</doStatement>\n")
+        self.open_node("doStatement")
+        # do name
+        self.add_token()
+        self.expect(IDENTIFIER)
+        self.compile_call_rest()
+        self.expect(";")
+        self.close_node()
 
     def compile_let(self) -> None:
         """Compiles a let statement."""
-        self.output_file.write("<letStatement>\n")
-        # let
-        self.write_keyword()
-        # name
-        self.write_identifier()
-        if self.tokenizer.curr_token == '[':
-            self.write_symbol()
+        self.open_node("letStatement")
+        # let name
+        self.add_token()
+        self.expect(IDENTIFIER)
+        if self.at_symbol("["):
+            self.add_token()
             self.compile_expression()
-            self.write_symbol()
-        # =
-        self.write_symbol()
+            self.expect("]")
+        self.expect("=")
         self.compile_expression()
-        # ;
-        self.write_symbol()
-        self.output_file.write("</letStatement>\n")
+        self.expect(";")
+        self.close_node()
 
     def compile_while(self) -> None:
-        self.output_file.write("<whileStatement>\n")
+        """Compiles a while statement."""
+        self.open_node("whileStatement")
         # while
-        self.write_keyword()
-        # (
-        self.write_symbol()
-        self.compile_expression()
-        # )
-        self.write_symbol()
-        # {
-        self.write_symbol()
-        self.compile_statements()
-        # }
-        self.write_symbol()
-
-        self.output_file.write("</whileStatement>\n")
+        self.add_token()
+        self.compile_condition_and_block()
+        self.close_node()
 
     def compile_return(self) -> None:
         """Compiles a return statement."""
-        self.output_file.write("<returnStatement>\n")
-        self.write_keyword()
-        while self.tokenizer.curr_token != ";":
+        self.open_node("returnStatement")
+        # return
+        self.add_token()
+        if not self.at_symbol(";"):
             self.compile_expression()
-        self.write_symbol()
-        self.output_file.write("</returnStatement>\n")
+        self.expect(";")
+        self.close_node()
 
     def compile_if(self) -> None:
         """Compiles a if statement, possibly with a trailing else clause."""
-        self.output_file.write("<ifStatement>\n")
+        self.open_node("ifStatement")
         # if
-        self.write_keyword()
-        # (
-        self.write_symbol()
-        self.compile_expression()
-        # )
-        self.write_symbol()
-        # {
-        self.write_symbol()
-        self.compile_statements()
-        # }
-        self.write_symbol()
-        if self.tokenizer.curr_token == "else":
+        self.add_token()
+        self.compile_condition_and_block()
+        tokenizer = self.tokenizer
+        if tokenizer.curr_token == "else" and tokenizer.curr_kind == KEYWORD:
             # else
-            self.write_keyword()
-            # {
-            self.write_symbol()
+            self.add_token()
+            self.expect("{")
             self.compile_statements()
-            # }
-            self.write_symbol()
-        self.output_file.write("</ifStatement>\n")
+            self.expect("}")
+        self.close_node()
+
+    def compile_condition_and_block(self) -> None:
+        """Compiles the '(' expression ')' '{' statements '}' part of an if or
+        a while statement."""
+        self.expect("(")
+        self.compile_expression()
+        self.expect(")")
+        self.expect("{")
+        self.compile_statements()
+        self.expect("}")
 
     def compile_expression(self) -> None:
-        """Compiles an expression."""
-        self.output_file.write("<expression>\n")
-        exp = ["+", "-", "*", '/', '&', '|', '<', '>', '=']
+        """Compiles an expression. Jack gives all binary operators the same
+        precedence and applies them from left to right, so an expression is
+        a flat sequence of terms separated by operators.
+        """
+        self.open_node("expression")
         self.compile_term()
-        while self.tokenizer.curr_token in exp:
-            if self.tokenizer.token_type() == "SYMBOL":
-                self.write_symbol()
-            if self.tokenizer.token_type() != "SYMBOL" or self.tokenizer.curr_token == "(":
-                self.compile_term()
-        self.output_file.write("</expression>\n")
+        tokenizer = self.tokenizer
+        while tokenizer.curr_token in BINARY_OPS and \
+                tokenizer.curr_kind == SYMBOL:
+            self.add_token()
+            self.compile_term()
+        self.close_node()
 
     def compile_term(self) -> None:
         """Compiles a term. 
@@ -259,91 +293,414 @@ class CompilationEngine:
         to distinguish between the three possibilities. Any other token is not
         part of this term and should not be advanced over.
         """
+        self.open_node("term")
+        self.term_compilers[self.tokenizer.curr_kind]()
+        self.close_node()
 
-        self.output_file.write("<term>\n")
-        if self.tokenizer.token_type() == "INT_CONST":
-            self.write_int_const()
-        if self.tokenizer.token_type() == "STRING_CONST":
-            self.write_str_const()
-        if self.tokenizer.token_type() == "KEYWORD":
-            self.write_keyword()
-        if self.tokenizer.token_type() == "IDENTIFIER":
-            self.write_identifier()
-            if self.tokenizer.curr_token == '(':
-                # (
-                self.write_symbol()
-                self.compile_expression_list()
-                # self.tokenizer.advance()
-                # )
-                self.write_symbol()
-            if self.tokenizer.curr_token == '[':
-                # [
-                self.write_symbol()
-                self.compile_expression()
-                # self.tokenizer.advance()
-                # ]
-                self.write_symbol()
-            if self.tokenizer.curr_token == '.':
-                # .
-                self.write_symbol()
-                # name
-                self.write_identifier()
-                # (
-                self.write_symbol()
-                self.compile_expression_list()
-                # )
-                self.write_symbol()
-
-        if self.tokenizer.curr_token == '(':
-            # (
-            self.write_symbol()
+    def compile_identifier_term(self) -> None:
+        """Compiles a term starting with an identifier: a variable, an array
+        entry or a subroutine call, told apart by the token after the name,
+        which is peeked at before the name is consumed."""
+        kind, token = self.tokenizer.peek()
+        # name
+        self.add_token()
+        if kind != SYMBOL:
+            return
+        if token == "[":
+            self.add_token()
             self.compile_expression()
-            # )
-            self.write_symbol()
-        if self.tokenizer.curr_token == "~":
-            self.write_symbol()
+            self.expect("]")
+        elif token == "(" or token == ".":
+            self.compile_call_rest()
+
+    def compile_symbol_term(self) -> None:
+        """Compiles a term starting with a symbol: a parenthesized expression
+        or a unary operator applied to a term."""
+        token = self.tokenizer.curr_token
+        if token == "(":
+            self.add_token()
+            self.compile_expression()
+            self.expect(")")
+        elif token in UNARY_OPS:
+            self.add_token()
             self.compile_term()
-        self.output_file.write("</term>\n")
+        else:
+            raise self.error("Expected a term")
+
+    def compile_keyword_constant(self) -> None:
+        """Compiles a term which is a keyword constant."""
+        self.expect(KEYWORD_CONSTANTS)
+
+    def compile_call_rest(self) -> None:
+        """Compiles the rest of a subroutine call, after its first name:
+        ('.' name)? '(' expressionList ')'."""
+        if self.at_symbol("."):
+            self.add_token()
+            self.expect(IDENTIFIER)
+        self.expect("(")
+        self.compile_expression_list()
+        self.expect(")")
 
     def compile_expression_list(self) -> None:
         """Compiles a (possibly empty) comma-separated list of expressions."""
-        self.output_file.write("<expressionList>\n")
-        if self.tokenizer.curr_token != ")":
-            self.compile_expression()
-        while self.tokenizer.curr_token == ",":
-            self.write_symbol()
+        self.open_node("expressionList")
+        if not self.at_symbol(")"):
             self.compile_expression()
+            while self.at_symbol(","):
+                self.add_token()
+                self.compile_expression()
+        self.close_node()
 
-        self.output_file.write("</expressionList>\n")
+    def at_symbol(self, symbol: str) -> bool:
+        """
+        Returns:
+            bool: True if the current token is the given symbol.
+        """
+        tokenizer = self.tokenizer
+        return tokenizer.curr_token == symbol and \
+            tokenizer.curr_kind == SYMBOL
 
-    def write_keyword(self):
-        str_write = "<keyword> " + self.tokenizer.curr_token + " </keyword>\n"
-        self.output_file.write(str_write)
-        self.tokenizer.advance()
+    def open_node(self, kind: str) -> None:
+        """Starts a new non-terminal, nested in the current one."""
+        node = Node(kind)
+        self.current.children.append(node)
+        self.parents.append(self.current)
+        self.current = node
 
-    def write_identifier(self):
-        str_write = "<identifier> " + self.tokenizer.curr_token + " </identifier>\n"
-        self.output_file.write(str_write)
-        self.tokenizer.advance()
+    def close_node(self) -> None:
+        """Ends the current non-terminal."""
+        self.current = self.parents.pop()
+        if not self.keep_tree and self.current is self.tree:
+            self.emit_tree()
+
+    def emit_tree(self) -> None:
+        """Hands the children of the class parsed so far to the backend.
+        Unless the tree is kept, they are then dropped from it (this is only
+        done before the class is complete if the tree is not kept)."""
+        children = self.tree.children
+        self.backend.write_class_children(self.tree, children)
+        if not self.keep_tree:
+            children.clear()
+
+    def add_token(self, expected=None) -> None:
+        """Adds the current token to the current non-terminal, as a terminal
+        of its own kind, and advances. The end of the input cannot be added,
+        so every call makes progress (or fails).
+
+        Args:
+            expected: what the grammar expects of the token, only checked in
+                strict mode (see add_expected_token).
+        """
+        tokenizer = self.tokenizer
+        if tokenizer.curr_kind == EOF:
+            raise ValueError("Unexpected end of input in line %d"
+                             % tokenizer.line_number())
+        token = tokenizer.curr_token
+        terminals = self.terminal_kinds[tokenizer.curr_kind]
+        terminal = terminals.get(token)
+        if terminal is None:
+            terminal = terminals[token] = Terminal(
+                TERMINAL_KINDS[tokenizer.curr_kind], token)
+        self.current.children.append(terminal)
+        tokenizer.advance()
+
+    def add_expected_token(self, expected=None) -> None:
+        """Adds the current token like add_token(), after checking that it is
+        what the grammar expects.
+
+        Args:
+            expected: a keyword or symbol (str), a kind of token (int), a
+                frozenset of such alternatives, or None to accept any token.
+        """
+        if expected is not None:
+            tokenizer = self.tokenizer
+            kind = tokenizer.curr_kind
+            if type(expected) is frozenset:
+                matches = kind in expected if kind == IDENTIFIER else \
+                    tokenizer.curr_token in expected and \
+                    (kind == KEYWORD or kind == SYMBOL)
+            elif type(expected) is int:
+                matches = kind == expected
+            else:
+                matches = tokenizer.curr_token == expected and \
+                    (kind == KEYWORD or kind == SYMBOL)
+            if not matches:
+                raise self.error("Expected %s" % describe_expected(expected))
+        self.add_token()
+
+    def error(self, message: str) -> ValueError:
+        """
+        Returns:
+            ValueError: an error with the given message, describing the
+            current token and its line.
+        """
+        tokenizer = self.tokenizer
+        if tokenizer.curr_kind == EOF:
+            got = "end of input"
+        else:
+            got = "%r (%s)" % (tokenizer.curr_token,
+                               KIND_NAMES[tokenizer.curr_kind])
+        return ValueError("%s but got %s in line %d"
+                          % (message, got, tokenizer.line_number()))
 
-    def write_symbol(self):
+
+# the methods of the IterativeCompilationEngine which it pushes onto its stack
+PUSHED_STEPS = ("close_node", "step_statements", "step_more_statements",
+                "step_else", "step_expression", "step_expression_rest",
+                "step_term", "step_expression_list", "step_more_expressions")
+
+
+class IterativeCompilationEngine(CompilationEngine):
+    """A CompilationEngine which keeps its place in the grammar on an
+    explicit work stack instead of the Python call stack, so statements and
+    expressions may be nested tens of thousands of levels deep (the recursive
+    engine fails with a RecursionError after a few hundred). Its parse trees,
+    and so its output and its errors, are identical to those of the
+    recursive engine.
+
+    Every step of the parser consumes the tokens it can decide on right
+    away, and pushes the rest of its rule onto the work stack as callables,
+    the one to run first pushed last. A step only calls another one directly
+    where that cannot nest: a unary operator pushes its operand rather than
+    compiling it, and a call pushes its arguments.
+    """
+
+    def __init__(self, input_stream: "JackTokenizer", output_stream,
+                 keep_tree: bool = True, backend=None,
+                 terminals=None, strict: bool = False) -> None:
+        """Creates a new engine, see CompilationEngine."""
+        super().__init__(input_stream, output_stream, keep_tree, backend,
+                         terminals, strict)
+        # what remains to be compiled, the next step last
+        self.work = []  # type: typing.List[typing.Callable[[], None]]
+        self.push = self.work.append
+        # the steps which are pushed are bound once, instead of allocating a
+        # bound method on every push (which also triggers garbage collection
+        # far more often)
+        for name in PUSHED_STEPS:
+            setattr(self, name, getattr(self, name))
+        # steps which only add an expected symbol
+        self.expect_symbol = {symbol: functools.partial(self.expect, symbol)
+                              for symbol in "()[]{};="}
+        self.statement_steps = {
+            "let": self.step_let,
+            "if": self.step_if,
+            "while": self.step_while,
+            "do": self.step_do,
+            "return": self.step_return,
+        }
+        # the steps of terms, which close the term themselves
+        self.term_steps = {
+            INT_CONST: self.step_constant_term,
+            STRING_CONST: self.step_constant_term,
+            KEYWORD: self.step_constant_term,
+            IDENTIFIER: self.step_identifier_term,
+            SYMBOL: self.step_symbol_term,
+            EOF: self.step_constant_term,
+        }
+
+    def run(self, step: typing.Callable[[], None]) -> None:
+        """Runs a step, and then the work it leaves until it is complete."""
+        work = self.work
+        base = len(work)
+        step()
+        while len(work) > base:
+            work.pop()()
+
+    # the recursive rules, whose callers (the rules inherited from the
+    # recursive engine) now run on the work stack
+
+    def compile_statements(self) -> None:
+        """Compiles a sequence of statements, see CompilationEngine."""
+        self.run(self.step_statements)
+
+    def compile_expression(self) -> None:
+        """Compiles an expression, see CompilationEngine."""
+        self.run(self.step_expression)
+
+    def compile_term(self) -> None:
+        """Compiles a term, see CompilationEngine."""
+        self.run(self.step_term)
+
+    def compile_expression_list(self) -> None:
+        """Compiles an expression list, see CompilationEngine."""
+        self.run(self.step_expression_list)
+
+    def step_statements(self) -> None:
+        self.open_node("statements")
+        self.push(self.step_more_statements)
+
+    def step_more_statements(self) -> None:
+        tokenizer = self.tokenizer
+        step = self.statement_steps.get(tokenizer.curr_token)
+        if step is not None and tokenizer.curr_kind == KEYWORD:
+            self.push(self.step_more_statements)
+            step()
+        else:
+            self.close_node()
+
+    def step_let(self) -> None:
+        self.open_node("letStatement")
+        # let name
+        self.add_token()
+        self.expect(IDENTIFIER)
+        push = self.push
+        expect_symbol = self.expect_symbol
+        push(self.close_node)
+        push(expect_symbol[";"])
+        push(self.step_expression)
+        push(expect_symbol["="])
+        if self.at_symbol("["):
+            self.add_token()
+            push(expect_symbol["]"])
+            push(self.step_expression)
+
+    def step_if(self) -> None:
+        self.open_node("ifStatement")
+        # if
+        self.add_token()
+        self.push(self.step_else)
+        self.push_condition_and_block()
+
+    def step_else(self) -> None:
+        tokenizer = self.tokenizer
+        if tokenizer.curr_token == "else" and tokenizer.curr_kind == KEYWORD:
+            # else {
+            self.add_token()
+            self.expect("{")
+            push = self.push
+            push(self.close_node)
+            push(self.expect_symbol["}"])
+            push(self.step_statements)
+        else:
+            self.close_node()
+
+    def step_while(self) -> None:
+        self.open_node("whileStatement")
+        # while
+        self.add_token()
+        self.push(self.close_node)
+        self.push_condition_and_block()
+
+    def push_condition_and_block(self) -> None:
+        """Pushes the '(' expression ')' '{' statements '}' part of an if or
+        a while statement."""
+        push = self.push
+        expect_symbol = self.expect_symbol
+        push(expect_symbol["}"])
+        push(self.step_statements)
+        push(expect_symbol["{"])
+        push(expect_symbol[")"])
+        push(self.step_expression)
+        push(expect_symbol["("])
+
+    def step_do(self) -> None:
+        self.open_node("doStatement")
+        # do name
+        self.add_token()
+        self.expect(IDENTIFIER)
+        push = self.push
+        push(self.close_node)
+        push(self.expect_symbol[";"])
+        self.step_call_rest()
+
+    def step_return(self) -> None:
+        self.open_node("returnStatement")
+        # return
+        self.add_token()
+        push = self.push
+        push(self.close_node)
+        push(self.expect_symbol[";"])
+        if not self.at_symbol(";"):
+            push(self.step_expression)
+
+    def step_expression(self) -> None:
+        self.open_node("expression")
+        self.push(self.step_expression_rest)
+        self.step_term()
+
+    def step_expression_rest(self) -> None:
+        tokenizer = self.tokenizer
+        if tokenizer.curr_token in BINARY_OPS and \
+                tokenizer.curr_kind == SYMBOL:
+            self.add_token()
+            self.push(self.step_expression_rest)
+            self.step_term()
+        else:
+            self.close_node()
+
+    def step_term(self) -> None:
+        self.open_node("term")
+        self.term_steps[self.tokenizer.curr_kind]()
+
+    def step_constant_term(self) -> None:
+        self.term_compilers[self.tokenizer.curr_kind]()
+        self.close_node()
+
+    def step_identifier_term(self) -> None:
+        kind, token = self.tokenizer.peek()
+        # name
+        self.add_token()
+        if kind == SYMBOL and token == "[":
+            self.add_token()
+            push = self.push
+            push(self.close_node)
+            push(self.expect_symbol["]"])
+            push(self.step_expression)
+        elif kind == SYMBOL and (token == "(" or token == "."):
+            self.push(self.close_node)
+            self.step_call_rest()
+        else:
+            self.close_node()
+
+    def step_symbol_term(self) -> None:
         token = self.tokenizer.curr_token
-        if self.tokenizer.curr_token == "&":
-            token = " &amp;"
-        if self.tokenizer.curr_token == "<":
-            token = "&lt;"
-        if self.tokenizer.curr_token == ">":
-            token = " &gt;"
-        str_write = "<symbol> " + token + " </symbol>\n"
-        self.output_file.write(str_write)
-        self.tokenizer.advance()
+        if token == "(":
+            self.add_token()
+            push = self.push
+            push(self.close_node)
+            push(self.expect_symbol[")"])
+            push(self.step_expression)
+        elif token in UNARY_OPS:
+            self.add_token()
+            self.push(self.close_node)
+            self.push(self.step_term)
+        else:
+            raise self.error("Expected a term")
 
-    def write_int_const(self):
-        str_write = "<integerConstant> " + self.tokenizer.curr_token + " </integerConstant>\n"
-        self.output_file.write(str_write)
-        self.tokenizer.advance()
+    def step_call_rest(self) -> None:
+        if self.at_symbol("."):
+            self.add_token()
+            self.expect(IDENTIFIER)
+        self.expect("(")
+        self.push(self.expect_symbol[")"])
+        self.push(self.step_expression_list)
 
-    def write_str_const(self):
-        str_write = "<stringConstant> " + self.tokenizer.curr_token + " </stringConstant>\n"
-        self.output_file.write(str_write)
-        self.tokenizer.advance()
+    def step_expression_list(self) -> None:
+        self.open_node("expressionList")
+        if self.at_symbol(")"):
+            self.close_node()
+        else:
+            self.push(self.step_more_expressions)
+            self.step_expression()
+
+    def step_more_expressions(self) -> None:
+        if self.at_symbol(","):
+            self.add_token()
+            self.push(self.step_more_expressions)
+            self.step_expression()
+        else:
+            self.close_node()
+
+
+def describe_expected(expected) -> str:
+    """
+    Returns:
+        str: a description of what add_expected_token() expects.
+    """
+    if type(expected) is frozenset:
+        return " or ".join(sorted(describe_expected(alternative)
+                                  for alternative in expected))
+    if type(expected) is int:
+        return KIND_NAMES[expected]
+    return repr(expected)
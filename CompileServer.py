@@ -0,0 +1,510 @@
+"""
+A resident compile server on a Unix domain socket, and its client.
+
+Tools which run JackAnalyzer.py as a subprocess per file pay for starting
+an interpreter and loading the analyzer every time. The server is started
+once, and analyzes the sources it is sent in a pool of warm worker
+processes, answering any number of connections concurrently.
+
+Every message, in both directions, is a JSON object preceded by its length,
+as a 4 byte big-endian integer. A request is
+
+    {"id": any, "source": str, "target": "xml" or "vm", "optimize": bool,
+     "strict": bool, "max_tokens": int, "timeout": float}
+
+where everything but the source is optional (see AnalyzerOptions), and its
+response is {"id": ..., "output": str, "report": ...} or
+{"id": ..., "error": str}. A connection can carry any number of requests,
+and may send them without waiting for the responses: they are analyzed
+concurrently (up to MAX_IN_FLIGHT at a time), and answered in order.
+
+Usage:
+    CompileServer.py serve [--socket PATH] [-j JOBS]
+    CompileServer.py compile [--socket PATH] [--target vm] FILE...
+    CompileServer.py bench [-j JOBS] FILE...
+"""
+import argparse
+import asyncio
+import concurrent.futures
+import concurrent.futures.process
+import errno
+import json
+import os
+import signal
+import socket
+import stat
+import statistics
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+import typing
+from JackAnalyzer import AnalyzerOptions, TARGETS, analyze_sources, \
+    list_jack_files, output_path_for
+
+DEFAULT_SOCKET = os.path.join(tempfile.gettempdir(), "jack-compile.sock")
+# the length prefix of a message
+LENGTH = struct.Struct(">I")
+MAX_MESSAGE_SIZE = 1 << 26
+# the seconds a request may take unless it asks for less (or more)
+DEFAULT_TIMEOUT = 60.0
+# the requests of a connection which may be waiting for their responses at
+# once: the connection is not read any further until the oldest is answered
+MAX_IN_FLIGHT = 64
+
+
+def compile_request(request: typing.Dict[str, typing.Any]
+                    ) -> typing.Dict[str, typing.Any]:
+    """Analyzes the source of a request, in a worker process.
+
+    Args:
+        request (typing.Dict[str, typing.Any]): a request, see above.
+
+    Returns:
+        typing.Dict[str, typing.Any]: its response.
+    """
+    response = {"id": request.get("id")}
+    try:
+        source = request["source"]
+        if not isinstance(source, str):
+            raise ValueError("The source must be a string")
+        target = request.get("target", "xml")
+        if target not in TARGETS:
+            raise ValueError("Unknown target %r" % (target,))
+        if request.get("optimize") and target != "vm":
+            raise ValueError("optimize only applies to target vm")
+        options = AnalyzerOptions(
+            target=target, optimizing=bool(request.get("optimize")),
+            strict=bool(request.get("strict")),
+            max_tokens=request.get("max_tokens"),
+            timeout=request.get("timeout", DEFAULT_TIMEOUT))
+    except (KeyError, ValueError, TypeError) as error:
+        response["error"] = "Bad request: %s" % error
+        return response
+    result = analyze_sources([source], options)[0]
+    if result.error is not None:
+        response["error"] = result.error
+    else:
+        response["output"] = result.output
+        response["report"] = result.report
+    return response
+
+
+def init_worker() -> None:
+    """Undoes the signal handling of the server in a worker process forked
+    from it. Otherwise a worker which is terminated (e.g. when another one
+    dies) reports its SIGTERM to the server's event loop, stopping the
+    server, and SIGINT from the terminal interrupts the analysis of the
+    workers before the server shuts them down."""
+    signal.set_wakeup_fd(-1)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+class CompileServer:
+    """Answers the requests of its connections with a pool of workers."""
+
+    def __init__(self, socket_path: str = DEFAULT_SOCKET,
+                 jobs: int = os.cpu_count() or 1) -> None:
+        """
+        Args:
+            socket_path (str): where to listen.
+            jobs (int): number of worker processes.
+        """
+        self.socket_path = socket_path
+        self.jobs = jobs
+        self.pool = None  # type: typing.Optional[concurrent.futures.Executor]
+        # held while a broken pool is replaced
+        self.pool_lock = None  # type: typing.Optional[asyncio.Lock]
+
+    async def serve(self) -> None:
+        """Listens until SIGINT or SIGTERM, then removes the socket.
+
+        Raises:
+            OSError: if another server is listening on the socket, or its
+                path is taken by something other than a socket.
+        """
+        remove_stale_socket(self.socket_path)
+        loop = asyncio.get_running_loop()
+        stopped = asyncio.Event()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, stopped.set)
+        self.pool_lock = asyncio.Lock()
+        try:
+            await self.start_pool()
+            server = await asyncio.start_unix_server(
+                self.handle, path=self.socket_path)
+            try:
+                await stopped.wait()
+            finally:
+                server.close()
+                await server.wait_closed()
+                os.remove(self.socket_path)
+        finally:
+            self.pool.shutdown()
+
+    async def start_pool(self) -> None:
+        """Starts a new pool of workers, and waits until every one of them
+        has loaded the analyzer."""
+        loop = asyncio.get_running_loop()
+        self.pool = concurrent.futures.ProcessPoolExecutor(
+            self.jobs, initializer=init_worker)
+        await asyncio.gather(*(loop.run_in_executor(
+            self.pool, compile_request, {"source": ""})
+            for _ in range(self.jobs)))
+
+    async def replace_pool(self, broken: concurrent.futures.Executor
+                           ) -> None:
+        """Replaces a pool which a dead worker broke, unless another request
+        which failed in it already did."""
+        async with self.pool_lock:
+            if self.pool is broken:
+                broken.shutdown(wait=False)
+                await self.start_pool()
+
+    async def handle(self, reader: asyncio.StreamReader,
+                     writer: asyncio.StreamWriter) -> None:
+        """Answers the requests of a connection until it is closed. Requests
+        are read (and analyzed) without waiting for the responses of the
+        ones before them, and answered in order."""
+        pending = asyncio.Queue(MAX_IN_FLIGHT)  # type: asyncio.Queue
+        responder = asyncio.ensure_future(self.respond(pending, writer))
+        try:
+            while True:
+                try:
+                    request = await read_message(reader)
+                except ValueError as error:
+                    await pending.put(completed({"error": str(error)}))
+                    break
+                if request is None:
+                    break
+                await pending.put(asyncio.ensure_future(self.answer(request)))
+        except ConnectionError:
+            pass
+        finally:
+            await pending.put(None)
+            await responder
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    async def respond(self, pending: asyncio.Queue,
+                      writer: asyncio.StreamWriter) -> None:
+        """Writes the responses of a connection, in the order of its
+        requests, until None is queued."""
+        while True:
+            future = await pending.get()
+            if future is None:
+                return
+            response = await future
+            try:
+                writer.write(encode_message(response))
+                await writer.drain()
+            except ConnectionError:
+                # the client is gone, the rest is analyzed for nothing
+                pass
+
+    async def answer(self, request: typing.Any
+                     ) -> typing.Dict[str, typing.Any]:
+        """
+        Returns:
+            typing.Dict[str, typing.Any]: the response to a request.
+        """
+        if not isinstance(request, dict):
+            return {"id": None, "error": "Bad request: not an object"}
+        loop = asyncio.get_running_loop()
+        failure = None  # type: typing.Optional[Exception]
+        for _ in range(2):
+            pool = self.pool
+            try:
+                return await loop.run_in_executor(pool, compile_request,
+                                                  request)
+            except concurrent.futures.process.BrokenProcessPool as error:
+                # a worker died (e.g. it was killed, or ran out of memory),
+                # which fails every request of its pool: they are tried
+                # once more in a new pool
+                failure = error
+                await self.replace_pool(pool)
+            except Exception as error:
+                failure = error
+                break
+        return {"id": request.get("id"),
+                "error": "%s: %s" % (type(failure).__name__, failure)}
+
+
+def remove_stale_socket(socket_path: str) -> None:
+    """Removes the socket left behind by a server which was killed, if there
+    is one. A socket which a server still listens on is left alone.
+
+    Raises:
+        OSError: if a server listens on the socket, or the path is taken by
+            something other than a socket.
+    """
+    try:
+        mode = os.stat(socket_path).st_mode
+    except FileNotFoundError:
+        return
+    if not stat.S_ISSOCK(mode):
+        raise FileExistsError(errno.EEXIST, "Not a socket", socket_path)
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(socket_path)
+    except ConnectionRefusedError:
+        # nothing listens on it any more
+        os.remove(socket_path)
+        return
+    finally:
+        probe.close()
+    raise OSError(errno.EADDRINUSE, "Another server is listening on it",
+                  socket_path)
+
+
+class CompileClient:
+    """A blocking client of a CompileServer."""
+
+    def __init__(self, socket_path: str = DEFAULT_SOCKET) -> None:
+        """Connects to the server listening on the given socket."""
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.socket.connect(socket_path)
+        self.input = self.socket.makefile('rb')
+
+    def compile(self, source: str, **options: typing.Any
+                ) -> typing.Dict[str, typing.Any]:
+        """Analyzes a single source.
+
+        Args:
+            source (str): the source of a class.
+            options: any of the optional fields of a request.
+
+        Returns:
+            typing.Dict[str, typing.Any]: the response.
+        """
+        return self.compile_many([source], **options)[0]
+
+    def compile_many(self, sources: typing.List[str], **options: typing.Any
+                     ) -> typing.List[typing.Dict[str, typing.Any]]:
+        """Sends the requests without waiting for their responses, so the
+        server analyzes them concurrently, then reads the responses.
+
+        Returns:
+            typing.List[typing.Dict[str, typing.Any]]: the responses, in the
+            order of the sources.
+        """
+        requests = [encode_message(dict(options, id=index, source=source))
+                    for index, source in enumerate(sources)]
+        responses = []
+        sent = 0
+        while len(responses) < len(requests):
+            # no more than MAX_IN_FLIGHT requests wait for their responses,
+            # as the server stops reading beyond that until they are read
+            window = requests[sent:len(responses) + MAX_IN_FLIGHT]
+            if window:
+                self.socket.sendall(b"".join(window))
+                sent += len(window)
+            header = self.input.read(LENGTH.size)
+            if len(header) < LENGTH.size:
+                raise ConnectionError("The server closed the connection")
+            size, = LENGTH.unpack(header)
+            responses.append(json.loads(self.input.read(size)))
+        return responses
+
+    def close(self) -> None:
+        self.input.close()
+        self.socket.close()
+
+    def __enter__(self) -> "CompileClient":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+async def read_message(reader: asyncio.StreamReader) -> typing.Any:
+    """
+    Returns:
+        typing.Any: the next message, or None at the end of the stream.
+
+    Raises:
+        ValueError: if the message is too large or is not JSON.
+    """
+    try:
+        header = await reader.readexactly(LENGTH.size)
+    except asyncio.IncompleteReadError:
+        return None
+    size, = LENGTH.unpack(header)
+    if size > MAX_MESSAGE_SIZE:
+        raise ValueError("Message of %d bytes, the limit is %d"
+                         % (size, MAX_MESSAGE_SIZE))
+    try:
+        return json.loads(await reader.readexactly(size))
+    except asyncio.IncompleteReadError:
+        return None
+
+
+def encode_message(message: typing.Any) -> bytes:
+    """
+    Returns:
+        bytes: the message as JSON, with its length prefix.
+    """
+    payload = json.dumps(message).encode()
+    return LENGTH.pack(len(payload)) + payload
+
+
+def completed(result: typing.Any) -> asyncio.Future:
+    """
+    Returns:
+        asyncio.Future: a future which already has the given result.
+    """
+    future = asyncio.get_running_loop().create_future()
+    future.set_result(result)
+    return future
+
+
+def compile_files(input_paths: typing.List[str], socket_path: str,
+                  **options: typing.Any) -> int:
+    """Analyzes files with a running server, writing every output next to
+    its source like JackAnalyzer does.
+
+    Returns:
+        int: the number of files which failed.
+    """
+    sources = []
+    for input_path in input_paths:
+        with open(input_path, 'r') as input_file:
+            sources.append(input_file.read())
+    with CompileClient(socket_path) as client:
+        responses = client.compile_many(sources, **options)
+    failed = 0
+    for input_path, response in zip(input_paths, responses):
+        if "error" in response:
+            print("%s: %s" % (input_path, response["error"]),
+                  file=sys.stderr)
+            failed += 1
+            continue
+        output_path = output_path_for(input_path,
+                                      options.get("target", "xml"))
+        with open(output_path, 'w') as output_file:
+            output_file.write(response["output"])
+    return failed
+
+
+def benchmark(input_paths: typing.List[str], jobs: int
+              ) -> typing.Dict[str, typing.Dict[str, float]]:
+    """Compares the latency and throughput of analyzing files with a
+    subprocess per file, and with a server (one request at a time, and all
+    requests at once).
+
+    Returns:
+        typing.Dict[str, typing.Dict[str, float]]: for every approach, the
+        median and mean latency of a file (in milliseconds) and the number
+        of files analyzed per second.
+    """
+    analyzer = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            "JackAnalyzer.py")
+    sources = []
+    for input_path in input_paths:
+        with open(input_path, 'r') as input_file:
+            sources.append(input_file.read())
+    results = {}
+    latencies = []
+    start = time.perf_counter()
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for index, source in enumerate(sources):
+            path = os.path.join(temp_dir, "File%d.jack" % index)
+            with open(path, 'w') as source_file:
+                source_file.write(source)
+            file_start = time.perf_counter()
+            subprocess.run([sys.executable, analyzer, "-j", "1",
+                            path], check=True, stdout=subprocess.DEVNULL)
+            latencies.append(time.perf_counter() - file_start)
+    results["subprocess"] = timings(latencies,
+                                    time.perf_counter() - start)
+    with tempfile.TemporaryDirectory() as temp_dir:
+        socket_path = os.path.join(temp_dir, "server.sock")
+        server = subprocess.Popen([sys.executable, os.path.abspath(__file__),
+                                   "serve", "--socket", socket_path,
+                                   "-j", str(jobs)])
+        try:
+            while not os.path.exists(socket_path):
+                if server.poll() is not None:
+                    raise RuntimeError("The server did not start")
+                time.sleep(0.01)
+            with CompileClient(socket_path) as client:
+                latencies = []
+                start = time.perf_counter()
+                for source in sources:
+                    file_start = time.perf_counter()
+                    client.compile(source)
+                    latencies.append(time.perf_counter() - file_start)
+                results["server"] = timings(latencies,
+                                            time.perf_counter() - start)
+                start = time.perf_counter()
+                client.compile_many(sources)
+                seconds = time.perf_counter() - start
+                results["server_pipelined"] = timings(
+                    [seconds / len(sources)] * len(sources), seconds)
+        finally:
+            server.terminate()
+            server.wait()
+    return results
+
+
+def timings(latencies: typing.List[float], seconds: float
+            ) -> typing.Dict[str, float]:
+    return {"median_ms": statistics.median(latencies) * 1000,
+            "mean_ms": statistics.mean(latencies) * 1000,
+            "files_per_second": len(latencies) / seconds}
+
+
+if "__main__" == __name__:
+    parser = argparse.ArgumentParser(
+        prog="CompileServer",
+        description="A resident compile server for Jack files, and its "
+                    "client.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    serve_parser = commands.add_parser("serve", help="run the server")
+    compile_parser = commands.add_parser(
+        "compile", help="analyze files with a running server")
+    bench_parser = commands.add_parser(
+        "bench", help="compare the server with a subprocess per file")
+    for command_parser in (serve_parser, compile_parser):
+        command_parser.add_argument("--socket", default=DEFAULT_SOCKET,
+                                    help="the socket of the server "
+                                         "(default: %s)" % DEFAULT_SOCKET)
+    for command_parser in (serve_parser, bench_parser):
+        command_parser.add_argument("-j", "--jobs", type=int,
+                                    default=os.cpu_count() or 1,
+                                    help="number of worker processes")
+    for command_parser in (compile_parser, bench_parser):
+        command_parser.add_argument("input_paths", nargs="+",
+                                    help=".jack files or directories")
+    compile_parser.add_argument("--target", choices=TARGETS)
+    compile_parser.add_argument("-O", "--optimize", action="store_true",
+                                help="optimize the VM code (implies --target "
+                                     "vm)")
+    compile_parser.add_argument("--strict", action="store_true")
+    args = parser.parse_args()
+    if args.command == "compile":
+        if args.target is None:
+            args.target = "vm" if args.optimize else "xml"
+        elif args.optimize and args.target != "vm":
+            compile_parser.error("-O only applies to --target vm")
+    if args.command == "serve":
+        try:
+            asyncio.run(CompileServer(args.socket, args.jobs).serve())
+        except OSError as error:
+            sys.exit("Cannot serve on %s: %s" % (args.socket, error))
+        sys.exit()
+    input_paths = [path for argument in args.input_paths
+                   for path in list_jack_files(os.path.abspath(argument))]
+    if args.command == "compile":
+        failed = compile_files(input_paths, args.socket, target=args.target,
+                               optimize=args.optimize, strict=args.strict)
+        if failed:
+            sys.exit("%d of %d files failed" % (failed, len(input_paths)))
+    else:
+        json.dump(benchmark(input_paths, args.jobs), sys.stdout, indent=2)
+        print()
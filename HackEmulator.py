@@ -0,0 +1,504 @@
+"""
+Runs Hack machine code in-process and headlessly, and profiles it: how many
+cycles every function of the program (every label which names a VM
+function) took.
+
+Programs are assembled (or loaded from .hack files) into a ROM of 16-bit
+words, and the ROM is decoded once: every basic block (a run of
+instructions ending with a jump) is compiled into a Python function when it
+is first reached, which runs its instructions on the A and D registers and
+a flat RAM, and returns the address it jumps to. Blocks also end before
+every function label, so the cycles of a block all belong to one function,
+and profiling costs a counter per block rather than per instruction.
+
+The shift instructions of the extended ALU (D<<, A>>, M>> ...) are
+supported. A program halts when it reaches a jump to itself (the usual end
+loop) or Sys.halt, jumps out of the ROM, or runs out of cycles.
+
+Usage: HackEmulator.py PATH [--cycles N], where PATH is a .hack or .asm
+file, a .vm file or a directory of .vm files (which are translated with
+the bootstrap code first).
+"""
+import argparse
+import bisect
+import json
+import os
+import sys
+import time
+import typing
+from VMTranslator import VMTranslator, list_vm_files
+
+WORD_MASK = 0xFFFF
+SIGN_BIT = 0x8000
+# the RAM is as large as the addresses A can hold, so that no address is out
+# of range; only the first 24577 words (up to the keyboard) are the Hack's
+RAM_SIZE = 1 << 16
+DEFAULT_CYCLES = 10 ** 7
+PREDEFINED = {"SP": 0, "LCL": 1, "ARG": 2, "THIS": 3, "THAT": 4,
+              "SCREEN": 16384, "KBD": 24576}
+PREDEFINED.update(("R%d" % register, register) for register in range(16))
+FIRST_VARIABLE = 16
+# the OS subroutine which ends a Jack program, by spinning forever
+HALT_LABELS = ("Sys.halt",)
+# the profile row of the code before the first function label
+UNLABELED = "(unlabeled)"
+
+# the a-bit and c-bits of every computation, with "X" for A (a=0) or M (a=1)
+COMPUTATIONS = {
+    "0": "101010", "1": "111111", "-1": "111010", "D": "001100",
+    "X": "110000", "!D": "001101", "!X": "110001", "-D": "001111",
+    "-X": "110011", "D+1": "011111", "X+1": "110111", "D-1": "001110",
+    "X-1": "110010", "D+X": "000010", "D-X": "010011", "X-D": "000111",
+    "D&X": "000000", "D|X": "010101",
+}
+# the computations of the extended ALU, which start with 101 rather than 111
+SHIFTS = {"A<<": "0100000", "D<<": "0110000", "M<<": "1100000",
+          "A>>": "0000000", "D>>": "0010000", "M>>": "1000000"}
+# the same computations in Python, on unsigned 16-bit values
+EXPRESSIONS = {
+    "0": "0", "1": "1", "-1": "65535", "D": "D", "X": "X", "!D": "D ^ 65535",
+    "!X": "X ^ 65535", "-D": "-D & 65535", "-X": "-X & 65535",
+    "D+1": "(D + 1) & 65535", "X+1": "(X + 1) & 65535",
+    "D-1": "(D - 1) & 65535", "X-1": "(X - 1) & 65535",
+    "D+X": "(D + X) & 65535", "D-X": "(D - X) & 65535",
+    "X-D": "(X - D) & 65535", "D&X": "D & X", "D|X": "D | X",
+    "X<<": "(X << 1) & 65535", "X>>": "X >> 1 | X & 32768",
+}
+JUMPS = ("", "JGT", "JEQ", "JGE", "JLT", "JNE", "JLE", "JMP")
+# when a jump is taken, in Python, on the unsigned value v
+CONDITIONS = ("False", "0 < v < 32768", "v == 0", "v < 32768", "v > 32767",
+              "v != 0", "v == 0 or v > 32767", "True")
+DESTINATIONS = ("", "M", "D", "MD", "A", "AM", "AD", "AMD")
+
+
+def computation_codes() -> typing.Dict[str, int]:
+    """
+    Returns:
+        typing.Dict[str, int]: the bits 15-6 of the C-instruction of every
+        computation, including the commutative variants (e.g. both D+A and
+        A+D).
+    """
+    codes = {}
+    for computation, bits in COMPUTATIONS.items():
+        for register, a_bit in (("A", "0"), ("M", "1")):
+            if "X" not in computation and a_bit == "1":
+                # e.g. D+1 does not read A or M, and is assembled with a=0
+                continue
+            code = int("111" + a_bit + bits, 2)
+            codes[computation.replace("X", register)] = code
+            if computation[1:2] in ("+", "&", "|") and \
+                    computation[2:] not in ("1", ""):
+                codes[(computation[2] + computation[1] + computation[0])
+                      .replace("X", register)] = code
+    for computation, bits in SHIFTS.items():
+        codes[computation] = int("101" + bits, 2)
+    return codes
+
+
+def decoded_expressions() -> typing.Dict[int, str]:
+    """
+    Returns:
+        typing.Dict[int, str]: the Python expression of every computation,
+        by the bits 15-6 of its C-instruction.
+    """
+    expressions = {}
+    for computation, bits in COMPUTATIONS.items():
+        for operand, a_bit in (("A", "0"), ("ram[A]", "1")):
+            expressions[int("111" + a_bit + bits, 2)] = \
+                EXPRESSIONS[computation].replace("X", operand)
+    for computation, bits in SHIFTS.items():
+        operand = {"A": "A", "D": "D", "M": "ram[A]"}[computation[0]]
+        expressions[int("101" + bits, 2)] = \
+            EXPRESSIONS["X" + computation[1:]].replace("X", operand)
+    return expressions
+
+
+CODES = computation_codes()
+DECODED = decoded_expressions()
+
+
+class Program(typing.NamedTuple):
+    """An assembled program."""
+    rom: typing.List[int]
+    # the address of every label
+    labels: typing.Dict[str, int]
+
+
+class Halted(Exception):
+    """Raised by a block which jumps to itself and changes nothing."""
+
+
+def assemble(source: str) -> Program:
+    """Assembles a Hack assembly program.
+
+    Args:
+        source (str): the program.
+
+    Returns:
+        Program: its machine code and labels.
+    """
+    instructions = []
+    labels = {}
+    for line, text in enumerate(source.splitlines(), 1):
+        text = text.split("//", 1)[0].replace(" ", "").replace("\t", "")
+        if not text:
+            continue
+        if text[0] == "(":
+            if text[-1] != ")" or len(text) < 3:
+                raise ValueError("Malformed label '%s' in line %d"
+                                 % (text, line))
+            labels[text[1:-1]] = len(instructions)
+        else:
+            instructions.append((line, text))
+    symbols = dict(PREDEFINED)
+    symbols.update(labels)
+    next_variable = FIRST_VARIABLE
+    rom = []
+    for line, text in instructions:
+        if text[0] == "@":
+            value = text[1:]
+            if value.isdigit():
+                address = int(value)
+                if address > 0x7FFF:
+                    raise ValueError("Constant %d is too large in line %d"
+                                     % (address, line))
+            else:
+                address = symbols.get(value)
+                if address is None:
+                    address = symbols[value] = next_variable
+                    next_variable += 1
+            rom.append(address)
+            continue
+        destination, _, computation = text.rpartition("=")
+        computation, _, jump = computation.partition(";")
+        code = CODES.get(computation)
+        if code is None or jump not in JUMPS or \
+                set(destination) - set("AMD") or \
+                len(set(destination)) != len(destination):
+            raise ValueError("Malformed instruction '%s' in line %d"
+                             % (text, line))
+        dest_bits = sum(bit for register, bit in (("A", 4), ("D", 2),
+                                                  ("M", 1))
+                        if register in destination)
+        rom.append(code << 6 | dest_bits << 3 | JUMPS.index(jump))
+    return Program(rom, labels)
+
+
+def read_hack(source: str) -> Program:
+    """
+    Args:
+        source (str): a .hack file, one binary instruction per line.
+
+    Returns:
+        Program: its machine code, without labels.
+    """
+    rom = []
+    for line, text in enumerate(source.split(), 1):
+        if len(text) != 16 or set(text) - set("01"):
+            raise ValueError("Malformed instruction '%s' in line %d"
+                             % (text, line))
+        rom.append(int(text, 2))
+    return Program(rom, {})
+
+
+def load_program(path: str) -> Program:
+    """
+    Args:
+        path (str): a .hack or .asm file, a .vm file, or a directory of .vm
+            files which are translated (with the bootstrap code) first.
+
+    Returns:
+        Program: the assembled program.
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if os.path.isdir(path) or extension == ".vm":
+        translator = VMTranslator()
+        if os.path.isdir(path):
+            translator.write_bootstrap()
+        for vm_path in list_vm_files(path):
+            with open(vm_path, 'r') as vm_file:
+                translator.translate(
+                    os.path.splitext(os.path.basename(vm_path))[0],
+                    vm_file.read())
+        translator.finish()
+        return assemble("\n".join(translator.lines))
+    with open(path, 'r') as program_file:
+        source = program_file.read()
+    return read_hack(source) if extension == ".hack" else assemble(source)
+
+
+def function_labels(labels: typing.Dict[str, int]
+                    ) -> typing.List[typing.Tuple[int, str]]:
+    """
+    Args:
+        labels (typing.Dict[str, int]): the labels of a program.
+
+    Returns:
+        typing.List[typing.Tuple[int, str]]: the address and name of every
+        function label, sorted by address: the labels of VM functions (e.g.
+        "Main.main", but not the labels inside them, which contain a '$'),
+        and of the stubs of the VMTranslator (e.g. "$$CALL").
+    """
+    functions = {}
+    for label, address in labels.items():
+        if label.startswith("$$"):
+            # the parts of a stub belong to it
+            functions.setdefault(label.split(".", 1)[0], address)
+        elif "$" not in label:
+            functions[label] = address
+    return sorted((address, name) for name, address in functions.items())
+
+
+class HackMachine:
+    """A Hack computer, without its screen and keyboard."""
+
+    def __init__(self, program: Program,
+                 halt_labels: typing.Iterable[str] = HALT_LABELS) -> None:
+        """
+        Args:
+            program (Program): the program to run.
+            halt_labels (typing.Iterable[str]): labels at which the program
+                halts when it reaches them (those it does not have are
+                ignored).
+        """
+        self.rom = program.rom
+        self.ram = [0] * RAM_SIZE
+        self.a_register = 0
+        self.d_register = 0
+        self.pc = 0
+        self.cycles = 0
+        self.halted = False
+        self.functions = function_labels(program.labels)
+        self.halts = {program.labels[label] for label in halt_labels
+                      if label in program.labels}
+        self.boundaries = {address for address, _ in self.functions}
+        self.boundaries.update(self.halts)
+        # the compiled block starting at every address, its number of
+        # instructions, and how many times it ran
+        self.blocks = [None] * len(self.rom)  # type: typing.List[typing.Optional[typing.Callable]]
+        self.lengths = [0] * len(self.rom)
+        self.hits = [0] * len(self.rom)
+
+    def run(self, max_cycles: int = DEFAULT_CYCLES) -> int:
+        """Runs the program until it halts, or for about max_cycles cycles
+        (it stops at the end of a block).
+
+        Returns:
+            int: the number of cycles run.
+        """
+        ram = self.ram
+        blocks = self.blocks
+        lengths = self.lengths
+        hits = self.hits
+        size = len(self.rom)
+        pc, a_register, d_register = self.pc, self.a_register, \
+            self.d_register
+        start = cycles = self.cycles
+        limit = cycles + max_cycles
+        try:
+            while cycles < limit:
+                if pc >= size:
+                    self.halted = True
+                    break
+                block = blocks[pc]
+                if block is None:
+                    block = self.compile(pc)
+                hits[pc] += 1
+                cycles += lengths[pc]
+                pc, a_register, d_register = block(ram, a_register,
+                                                   d_register)
+        except Halted:
+            self.halted = True
+        self.pc, self.a_register, self.d_register = pc, a_register, \
+            d_register
+        self.cycles = cycles
+        return cycles - start
+
+    def compile(self, entry: int) -> typing.Callable:
+        """Compiles the block starting at an address.
+
+        Returns:
+            typing.Callable: a function of the RAM and of A and D, which runs
+            the block and returns the address it jumps to, and A and D.
+        """
+        rom = self.rom
+        # a halt label halts the program before its first instruction
+        body = ["raise Halted"] if entry in self.halts else []
+        address = entry
+        while entry not in self.halts:
+            word = rom[address]
+            address += 1
+            if word < SIGN_BIT:
+                body.append("A = %d" % word)
+            else:
+                if address == entry + 2 and rom[entry] == entry and \
+                        word & 0x3F == 7:
+                    # an end loop: a jump to itself which writes nothing
+                    body.append("raise Halted")
+                    break
+                body.extend(decode(word, address))
+                if word & 7:
+                    break
+            if address >= len(rom) or address in self.boundaries:
+                body.append("return %d, A, D" % address)
+                break
+        source = "def block(ram, A, D):\n    " + "\n    ".join(body)
+        namespace = {"Halted": Halted}
+        exec(compile(source, "<block %d>" % entry, "exec"), namespace)
+        block = namespace["block"]
+        self.blocks[entry] = block
+        self.lengths[entry] = address - entry
+        return block
+
+    def profile(self) -> typing.Dict[str, typing.Any]:
+        """
+        Returns:
+            typing.Dict[str, typing.Any]: the number of cycles run, whether
+            the program halted, and the cycles of every function, most
+            expensive first.
+        """
+        addresses = [address for address, _ in self.functions]
+        names = [name for _, name in self.functions]
+        cycles = {}  # type: typing.Dict[str, int]
+        for entry, hits in enumerate(self.hits):
+            if hits:
+                position = bisect.bisect_right(addresses, entry) - 1
+                name = names[position] if position >= 0 else UNLABELED
+                cycles[name] = cycles.get(name, 0) + hits * self.lengths[entry]
+        total = sum(cycles.values()) or 1
+        return {"cycles": self.cycles, "halted": self.halted,
+                "functions": {
+                    name: {"cycles": count,
+                           "share": round(count / total, 6)}
+                    for name, count in sorted(cycles.items(),
+                                              key=lambda item: -item[1])}}
+
+
+def decode(word: int, next_address: int) -> typing.List[str]:
+    """
+    Args:
+        word (int): a C-instruction.
+        next_address (int): the address after it.
+
+    Returns:
+        typing.List[str]: the Python statements which run the instruction.
+        An instruction which jumps returns from the block.
+    """
+    expression = DECODED.get(word >> 6)
+    if expression is None:
+        raise ValueError("Invalid instruction %s at address %d"
+                         % (format(word, "016b"), next_address - 1))
+    destination = DESTINATIONS[(word >> 3) & 7]
+    jump = word & 7
+    if not jump and len(destination) <= 1:
+        if destination == "M":
+            return ["ram[A] = " + expression]
+        return ["%s = %s" % (destination, expression)] if destination \
+            else []
+    statements = ["v = " + expression]
+    if jump and "A" in destination:
+        # the jump goes to the address A held before the instruction
+        statements.append("j = A")
+    # M is written first, at the address A held before the instruction
+    statements.extend("%s = v" % ("ram[A]" if register == "M" else register)
+                      for register in "MDA" if register in destination)
+    target = "j" if "A" in destination else "A"
+    if jump == 7:
+        statements.append("return %s, A, D" % target)
+    elif jump:
+        statements.append("if %s:\n        return %s, A, D" % (
+            CONDITIONS[jump], target))
+        statements.append("return %d, A, D" % next_address)
+    return statements
+
+
+def print_profile(profile: typing.Dict[str, typing.Any], seconds: float,
+                  top: int = 20) -> None:
+    """Prints the most expensive functions of a profile, and the speed of
+    the emulation."""
+    functions = list(profile["functions"].items())
+    if functions:
+        width = max(len(name) for name, _ in functions[:top])
+        for name, entry in functions[:top]:
+            print("%-*s %12d cycles %6.2f%%"
+                  % (width, name, entry["cycles"], 100 * entry["share"]))
+        if len(functions) > top:
+            print("(%d more functions)" % (len(functions) - top))
+    print("%d cycles%s in %.2f s (%.1f M cycles/s)" % (
+        profile["cycles"], ", halted" if profile["halted"] else "",
+        seconds, profile["cycles"] / seconds / 1e6 if seconds else 0.0))
+
+
+def print_comparison(before: typing.Dict[str, typing.Any],
+                     after: typing.Dict[str, typing.Any], top: int = 20
+                     ) -> None:
+    """Prints how the cycles of every function, and in total, changed
+    between two profiles of a program, e.g. of two builds of it."""
+    rows = []
+    for name in dict.fromkeys(list(after["functions"]) +
+                              list(before["functions"])):
+        old = before["functions"].get(name, {}).get("cycles", 0)
+        new = after["functions"].get(name, {}).get("cycles", 0)
+        rows.append((name, old, new))
+    rows.sort(key=lambda row: -abs(row[2] - row[1]))
+    rows = rows[:top]
+    rows.append(("total", before["cycles"], after["cycles"]))
+    width = max(len(row[0]) for row in rows)
+    for name, old, new in rows:
+        print("%-*s %12d -> %12d cycles (%+.1f%%)" % (
+            width, name, old, new,
+            100.0 * (new - old) / old if old else 0.0))
+
+
+def parse_assignment(text: str) -> typing.Tuple[int, int]:
+    """Parses ADDRESS=VALUE (for --ram)."""
+    address, _, value = text.partition("=")
+    return int(address), int(value) & WORD_MASK
+
+
+if "__main__" == __name__:
+    parser = argparse.ArgumentParser(
+        prog="HackEmulator",
+        description="Runs a Hack program headlessly, and reports the cycles "
+                    "of every function.")
+    parser.add_argument("input_path",
+                        help="a .hack, .asm or .vm file, or a directory of "
+                             ".vm files")
+    parser.add_argument("--cycles", type=int, default=DEFAULT_CYCLES,
+                        help="stop after this many cycles (default: %d)"
+                             % DEFAULT_CYCLES)
+    parser.add_argument("--ram", metavar="ADDRESS=VALUE",
+                        type=parse_assignment, action="append", default=[],
+                        help="set a word of the RAM before running, e.g. "
+                             "0=256 for programs without the bootstrap code")
+    parser.add_argument("--top", type=int, default=20,
+                        help="number of functions to print (default: 20)")
+    parser.add_argument("--output", metavar="FILE",
+                        help="write the profile, with the timing, to FILE as "
+                             "JSON ('-' for standard output)")
+    parser.add_argument("--compare", metavar="FILE",
+                        help="compare the cycles with those of a profile "
+                             "written by --output, e.g. of another build")
+    args = parser.parse_args()
+    try:
+        machine = HackMachine(load_program(args.input_path))
+    except (OSError, ValueError) as error:
+        sys.exit(str(error))
+    for ram_address, ram_value in args.ram:
+        machine.ram[ram_address] = ram_value
+    start = time.perf_counter()
+    machine.run(args.cycles)
+    elapsed = time.perf_counter() - start
+    result = machine.profile()
+    result["seconds"] = elapsed
+    if args.output == "-":
+        json.dump(result, sys.stdout, indent=2)
+        print()
+    else:
+        print_profile(result, elapsed, args.top)
+        if args.output is not None:
+            with open(args.output, 'w') as output_file:
+                json.dump(result, output_file, indent=2)
+    if args.compare is not None:
+        with open(args.compare, 'r') as baseline_file:
+            print_comparison(json.load(baseline_file), result, args.top)
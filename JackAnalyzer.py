@@ -5,28 +5,710 @@ was written by Aviv Yaish. It is an extension to the specifications given
 as allowed by the Creative Common Attribution-NonCommercial-ShareAlike 3.0
 Unported [License](https://creativecommons.org/licenses/by-nc-sa/3.0/).
 """
+import argparse
+import concurrent.futures
+import contextlib
+import functools
+import hashlib
+import io
+import json
 import os
+import signal
 import sys
+import threading
+import time
 import typing
-from CompilationEngine import CompilationEngine
-from JackTokenizer import JackTokenizer
+from BuildCache import BuildCache, DEFAULT_MAX_ENTRIES
+from CodeGenerator import CodeGenerator
+from CompilationEngine import CompilationEngine, IterativeCompilationEngine
+from HackEmulator import HackMachine, load_program, print_profile
+from JackTokenizer import JackTokenizer, StreamingJackTokenizer
+from ParseTree import terminal_tables
+from Profiler import FileProfile, ProfilingBackend, summarize
+from ProgramIndex import ClassEntry, ClassIndexer, ProgramIndex, \
+    ENTRY_POINT, SYS_ENTRY_POINT
+from TokenCache import cached_scan, sidecar_path
+from VMTranslator import ROM_SIZE, asm_path_for, list_vm_files, \
+    print_sizes, translate_paths
+from XMLCompare import compare_pairs, print_comparisons
+from XMLWriter import XMLWriter
+from remove_spaces import normalize_paths, print_statuses
+
+# the kinds of output the analyzer can produce (and their file extensions)
+TARGETS = ("xml", "vm")
+# seconds between two polls of the input files in watch mode
+WATCH_INTERVAL = 0.5
+# the modules which shape the outputs kept in the build cache (and their
+# reports), see analyzer_version
+ANALYZER_MODULES = ("BuildCache", "CodeGenerator", "CompilationEngine",
+                    "JackAnalyzer", "JackTokenizer", "ParseTree", "Profiler",
+                    "ProgramIndex", "SymbolTable", "TokenCache", "VMOptimizer",
+                    "VMWriter", "XMLWriter")
+
+
+class AnalyzerOptions(typing.NamedTuple):
+    """How files are analyzed, see analyze_file."""
+    streaming: bool = False
+    target: str = "xml"
+    optimizing: bool = False
+    profiling: bool = False
+    strict: bool = False
+    # the budget of a single file: its number of tokens, and seconds of
+    # analysis (None for no limit)
+    max_tokens: typing.Optional[int] = None
+    timeout: typing.Optional[float] = None
+    # where the tokens of every file are cached (see TokenCache), None to
+    # lex every file
+    token_dir: typing.Optional[str] = None
+    # the full names of the subroutines to generate VM code for (see
+    # analyze_program), None for all of them
+    live: typing.Optional[typing.FrozenSet[str]] = None
+    # parse on an explicit work stack, for very deeply nested code (the
+    # output is the same, so it is not part of the cache mode)
+    iterative: bool = False
+
+    def cache_mode(self) -> str:
+        """
+        Returns:
+            str: identifies the kind of output in the keys of the build cache.
+        """
+        mode = self.target + "-O" if self.optimizing else self.target
+        if self.strict:
+            mode += "-strict"
+        if self.max_tokens is not None:
+            # a file over the budget fails, so it must not be served from
+            # outputs cached without (or with a larger) budget
+            mode += "-max-tokens-%d" % self.max_tokens
+        if self.live is not None:
+            digest = hashlib.sha256("\n".join(sorted(self.live)).encode())
+            mode += "-live-" + digest.hexdigest()
+        return mode
+
+
+class FileResult(typing.NamedTuple):
+    """The outcome of analyzing a single file."""
+    # a description of the failure, None if the file was analyzed
+    error: typing.Optional[str] = None
+    # the CodeGenerator's report, for VM output
+    report: typing.Optional[typing.Dict[str, typing.Any]] = None
+    # the FileProfile of the analysis, when profiling
+    profile: typing.Optional[typing.Dict[str, typing.Dict]] = None
+    # True if the output was restored from the build cache
+    cached: bool = False
+    # the output itself, for sources analyzed in memory
+    output: typing.Optional[str] = None
+    # the entry of the class in the program index, from index_path
+    index: typing.Optional[ClassEntry] = None
+
+
+class SharedTables:
+    """Tables which the files of a batch share: the interned terminals of
+    the parse trees and the XML lines of those terminals. Tokens that recur
+    across the batch (keywords, symbols, common names) are then allocated,
+    and escaped, only once.
+    """
+
+    def __init__(self) -> None:
+        self.terminals = terminal_tables()
+        self.terminal_lines = {}  # type: typing.Dict[typing.Any, str]
 
 
 def analyze_file(
-        input_file: typing.TextIO, output_file: typing.TextIO) -> None:
+        input_file: typing.TextIO, output_file: typing.TextIO,
+        streaming: bool = False, target: str = "xml",
+        optimizing: bool = False, profile: typing.Optional[FileProfile] = None,
+        tables: typing.Optional[SharedTables] = None, strict: bool = False,
+        max_tokens: typing.Optional[int] = None,
+        sidecar: typing.Optional[str] = None,
+        live: typing.Optional[typing.AbstractSet[str]] = None,
+        iterative: bool = False
+) -> typing.Optional[typing.Dict[str, typing.Any]]:
     """Analyzes a single file.
 
     Args:
         input_file (typing.TextIO): the file to analyze.
         output_file (typing.TextIO): writes all output to this file.
+        streaming (bool): lex the input lazily, with bounded memory, instead
+            of scanning it all up front.
+        target (str): "xml" for the parse tree as XML, or "vm" for VM code.
+        optimizing (bool): optimize the VM code.
+        profile (typing.Optional[FileProfile]): if given, records the time
+            spent in every phase and counts of what was processed.
+        tables (typing.Optional[SharedTables]): tables to share with the
+            other files of a batch.
+        strict (bool): check every token against the grammar, failing on
+            the first one which does not fit.
+        max_tokens (typing.Optional[int]): if given, a file with more tokens
+            than this fails.
+        sidecar (typing.Optional[str]): the path of the token sidecar of the
+            file. The tokens are loaded from it if it matches the source,
+            otherwise the source is lexed and the sidecar rewritten. Ignored
+            when streaming.
+        live (typing.Optional[typing.AbstractSet[str]]): for VM code, the
+            full names of the subroutines to translate, None for all.
+        iterative (bool): parse with an IterativeCompilationEngine, which
+            handles any depth of nesting, instead of the recursive one.
+
+    Returns:
+        typing.Optional[typing.Dict[str, typing.Any]]: for VM code, the
+        CodeGenerator's report of the number of commands generated.
+    """
+    start = time.perf_counter() if profile is not None else 0.0
+    if streaming:
+        tokenizer = StreamingJackTokenizer(input_file, max_tokens=max_tokens)
+    elif profile is not None or sidecar is not None:
+        source = input_file.read()
+        if profile is not None:
+            start = profile.add_time("read", start)
+        if sidecar is not None:
+            table, loaded = cached_scan(source, sidecar)
+            tokenizer = JackTokenizer.from_table(table, max_tokens)
+        else:
+            tokenizer = JackTokenizer(io.StringIO(source), max_tokens)
+            loaded = False
+        if profile is not None:
+            start = profile.add_time("tokenize", start)
+            profile.counters["cached_tokens"] = \
+                tokenizer.num_tokens if loaded else 0
+    else:
+        tokenizer = JackTokenizer(input_file, max_tokens)
+    if tables is None:
+        tables = SharedTables()
+    if target == "vm":
+        backend = CodeGenerator(output_file, optimizing, live)
+    else:
+        backend = XMLWriter(output_file, terminal_lines=tables.terminal_lines)
+    engine_backend = backend
+    if profile is not None:
+        engine_backend = ProfilingBackend(backend, profile)
+    # a streamed file is written out a declaration at a time, as it is parsed
+    engine_class = IterativeCompilationEngine if iterative \
+        else CompilationEngine
+    engine = engine_class(tokenizer, output_file, keep_tree=not streaming,
+                          backend=engine_backend, terminals=tables.terminals,
+                          strict=strict)
+    engine.compile_class()
+    if profile is not None:
+        profile.add_time("parse", start)
+        # the backend was called from within the parser
+        profile.timings["parse"] -= profile.timings["emit"]
+        profile.counters["writes"] = backend.write_calls
+        if streaming:
+            # lexed on demand, while parsing
+            profile.timings["read"] = profile.timings["tokenize"] = None
+            profile.counters["tokens"] = None
+        else:
+            profile.counters["tokens"] = tokenizer.num_tokens
+    return backend.report() if target == "vm" else None
+
+
+def analyze_source(source: str,
+                   options: AnalyzerOptions = AnalyzerOptions()) -> str:
+    """Analyzes the source of a single class in memory.
+
+    Args:
+        source (str): the source of a class.
+        options (AnalyzerOptions): how to analyze it (profiling is ignored).
+
+    Returns:
+        str: the output, XML or VM code according to options.target.
+    """
+    output_file = io.StringIO()
+    with time_limit(options.timeout):
+        analyze_file(io.StringIO(source), output_file, options.streaming,
+                     options.target, options.optimizing,
+                     strict=options.strict, max_tokens=options.max_tokens,
+                     live=options.live, iterative=options.iterative)
+    return output_file.getvalue()
+
+
+def analyze_sources(
+        sources: typing.Union[typing.Mapping[str, str], typing.Iterable[str]],
+        options: AnalyzerOptions = AnalyzerOptions()
+) -> typing.Dict[typing.Any, FileResult]:
+    """Analyzes a batch of sources in memory, in a single call, with no
+    filesystem access at all. The files of the batch share their tables (see
+    SharedTables). A source that fails does not stop the rest of the batch.
+
+    Args:
+        sources (typing.Union[typing.Mapping[str, str],
+            typing.Iterable[str]]): maps names (e.g. class names) to the
+            sources of classes, or just the sources, which are then named
+            by their position.
+        options (AnalyzerOptions): how to analyze them.
+
+    Returns:
+        typing.Dict[typing.Any, FileResult]: maps the name of every source,
+        in the given order, to the outcome of its analysis, with its output.
+    """
+    if not isinstance(sources, typing.Mapping):
+        sources = dict(enumerate(sources))
+    tables = SharedTables()
+    results = {}
+    for name, source in sources.items():
+        output_file = io.StringIO()
+        profile = FileProfile() if options.profiling else None
+        try:
+            with time_limit(options.timeout):
+                report = analyze_file(io.StringIO(source), output_file,
+                                      options.streaming, options.target,
+                                      options.optimizing, profile, tables,
+                                      options.strict, options.max_tokens,
+                                      live=options.live,
+                                      iterative=options.iterative)
+        except Exception as error:
+            results[name] = FileResult(error=describe_error(error))
+            continue
+        results[name] = FileResult(
+            report=report, output=output_file.getvalue(),
+            profile=profile.as_dict() if profile is not None else None)
+    return results
+
+
+@contextlib.contextmanager
+def time_limit(seconds: typing.Optional[float]) -> typing.Iterator[None]:
+    """Fails the analysis run within the context with a TimeoutError once
+    it has taken the given number of seconds.
+
+    The limit is enforced with SIGALRM, so it only applies in the main thread
+    of a process (the worker processes of a batch included), and only where
+    the platform has setitimer; elsewhere it is not enforced.
+
+    Args:
+        seconds (typing.Optional[float]): the limit, None for no limit.
+    """
+    if seconds is None or not hasattr(signal, "setitimer") or \
+            threading.current_thread() is not threading.main_thread():
+        yield
+        return
+
+    def expire(signum, frame):
+        raise TimeoutError("Analysis took longer than %g seconds" % seconds)
+
+    previous = signal.signal(signal.SIGALRM, expire)
+    signal.setitimer(signal.ITIMER_REAL, seconds)
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+
+
+def output_path_for(input_path: str, target: str = "xml") -> str:
+    """
+    Args:
+        input_path (str): path of a .jack file.
+        target (str): the kind of output.
+
+    Returns:
+        str: the path of the file it is analyzed into.
+    """
+    filename, extension = os.path.splitext(input_path)
+    return filename + "." + target
+
+
+def analyze_path(input_path: str,
+                 options: AnalyzerOptions = AnalyzerOptions()) -> FileResult:
+    """Analyzes a single .jack file into a sibling output file. If the
+    analysis fails, no partial output is left behind.
+
+    Args:
+        input_path (str): path of the file to analyze.
+        options (AnalyzerOptions): how to analyze it.
+
+    Returns:
+        FileResult: the report (and profile) of the analysis.
+    """
+    output_path = output_path_for(input_path, options.target)
+    profile = FileProfile() if options.profiling else None
+    sidecar = None
+    if options.token_dir is not None and not options.streaming:
+        sidecar = sidecar_path(input_path, options.token_dir)
+    try:
+        with open(input_path, 'r') as input_file, \
+                open(output_path, 'w') as output_file, \
+                time_limit(options.timeout):
+            report = analyze_file(input_file, output_file, options.streaming,
+                                  options.target, options.optimizing,
+                                  profile, strict=options.strict,
+                                  max_tokens=options.max_tokens,
+                                  sidecar=sidecar, live=options.live,
+                                  iterative=options.iterative)
+    except BaseException:
+        if os.path.exists(output_path):
+            os.remove(output_path)
+        raise
+    return FileResult(report=report, profile=profile.as_dict()
+                      if profile is not None else None)
+
+
+def analyze_paths(input_paths: typing.List[str], jobs: int = 1,
+                  options: AnalyzerOptions = AnalyzerOptions(),
+                  cache: typing.Optional[BuildCache] = None
+                  ) -> typing.Dict[str, FileResult]:
+    """Analyzes several .jack files, each into its own output file. With more
+    than one job, every file is analyzed in a worker process of its own. A
+    file that fails does not stop the rest of the batch.
+
+    Args:
+        input_paths (typing.List[str]): paths of the files to analyze.
+        jobs (int): number of worker processes to use.
+        options (AnalyzerOptions): how to analyze them.
+        cache (typing.Optional[BuildCache]): if given, files whose source
+            was analyzed before have their output restored from the cache
+            instead, and fresh outputs are added to it.
+
+    Returns:
+        typing.Dict[str, FileResult]: maps every input path, in the given
+        order, to the outcome of its analysis.
+    """
+    results = {path: FileResult() for path in input_paths}
+    keys = {}  # type: typing.Dict[str, str]
+    pending = input_paths
+    if cache is not None:
+        pending = []
+        version = analyzer_version()
+        for input_path in input_paths:
+            try:
+                with open(input_path, 'rb') as source_file:
+                    key = cache.key(source_file.read(), version,
+                                    options.cache_mode())
+            except OSError:
+                # left for analyze_path to report
+                pending.append(input_path)
+                continue
+            if cache.restore(key, output_path_for(input_path,
+                                                  options.target)):
+                results[input_path] = FileResult(report=cache.metadata(key),
+                                                 cached=True)
+            else:
+                keys[input_path] = key
+                pending.append(input_path)
+    for input_path, result in analyze_batch(pending, jobs, options):
+        results[input_path] = result
+        if result.error is None and input_path in keys:
+            cache.store(keys[input_path],
+                        output_path_for(input_path, options.target),
+                        input_path, result.report)
+    if cache is not None:
+        cache.prune()
+        cache.save()
+    return results
+
+
+def analyze_batch(input_paths: typing.List[str], jobs: int,
+                  options: AnalyzerOptions,
+                  task: typing.Callable[[str, AnalyzerOptions],
+                                        FileResult] = analyze_path
+                  ) -> typing.Iterator[typing.Tuple[str, FileResult]]:
+    """Analyzes several .jack files, in worker processes if jobs > 1.
+
+    Args:
+        input_paths (typing.List[str]): paths of the files to analyze.
+        jobs (int): number of worker processes to use.
+        options (AnalyzerOptions): how to analyze them.
+        task (typing.Callable[[str, AnalyzerOptions], FileResult]): what to
+            do with every file, analyze_path or index_path.
+
+    Returns:
+        typing.Iterator[typing.Tuple[str, FileResult]]: every input path, in
+        the given order, with the outcome of its analysis.
     """
-    # Your code goes here!
-    # It might be good to start by creating a new JackTokenizer and CompilationEngine:
-    tokenizer = JackTokenizer(input_file)
-    engine = CompilationEngine(tokenizer, output_file)
+    if jobs <= 1 or len(input_paths) <= 1:
+        for input_path in input_paths:
+            try:
+                yield input_path, task(input_path, options)
+            except Exception as error:
+                yield input_path, FileResult(error=describe_error(error))
+        return
+    workers = min(jobs, len(input_paths))
+    with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+        futures = [pool.submit(task, input_path, options)
+                   for input_path in input_paths]
+        for input_path, future in zip(input_paths, futures):
+            try:
+                yield input_path, future.result()
+            except Exception as error:
+                yield input_path, FileResult(error=describe_error(error))
+
+
+def index_file(input_file: typing.TextIO, streaming: bool = False,
+               strict: bool = False, max_tokens: typing.Optional[int] = None,
+               sidecar: typing.Optional[str] = None,
+               iterative: bool = False) -> ClassEntry:
+    """Parses a single file into its entry in the program index.
+
+    Args:
+        input_file (typing.TextIO): the file to index.
+        streaming, strict, max_tokens, sidecar, iterative: as for
+            analyze_file.
+
+    Returns:
+        ClassEntry: the signatures and calls of the subroutines of its class.
+    """
+    if streaming:
+        tokenizer = StreamingJackTokenizer(input_file, max_tokens=max_tokens)
+    elif sidecar is not None:
+        table, loaded = cached_scan(input_file.read(), sidecar)
+        tokenizer = JackTokenizer.from_table(table, max_tokens)
+    else:
+        tokenizer = JackTokenizer(input_file, max_tokens)
+    indexer = ClassIndexer()
+    engine_class = IterativeCompilationEngine if iterative \
+        else CompilationEngine
+    engine = engine_class(tokenizer, None, keep_tree=False, backend=indexer,
+                          strict=strict)
     engine.compile_class()
+    return indexer.entry()
 
 
+def index_path(input_path: str,
+               options: AnalyzerOptions = AnalyzerOptions()) -> FileResult:
+    """Indexes a single .jack file, see index_file.
+
+    Returns:
+        FileResult: the outcome, with the entry of the class.
+    """
+    sidecar = None
+    if options.token_dir is not None and not options.streaming:
+        sidecar = sidecar_path(input_path, options.token_dir)
+    with open(input_path, 'r') as input_file, time_limit(options.timeout):
+        entry = index_file(input_file, options.streaming, options.strict,
+                           options.max_tokens, sidecar, options.iterative)
+    return FileResult(index=entry)
+
+
+def analyze_program(input_paths: typing.List[str], jobs: int = 1,
+                    options: AnalyzerOptions = AnalyzerOptions(),
+                    cache: typing.Optional[BuildCache] = None
+                    ) -> typing.Dict[str, FileResult]:
+    """Compiles the .jack files of a whole program into VM code, leaving
+    out the subroutines which can never be called.
+
+    The files are first indexed (in parallel), and the subroutines
+    reachable from the entry points of the program (see
+    ProgramIndex.entry_points) are found in the index of the whole program.
+    The files are then analyzed as by analyze_paths, translating only
+    those subroutines. A program without Main.main or Sys.init is compiled
+    whole. Calls to subroutines which the classes of the program do not
+    define are warned about on stderr.
+
+    Args:
+        input_paths (typing.List[str]): paths of all the files of a program.
+        jobs, options, cache: as for analyze_paths. The options' target
+            should be "vm".
+
+    Returns:
+        typing.Dict[str, FileResult]: as for analyze_paths. The reports
+        name the subroutines which were eliminated.
+    """
+    results = {}  # type: typing.Dict[str, FileResult]
+    index = ProgramIndex()
+    for input_path, result in analyze_batch(input_paths, jobs, options,
+                                            index_path):
+        if result.error is not None:
+            results[input_path] = result
+        else:
+            index.add(result.index)
+    for caller, callee in index.undefined_calls():
+        print("warning: %s calls %s, which is not defined" % (caller, callee),
+              file=sys.stderr)
+    roots = index.entry_points()
+    if index.subroutine(roots[0]) is not None:
+        options = options._replace(live=frozenset(index.reachable(roots)))
+    indexed = [path for path in input_paths if path not in results]
+    results.update(analyze_paths(indexed, jobs, options, cache))
+    return {path: results[path] for path in input_paths}
+
+
+@functools.lru_cache(maxsize=None)
+def analyzer_version() -> str:
+    """
+    Returns:
+        str: a digest of the analyzer's own source files (ANALYZER_MODULES),
+        so that any change to the analyzer invalidates the outputs cached by
+        older versions.
+    """
+    analyzer_dir = os.path.dirname(os.path.abspath(__file__))
+    digest = hashlib.sha256()
+    for module in ANALYZER_MODULES:
+        with open(os.path.join(analyzer_dir, module + ".py"), 'rb') \
+                as source_file:
+            digest.update(source_file.read())
+    return digest.hexdigest()
+
+
+def watch(argument_path: str, jobs: int = 1,
+          options: AnalyzerOptions = AnalyzerOptions(),
+          cache: typing.Optional[BuildCache] = None,
+          interval: float = WATCH_INTERVAL) -> None:
+    """Analyzes every file the path refers to, then keeps polling them and
+    analyzes again only the files which were added or modified since, until
+    interrupted. The process (and the modules it loaded) stays warm between
+    rounds, and the latency of every round is printed.
+
+    Args:
+        argument_path (str): a .jack file or a directory.
+        jobs (int): see analyze_paths.
+        options (AnalyzerOptions): how to analyze the files.
+        cache (typing.Optional[BuildCache]): see analyze_paths.
+        interval (float): seconds between two polls.
+    """
+    known = {}  # type: typing.Dict[str, typing.Tuple[int, int]]
+    try:
+        while True:
+            current = snapshot(argument_path)
+            changed = [path for path, stat in current.items()
+                       if known.get(path) != stat]
+            for input_path in known:
+                if input_path not in current:
+                    print("removed %s" % input_path)
+            known = current
+            if changed:
+                start = time.perf_counter()
+                results = analyze_paths(changed, jobs, options, cache)
+                milliseconds = (time.perf_counter() - start) * 1000
+                if options.optimizing:
+                    print_savings([result.report
+                                   for result in results.values()
+                                   if result.report is not None])
+                failed = print_failures(results)
+                print("analyzed %d file%s in %.1f ms%s" % (
+                    len(changed), "" if len(changed) == 1 else "s",
+                    milliseconds, ", %d failed" % failed if failed else ""))
+                sys.stdout.flush()
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        pass
+
+
+def snapshot(argument_path: str) -> typing.Dict[str, typing.Tuple[int, int]]:
+    """
+    Args:
+        argument_path (str): a .jack file or a directory.
+
+    Returns:
+        typing.Dict[str, typing.Tuple[int, int]]: the modification time (in
+        nanoseconds) and size of every .jack file the path refers to.
+    """
+    stats = {}
+    for input_path in list_jack_files(argument_path):
+        try:
+            stat = os.stat(input_path)
+        except OSError:
+            # removed since the directory was listed
+            continue
+        stats[input_path] = (stat.st_mtime_ns, stat.st_size)
+    return stats
+
+
+def print_failures(results: typing.Dict[str, FileResult]) -> int:
+    """Prints the failures of a build to stderr.
+
+    Returns:
+        int: the number of files which failed.
+    """
+    failed = 0
+    for input_path, result in results.items():
+        if result.error is not None:
+            print("%s: %s" % (input_path, result.error), file=sys.stderr)
+            failed += 1
+    return failed
+
+
+def print_savings(reports: typing.List[typing.Dict[str, typing.Any]]
+                  ) -> None:
+    """Prints how many VM commands the optimizer saved in every class, and
+    in total.
+
+    Args:
+        reports (typing.List[typing.Dict[str, typing.Any]]): the reports of
+            the CodeGenerator.
+    """
+    rows = [(report["class"], report["commands"], report["optimized"])
+            for report in reports]
+    rows.append(("total", sum(row[1] for row in rows),
+                 sum(row[2] for row in rows)))
+    width = max(len(str(row[0])) for row in rows)
+    for name, commands, optimized in rows:
+        saved = commands - optimized
+        print("%-*s %7d -> %7d commands (-%d, %.1f%%)"
+              % (width, name, commands, optimized, saved,
+                 100.0 * saved / commands if commands else 0.0))
+
+
+def print_eliminated(reports: typing.List[typing.Dict[str, typing.Any]]
+                     ) -> None:
+    """Prints how many subroutines were eliminated from every class, and in
+    total, and which.
+
+    Args:
+        reports (typing.List[typing.Dict[str, typing.Any]]): the reports of
+            the CodeGenerator.
+    """
+    rows = [(report["class"], report["subroutines"], report["eliminated"])
+            for report in reports]
+    rows.append(("total", sum(row[1] for row in rows),
+                 [name for row in rows for name in row[2]]))
+    width = max(len(str(row[0])) for row in rows)
+    for name, subroutines, eliminated in rows:
+        print("%-*s %4d of %4d subroutines eliminated%s"
+              % (width, name, len(eliminated), subroutines,
+                 ": " + ", ".join(eliminated)
+                 if eliminated and name != "total" else ""))
+
+
+def profile_report(results: typing.Dict[str, FileResult],
+                   wall_seconds: float, jobs: int) -> typing.Dict[str, typing.Any]:
+    """
+    Args:
+        results (typing.Dict[str, FileResult]): the results of a profiled
+            build, see analyze_paths.
+        wall_seconds (float): how long the whole build took.
+        jobs (int): number of worker processes used.
+
+    Returns:
+        typing.Dict[str, typing.Any]: the profile of every file (cached and
+        failed files have none) and their totals, ready to be serialized as
+        JSON.
+    """
+    files = {}
+    for input_path, result in results.items():
+        entry = dict(result.profile or {})
+        entry["cached"] = result.cached
+        if result.error is not None:
+            entry["error"] = result.error
+        files[input_path] = entry
+    profiles = [result.profile for result in results.values()
+                if result.profile is not None]
+    return {"wall_seconds": wall_seconds, "jobs": jobs, "files": files,
+            "total": summarize(profiles)}
+
+
+def describe_error(error: BaseException) -> str:
+    """
+    Returns:
+        str: a one line description of an error raised while analyzing.
+    """
+    return "%s: %s" % (type(error).__name__, error)
+
+
+def list_jack_files(argument_path: str) -> typing.List[str]:
+    """
+    Args:
+        argument_path (str): a .jack file or a directory.
+
+    Returns:
+        typing.List[str]: the .jack files the path refers to, sorted.
+    """
+    if os.path.isdir(argument_path):
+        files_to_assemble = [
+            os.path.join(argument_path, filename)
+            for filename in os.listdir(argument_path)]
+    else:
+        files_to_assemble = [argument_path]
+    return sorted(path for path in files_to_assemble
+                  if os.path.splitext(path)[1].lower() == ".jack")
 
 
 if "__main__" == __name__:
@@ -35,20 +717,194 @@ if "__main__" == __name__:
     # Both are closed automatically when the code finishes running.
     # If the output file does not exist, it is created automatically in the
     # correct path, using the correct filename.
-    if not len(sys.argv) == 2:
-        sys.exit("Invalid usage, please use: JackAnalyzer <input path>")
-    argument_path = os.path.abspath(sys.argv[1])
-    if os.path.isdir(argument_path):
-        files_to_assemble = [
-            os.path.join(argument_path, filename)
-            for filename in os.listdir(argument_path)]
+    parser = argparse.ArgumentParser(
+        prog="JackAnalyzer",
+        description="Analyzes Jack files into XML, or compiles them into VM "
+                    "code.")
+    parser.add_argument("input_path", help="a .jack file or a directory")
+    parser.add_argument("--target", choices=TARGETS,
+                        help="the kind of output to produce (default: xml, "
+                             "or vm with -O)")
+    parser.add_argument("-O", "--optimize", action="store_true",
+                        help="optimize the VM code, and report the savings "
+                             "of every class")
+    parser.add_argument("--prune", action="store_true",
+                        help="compile the files as a whole program, leaving "
+                             "out the subroutines which are unreachable "
+                             "from %s, or from %s if the program has no "
+                             "Sys class (implies --target vm)"
+                        % (SYS_ENTRY_POINT, ENTRY_POINT))
+    parser.add_argument("--asm", action="store_true",
+                        help="also translate the VM files of the input into "
+                             "a single Hack assembly file, and report the "
+                             "size of every class (implies --target vm)")
+    parser.add_argument("--bootstrap", action="store_true",
+                        help="start the assembly program with the bootstrap "
+                             "code, which calls Sys.init")
+    parser.add_argument("--run", metavar="CYCLES", type=int,
+                        help="run the assembly program on the emulator for "
+                             "at most CYCLES cycles, and report the cycles "
+                             "of every function (requires --asm). The "
+                             "program starts at Sys.init with --bootstrap, "
+                             "and otherwise at the first command of the "
+                             "first VM file, in alphabetical order")
+    parser.add_argument("--verify", metavar="DIR",
+                        help="compare the XML output of every file with the "
+                             "file of the same name in DIR, token by token")
+    parser.add_argument("--normalize", metavar="DIR",
+                        help="also write the XML outputs to DIR with the "
+                             "whitespace around their lines stripped (see "
+                             "remove_spaces.py)")
+    parser.add_argument("--profile", metavar="FILE",
+                        help="time every phase of the analysis of every "
+                             "file and write the timings and counters to "
+                             "FILE as JSON ('-' for standard output)")
+    parser.add_argument("--watch", action="store_true",
+                        help="stay resident, and analyze again the files "
+                             "which are added or modified")
+    parser.add_argument("--interval", type=float, default=WATCH_INTERVAL,
+                        help="seconds between two polls in watch mode "
+                             "(default: %s)" % WATCH_INTERVAL)
+    parser.add_argument("--strict", action="store_true",
+                        help="check every token against the grammar, and "
+                             "fail on the first one which does not fit")
+    parser.add_argument("--max-tokens", type=int,
+                        help="fail files with more tokens than this")
+    parser.add_argument("--timeout", type=float,
+                        help="fail files whose analysis takes longer than "
+                             "this many seconds")
+    parser.add_argument("--stream", action="store_true",
+                        help="lex lazily from a memory-mapped file, with "
+                             "bounded memory (for very large sources)")
+    parser.add_argument("--iterative", action="store_true",
+                        help="parse on an explicit stack instead of "
+                             "recursively, for code nested too deeply for "
+                             "the recursion limit (VM code generation still "
+                             "recurses)")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="number of files to analyze in parallel "
+                             "(default: 1, as starting the worker processes "
+                             "costs more than a typical project takes to "
+                             "analyze)")
+    parser.add_argument("--cache", action="store_true",
+                        help="keep a build cache, and restore the outputs of "
+                             "files which were analyzed before")
+    parser.add_argument("--cache-dir",
+                        help="where to keep the build cache, with --cache "
+                             "(default: .jackcache next to the input files)")
+    parser.add_argument("--no-token-cache", action="store_true",
+                        help="with --cache, lex every file instead of "
+                             "loading the tokens of unchanged files from the "
+                             "cache")
+    parser.add_argument("--cache-size", type=int,
+                        default=DEFAULT_MAX_ENTRIES,
+                        help="number of outputs the cache keeps before "
+                             "evicting the least recently used ones")
+    args = parser.parse_args()
+    if args.target is None:
+        args.target = "vm" if args.optimize or args.prune or args.asm \
+            else "xml"
+    elif args.optimize and args.target != "vm":
+        parser.error("-O only applies to --target vm")
+    elif args.prune and args.target != "vm":
+        parser.error("--prune only applies to --target vm")
+    elif args.asm and args.target != "vm":
+        parser.error("--asm only applies to --target vm")
+    if args.bootstrap and not args.asm:
+        parser.error("--bootstrap only applies to --asm")
+    if args.run is not None and not args.asm:
+        parser.error("--run only applies to --asm")
+    if args.watch and args.profile is not None:
+        parser.error("--profile cannot be combined with --watch")
+    if args.watch and args.prune:
+        parser.error("--prune cannot be combined with --watch")
+    if args.watch and args.asm:
+        parser.error("--asm cannot be combined with --watch")
+    if args.verify is not None and args.target != "xml":
+        parser.error("--verify only applies to --target xml")
+    if args.normalize is not None and args.target != "xml":
+        parser.error("--normalize only applies to --target xml")
+    if args.cache_dir is not None and not args.cache:
+        parser.error("--cache-dir only applies to --cache")
+    if args.no_token_cache and not args.cache:
+        parser.error("--no-token-cache only applies to --cache")
+    argument_path = os.path.abspath(args.input_path)
+    input_paths = list_jack_files(argument_path)
+    cache = None
+    token_dir = None
+    if args.cache:
+        cache_dir = args.cache_dir
+        if cache_dir is None:
+            input_dir = argument_path if os.path.isdir(argument_path) \
+                else os.path.dirname(argument_path)
+            cache_dir = os.path.join(input_dir, ".jackcache")
+        cache = BuildCache(cache_dir, args.cache_size)
+        if not args.no_token_cache:
+            token_dir = os.path.join(cache_dir, "tokens")
+    options = AnalyzerOptions(streaming=args.stream, target=args.target,
+                              optimizing=args.optimize,
+                              profiling=args.profile is not None,
+                              strict=args.strict, max_tokens=args.max_tokens,
+                              timeout=args.timeout, token_dir=token_dir,
+                              iterative=args.iterative)
+    if args.watch:
+        watch(argument_path, args.jobs, options, cache, args.interval)
+        sys.exit()
+    build_start = time.perf_counter()
+    if args.prune:
+        results = analyze_program(input_paths, args.jobs, options, cache)
     else:
-        files_to_assemble = [argument_path]
-    for input_path in files_to_assemble:
-        filename, extension = os.path.splitext(input_path)
-        if extension.lower() != ".jack":
-            continue
-        output_path = filename + ".xml"
-        with open(input_path, 'r') as input_file, \
-                open(output_path, 'w') as output_file:
-            analyze_file(input_file, output_file)
+        results = analyze_paths(input_paths, args.jobs, options, cache)
+    build_seconds = time.perf_counter() - build_start
+    reports = [result.report for result in results.values()
+               if result.report is not None]
+    if args.optimize:
+        print_savings(reports)
+    if args.prune and reports:
+        print_eliminated(reports)
+    if args.profile is not None:
+        build_profile = profile_report(results, build_seconds, args.jobs)
+        if args.profile == "-":
+            json.dump(build_profile, sys.stdout, indent=2)
+            print()
+        else:
+            with open(args.profile, 'w') as profile_file:
+                json.dump(build_profile, profile_file, indent=2)
+    failed = print_failures(results)
+    outputs = [output_path_for(input_path)
+               for input_path, result in results.items()
+               if result.error is None]
+    if args.normalize is not None:
+        failed += print_statuses(normalize_paths(
+            [(output, os.path.join(args.normalize, os.path.basename(output)))
+             for output in outputs], args.jobs))
+    mismatched = 0
+    if args.verify is not None:
+        mismatched = print_comparisons(compare_pairs(
+            [(output, os.path.join(args.verify, os.path.basename(output)))
+             for output in outputs], args.jobs))
+    if failed:
+        sys.exit("%d of %d files failed" % (failed, len(input_paths)))
+    if args.asm:
+        # the program is every VM file of the input, also those of the OS
+        # (or of other languages) which are not compiled from Jack
+        program_path = argument_path if os.path.isdir(argument_path) \
+            else output_path_for(argument_path, "vm")
+        try:
+            sizes = translate_paths(list_vm_files(program_path),
+                                    asm_path_for(program_path),
+                                    args.bootstrap)
+        except (OSError, ValueError) as error:
+            sys.exit(str(error))
+        if not print_sizes(sizes):
+            sys.exit("the program does not fit in the %d words of the ROM"
+                     % ROM_SIZE)
+        if args.run is not None:
+            machine = HackMachine(load_program(asm_path_for(program_path)))
+            run_start = time.perf_counter()
+            machine.run(args.run)
+            print_profile(machine.profile(),
+                          time.perf_counter() - run_start)
+    if mismatched:
+        sys.exit("%d of %d outputs do not match their references"
+                 % (mismatched, len(outputs)))
@@ -6,8 +6,12 @@ as allowed by the Creative Common Attribution-NonCommercial-ShareAlike 3.0
 Unported [License](https://creativecommons.org/licenses/by-nc-sa/3.0/).
 """
 import typing
-import sys
-import os
+import re
+import array
+import functools
+import itertools
+import mmap
+import codecs
 
 
 class JackTokenizer:
@@ -94,29 +98,48 @@ class JackTokenizer:
     Note that ^, # correspond to shiftleft and shiftright, respectively.
     """
 
-    def __init__(self, input_stream: typing.TextIO) -> None:
+    def __init__(self, input_stream: typing.TextIO,
+                 max_tokens: typing.Optional[int] = None) -> None:
         """Opens the input stream and gets ready to tokenize it.
 
         Args:
             input_stream (typing.TextIO): input stream.
+            max_tokens (typing.Optional[int]): if given, a source with more
+                tokens than this is rejected with a ValueError.
         """
-        # Your code goes here!
-        # A good place to start is to read all the lines of the input:
-        self.input_lines = input_stream.read().splitlines()
-        self.clean_comments()
-        self.curr_line_ind = -1
-        self.num_lines = len(self.input_lines)
-        self.curr_command = ''
+        # the whole source is scanned once, up front
+        self.use_table(scan(input_stream.read()), max_tokens)
+
+    @classmethod
+    def from_table(cls, table: "TokenTable",
+                   max_tokens: typing.Optional[int] = None
+                   ) -> "JackTokenizer":
+        """Creates a tokenizer over tokens which were scanned before, e.g.
+        loaded from a sidecar (see TokenCache).
+
+        Args:
+            table (TokenTable): the tokens of a source.
+            max_tokens (typing.Optional[int]): as for the constructor.
+
+        Returns:
+            JackTokenizer: a tokenizer before its first token.
+        """
+        tokenizer = cls.__new__(cls)
+        tokenizer.use_table(table, max_tokens)
+        return tokenizer
+
+    def use_table(self, table: "TokenTable",
+                  max_tokens: typing.Optional[int]) -> None:
+        """Gets ready to go over the tokens of the given table."""
+        self.table = table
+        self.num_tokens = len(table.kinds)
+        if max_tokens is not None and self.num_tokens > max_tokens:
+            raise ValueError("Too many tokens: %d, the limit is %d"
+                             % (self.num_tokens, max_tokens))
         self.curr_token = ''
         self.curr_token_ind = -1
-        self.keyword_arr = ['class', 'constructor', 'function', 'method', 'field',
-                            'static', 'var', 'int', 'char', 'boolean', 'void', 'true',
-                            'false', 'null', 'this', 'let', 'do', 'if', 'else',
-                            'while', 'return']
-
-        self.symbol_arr = ['{', '}', '(', ')', '[', ']', '.', ',', ';', '+',
-                           '-', '*', '/', '&', '|', '<', '>', '=', '~', '^', '#']
-        self.integerConstant_arr = [str(i) for i in range(0, 32768)]
+        self.curr_kind = IDENTIFIER
+        self.marked = None  # type: typing.Optional[int]
 
     def has_more_tokens(self) -> bool:
         """Do we have more tokens in the input?
@@ -124,84 +147,80 @@ class JackTokenizer:
         Returns:
             bool: True if there are more tokens, False otherwise.
         """
-        # if it's not the last line- return true
-        if self.curr_line_ind < len(self.input_lines) - 1:
-            return True
+        return self.curr_token_ind < self.num_tokens - 1
 
-        # TODO: check if it's true
+    def peek(self, k: int = 1) -> typing.Tuple[int, str]:
+        """Looks ahead without advancing.
+
+        Args:
+            k (int): how far ahead to look: 1 for the token after the current
+                one, and so on.
+
+        Returns:
+            typing.Tuple[int, str]: the kind and the lexeme of the k-th token
+            after the current one, (EOF, '') past the end of the input.
+        """
+        ind = self.curr_token_ind + k
+        if ind < self.num_tokens:
+            table = self.table
+            return table.kinds[ind], table.lexicon[table.lexeme_ids[ind]]
+        return EOF, ''
+
+    def mark(self) -> None:
+        """Marks the current token, for reset() to return to."""
+        self.marked = self.curr_token_ind
+
+    def reset(self) -> None:
+        """Makes the marked token the current token again."""
+        if self.marked is None:
+            raise ValueError("Cannot reset the tokenizer: nothing is marked")
+        if self.marked < 0:
+            self.curr_token_ind = -1
+            self.curr_kind = IDENTIFIER
+            self.curr_token = ''
         else:
-            if self.curr_token_ind < len(self.curr_command) - 1:
-                return True
-        return False
+            self.curr_token_ind = self.marked - 1
+            self.advance()
 
     def advance(self) -> None:
         """Gets the next token from the input and makes it the current token.
         This method should be called if has_more_tokens() is true.
-        Initially there is no current token.
+        Initially there is no current token. Advancing past the last token
+        makes the current token the end of the input: its kind is EOF and
+        its lexeme is empty.
         """
-        while self.has_more_tokens():
-            ind = self.curr_token_ind + 1
-            command_str = ''
-
-            while ind < len(self.curr_command):
-                if self.curr_command[ind] == "\t":
-                    ind += 1
-                    continue
-                command_str += self.curr_command[ind]
-
-                if command_str == '"':
-                    command_str = ""
-                    while '"' not in command_str:
-                        ind += 1
-                        command_str += self.curr_command[ind]
-                    command_str = command_str[:-1]
-
-                if command_str == " ":
-                    command_str = ""
-                    ind += 1
-                    continue
-
-                elif self.curr_command[ind] == " ":
-                    self.curr_token = command_str[:-1]
-                    self.curr_token_ind = ind
-                    return
-
-                elif self.curr_command[ind] in self.symbol_arr:
-                    if len(command_str) == 1:
-                        self.curr_token = command_str
-                        self.curr_token_ind = ind
-
-                    else:
-                        self.curr_token = command_str[:-1]
-                        self.curr_token_ind = ind - 1
-                    return
-                ind += 1
-            self.curr_token_ind = -1
-            self.curr_line_ind += 1
-            self.curr_command = self.input_lines[self.curr_line_ind]
-            if command_str != "":
-                self.curr_token = command_str
-                return
+        ind = self.curr_token_ind + 1
+        if ind < self.num_tokens:
+            table = self.table
+            self.curr_token_ind = ind
+            self.curr_kind = table.kinds[ind]
+            self.curr_token = table.lexicon[table.lexeme_ids[ind]]
+        else:
+            self.curr_token_ind = self.num_tokens
+            self.curr_kind = EOF
+            self.curr_token = ''
+
+    def line_number(self) -> int:
+        """
+        Returns:
+            int: the line of the current token (for diagnostics, it is
+            computed on demand).
+        """
+        table = self.table
+        # the end of the input is reported in the line of the last token
+        ind = min(self.curr_token_ind, self.num_tokens - 1)
+        if ind < 0:
+            return 1
+        return table.source.count("\n", 0, table.starts[ind]) + 1
 
     def token_type(self) -> str:
         """
         Returns:
             str: the type of the current token, can be
-            "KEYWORD", "SYMBOL", "IDENTIFIER", "INT_CONST", "STRING_CONST"
+            "KEYWORD", "SYMBOL", "IDENTIFIER", "INT_CONST", "STRING_CONST",
+            or "EOF" at the end of the input
         """
-        if self.curr_token in self.symbol_arr:
-            return 'SYMBOL'
-
-        elif self.curr_token in self.keyword_arr:
-            return 'KEYWORD'
-
-        elif self.curr_token in self.integerConstant_arr:
-            return 'INT_CONST'
-        elif self.input_lines[self.curr_line_ind][self.curr_token_ind][0] == '"' and \
-                self.input_lines[self.curr_line_ind][self.curr_token_ind][-1] == '"':
-            return 'STRING_CONST'
-        else:
-            return 'IDENTIFIER'
+        return TOKEN_TYPES[self.curr_kind]
 
     def keyword(self) -> str:
         """
@@ -212,7 +231,6 @@ class JackTokenizer:
             "BOOLEAN", "CHAR", "VOID", "VAR", "STATIC", "FIELD", "LET", "DO",
             "IF", "ELSE", "WHILE", "RETURN", "TRUE", "FALSE", "NULL", "THIS"
         """
-        # Your code goes here!
         return self.curr_token.upper()
 
     def symbol(self) -> str:
@@ -257,99 +275,383 @@ class JackTokenizer:
             StringConstant: '"' A sequence of Unicode characters not including
                       double quote or newline '"'
         """
-        return self.curr_token[1:-1]
+        return self.curr_token
 
-    def go_to_non_comment_line(self, curr_line_ind):
 
-        in_comment = True
-        while curr_line_ind < len(self.input_lines):
-            # when we finish a comment block
-            if self.input_lines[curr_line_ind] == "":
-                curr_line_ind += 1
-                continue
-            if is_end_of_comment(self.input_lines[curr_line_ind]):
-                in_comment = False
-            elif not in_comment:
-                break
-            curr_line_ind += 1
+# Token kinds, as stored in TokenTable.kinds, and their token_type() names.
+# EOF is the kind of the end of the input, which is never stored.
+KEYWORD, SYMBOL, IDENTIFIER, INT_CONST, STRING_CONST, EOF = range(6)
+TOKEN_TYPES = ("KEYWORD", "SYMBOL", "IDENTIFIER", "INT_CONST", "STRING_CONST",
+               "EOF")
+
+# The lexical tables are shared, immutable and module-level: building a
+# tokenizer costs nothing beyond scanning its own source.
+KEYWORDS = frozenset((
+    'class', 'constructor', 'function', 'method', 'field', 'static', 'var',
+    'int', 'char', 'boolean', 'void', 'true', 'false', 'null', 'this', 'let',
+    'do', 'if', 'else', 'while', 'return'))
+SYMBOLS = frozenset('{}()[].,;+-*/&|<>=~^#')
+INT_MAX = 32767
+# how much StreamingJackTokenizer reads at a time
+STREAM_CHUNK_SIZE = 1 << 16
+# how many tokens StreamingJackTokenizer holds (a power of 2)
+RING_SIZE = 64
+RING_MASK = RING_SIZE - 1
+
+
+@functools.lru_cache(maxsize=None)
+def token_pattern() -> typing.Pattern:
+    """Builds (on first use) the master pattern covering every lexical
+    element. Whitespace and both comment styles are consumed as a prefix of
+    the token that follows them, so every match yields exactly one token. The
+    groups are listed in kind order, so the kind of a token is the index of
+    its group minus one. Trailing whitespace and comments match as an empty
+    "end" token, so that the pattern never backtracks into a comment.
+
+    Returns:
+        typing.Pattern: the compiled pattern.
+    """
+    keywords = "|".join(sorted(KEYWORDS))
+    symbols = "".join(re.escape(symbol) for symbol in sorted(SYMBOLS))
+    return re.compile(r"""
+        (?:\s+|//[^\n]*|/\*.*?\*/)*
+        (?:
+          (?P<keyword>(?:%s)(?![A-Za-z_0-9]))
+        | (?P<symbol>[%s])
+        | (?P<identifier>[A-Za-z_][A-Za-z_0-9]*)
+        | (?P<int>[0-9]+)
+        | "(?P<string>[^"\n]*)"
+        | (?P<error>\S)
+        | (?P<end>\Z)
+        )
+    """ % (keywords, symbols), re.VERBOSE | re.DOTALL)
+
+
+class TokenTable:
+    """A compact, array-backed token stream for a single source.
+
+    Token i has kind kinds[i], spans source[starts[i]:ends[i]] and has the
+    lexeme lexicon[lexeme_ids[i]]. Every distinct lexeme is stored once.
+    String constants span (and are stored) without their double quotes.
+    The arrays of a table loaded by TokenCache are read-only memoryviews of
+    the same items.
+    """
+    __slots__ = ("source", "kinds", "starts", "ends", "lexeme_ids", "lexicon")
 
-            continue
+    def __init__(self, source: str) -> None:
+        self.source = source
+        self.kinds = bytearray()
+        self.starts = array.array("I")
+        self.ends = array.array("I")
+        self.lexeme_ids = array.array("I")
+        self.lexicon = []  # type: typing.List[str]
 
-        return curr_line_ind
 
-    def clean_comments(self):
-        curr_ind = 0
-        input_lines_without_comments = []
-        while curr_ind < len(self.input_lines):
-            # when there is a beginning of comment block
-            self.input_lines[curr_ind] = self.input_lines[curr_ind].strip()
-            if "//" in self.input_lines[curr_ind]:
-                a = self.input_lines[curr_ind].split("//")[1]
-                self.input_lines[curr_ind] = self.input_lines[curr_ind].split("//")[0]
+def scan(source: str) -> TokenTable:
+    """Breaks a Jack source into tokens in a single pass.
 
-                if '"' in self.input_lines[curr_ind] and '"' in a:
-                    self.input_lines[curr_ind] += a
+    Args:
+        source (str): the full text of a Jack file.
 
-            if self.input_lines[curr_ind] == "":
-                curr_ind += 1
-                continue
+    Returns:
+        TokenTable: the tokens of the source.
+    """
+    table = TokenTable(source)
+    add_kind = table.kinds.append
+    add_start = table.starts.append
+    add_end = table.ends.append
+    add_id = table.lexeme_ids.append
+    lexicon = table.lexicon
+    lexeme_index = {}  # type: typing.Dict[str, int]
+    pattern = token_pattern()
+    error_group = pattern.groupindex["error"]
+    end_group = pattern.groupindex["end"]
+    int_group = pattern.groupindex["int"]
+    for match in pattern.finditer(source):
+        group = match.lastindex
+        if group == end_group:
+            break
+        lexeme = match.group(group)
+        if group == error_group or \
+                (group == int_group and int(lexeme) > INT_MAX):
+            line = source.count("\n", 0, match.start(group)) + 1
+            raise ValueError("Unexpected token %r in line %d"
+                             % (lexeme, line))
+        lexeme_id = lexeme_index.get(lexeme)
+        if lexeme_id is None:
+            lexeme_id = lexeme_index[lexeme] = len(lexicon)
+            lexicon.append(lexeme)
+        start, end = match.span(group)
+        add_kind(group - 1)
+        add_start(start)
+        add_end(end)
+        add_id(lexeme_id)
+    return table
+
+
+class StreamingJackTokenizer(JackTokenizer):
+    """A JackTokenizer that lexes its input lazily, a chunk at a time.
+
+    Only a ring of RING_SIZE tokens (from the current or the marked one on)
+    and the unfinished line are held in memory, so the compilation engine can
+    start emitting output before the whole source has been read, and memory
+    stays bounded regardless of the size of the file. Tokens are lexed into
+    the ring in batches, as far ahead as it has room for, so peek() can look
+    up to RING_SIZE - 1 tokens ahead, and reset() can return to a mark which
+    is less than RING_SIZE tokens behind. The index of the current token is
+    position; curr_token_ind stays -1, as there is no table to index.
+    """
 
-            if is_beginning_of_comment(self.input_lines[curr_ind]):
-                curr_ind = self.go_to_non_comment_line(curr_ind)
-                continue
+    def __init__(self, input_stream: typing.TextIO,
+                 chunk_size: int = STREAM_CHUNK_SIZE,
+                 max_tokens: typing.Optional[int] = None) -> None:
+        """Opens the input stream and gets ready to tokenize it.
+
+        Args:
+            input_stream (typing.TextIO): input stream.
+            chunk_size (int): number of bytes (or characters) read at once.
+            max_tokens (typing.Optional[int]): if given, a ValueError is
+                raised once the source turns out to have more tokens.
+        """
+        self.table = None
+        self.curr_token = ''
+        self.curr_token_ind = -1
+        self.curr_kind = IDENTIFIER
+        self.curr_line = 1
+        self.tokens = stream_tokens(input_stream, chunk_size, max_tokens)
+        # token i is in slot i & RING_MASK of the ring
+        self.ring_kinds = [EOF] * RING_SIZE
+        self.ring_tokens = [''] * RING_SIZE
+        self.ring_lines = [1] * RING_SIZE
+        # the index of the current token, and the number of tokens lexed
+        self.position = -1
+        self.lexed = 0
+        self.exhausted = False
+        self.marked = None  # type: typing.Optional[int]
+
+    def has_more_tokens(self) -> bool:
+        """Do we have more tokens in the input?
+
+        Returns:
+            bool: True if there are more tokens, False otherwise.
+        """
+        ind = self.position + 1
+        if ind >= self.lexed:
+            self.fill(ind, False)
+        return ind < self.lexed
+
+    def advance(self) -> None:
+        """Gets the next token from the input and makes it the current token.
+        This method should be called if has_more_tokens() is true.
+        Initially there is no current token.
+        """
+        ind = self.position + 1
+        if ind >= self.lexed:
+            self.fill(ind, True)
+        if ind < self.lexed:
+            slot = ind & RING_MASK
+            self.position = ind
+            self.curr_kind = self.ring_kinds[slot]
+            self.curr_token = self.ring_tokens[slot]
+            self.curr_line = self.ring_lines[slot]
+        else:
+            self.position = self.lexed
+            self.curr_kind = EOF
+            self.curr_token = ''
+
+    def peek(self, k: int = 1) -> typing.Tuple[int, str]:
+        """Looks ahead without advancing, see JackTokenizer.peek. A ValueError
+        is raised for k >= RING_SIZE, or when the tokens up to the k-th
+        would push the marked token out of the ring."""
+        if k >= RING_SIZE:
+            raise ValueError("Cannot look more than %d tokens ahead"
+                             % (RING_SIZE - 1))
+        ind = self.position + k
+        if ind >= self.lexed:
+            self.fill(ind, False)
+            if ind >= self.lexed:
+                return EOF, ''
+        slot = ind & RING_MASK
+        return self.ring_kinds[slot], self.ring_tokens[slot]
+
+    def mark(self) -> None:
+        """Marks the current token, for reset() to return to."""
+        self.marked = self.position
+
+    def reset(self) -> None:
+        """Makes the marked token the current token again."""
+        if self.marked is None:
+            raise ValueError("Cannot reset the tokenizer: nothing is marked, "
+                             "or the mark has left the ring")
+        if self.marked < 0:
+            self.position = -1
+            self.curr_kind = IDENTIFIER
+            self.curr_token = ''
+            self.curr_line = 1
+        else:
+            self.position = self.marked - 1
+            self.advance()
 
+    def fill(self, ind: int, advancing: bool) -> None:
+        """Lexes tokens into the ring, at least up to the one at the given
+        index (unless the input ends before it), and as far as the ring
+        allows, so that tokens are lexed in batches.
+
+        Args:
+            ind (int): the index of the token needed.
+            advancing (bool): True if the tokenizer advances to it, in which
+                case a mark which would be pushed out of the ring is dropped
+                (rather than failing the lookahead).
+        """
+        if self.exhausted:
+            return
+        # the slot of a token holds the token RING_SIZE before it, which
+        # must not be needed anymore: the current and the marked token stay
+        keep = self.position
+        if self.marked is not None and self.marked < keep:
+            keep = self.marked
+        if ind - keep >= RING_SIZE:
+            if advancing and ind - self.position < RING_SIZE:
+                self.marked = None
+                keep = self.position
+            else:
+                raise ValueError("Cannot look more than %d tokens ahead"
+                                 % (RING_SIZE - 1))
+        kinds, lexemes, lines = self.ring_kinds, self.ring_tokens, \
+            self.ring_lines
+        lexed = self.lexed
+        limit = keep + RING_SIZE
+        try:
+            for token in itertools.islice(self.tokens, limit - lexed):
+                slot = lexed & RING_MASK
+                kinds[slot], lexemes[slot], lines[slot] = token
+                lexed += 1
+        finally:
+            # the tokens before a lexical error stay readable
+            self.lexed = lexed
+        if lexed < limit:
+            self.exhausted = True
+
+    def line_number(self) -> int:
+        """
+        Returns:
+            int: the line of the current token.
+        """
+        return self.curr_line
 
-            # when it's a one line comment
-            elif self.input_lines[curr_ind][0] == "/":
-                if self.input_lines[curr_ind][1] == "/":
-                    curr_ind += 1
-                    continue
-
-            # otherwise, it's a command
-            input_lines_without_comments.append(self.input_lines[curr_ind])
-            curr_ind += 1
-
-        self.input_lines = input_lines_without_comments
-
-
-def is_beginning_of_comment(curr_command):
-    curr_command = curr_command.replace("\t", "")
-    if len(curr_command) >= 2:
-        if curr_command[0] == "/":
-            if (curr_command[1] == "*") or (curr_command[1] == "*" and curr_command[2] == "*"):
-                return True
-    return False
-
-
-def is_end_of_comment(curr_command):
-    curr_command = curr_command.strip(" ")
-    curr_command = curr_command.replace("\t", "")
-    if len(curr_command) >= 2:
-        if curr_command[-1] == "/":
-            if curr_command[-2] == "*":
-                return True
-    return False
-
-
-if "__main__" == __name__:
-
-    if not len(sys.argv) == 2:
-        sys.exit("Invalid usage, please use: JackAnalyzer <input path>")
-    argument_path = os.path.abspath(sys.argv[1])
-    if os.path.isdir(argument_path):
-        files_to_assemble = [
-            os.path.join(argument_path, filename)
-            for filename in os.listdir(argument_path)]
-    else:
-        files_to_assemble = [argument_path]
-    for input_path in files_to_assemble:
-        filename, extension = os.path.splitext(input_path)
-        if extension.lower() != ".jack":
-            continue
-        output_path = filename + ".xml"
-        with open(input_path, 'r') as input_file, \
-                open(output_path, 'w') as output_file:
-            a = JackTokenizer(input_file)
-            while a.has_more_tokens():
-                a.advance()
-                print(a.keyword())
+
+def read_chunks(input_stream: typing.TextIO,
+                chunk_size: int) -> typing.Iterator[str]:
+    """Reads a stream in chunks. Files that are still at their start are
+    memory-mapped and decoded incrementally, anything else (pipes, in-memory
+    streams, partially read files) is read through the stream itself.
+
+    Args:
+        input_stream (typing.TextIO): input stream.
+        chunk_size (int): number of bytes (or characters) read at once.
+
+    Returns:
+        typing.Iterator[str]: the text of the stream, chunk by chunk.
+    """
+    mapped = None
+    try:
+        if input_stream.tell() == 0:
+            mapped = mmap.mmap(input_stream.fileno(), 0,
+                               access=mmap.ACCESS_READ)
+    except (AttributeError, OSError, ValueError):
+        # not a regular file, or an empty one, which cannot be mapped
+        mapped = None
+    if mapped is None:
+        chunk = input_stream.read(chunk_size)
+        while chunk:
+            yield chunk
+            chunk = input_stream.read(chunk_size)
+        return
+    encoding = getattr(input_stream, "encoding", None) or "utf-8"
+    decoder = codecs.getincrementaldecoder(encoding)()
+    with mapped:
+        for offset in range(0, len(mapped), chunk_size):
+            yield decoder.decode(mapped[offset:offset + chunk_size])
+        yield decoder.decode(b"", final=True)
+
+
+def stream_tokens(input_stream: typing.TextIO, chunk_size: int,
+                  max_tokens: typing.Optional[int] = None
+                  ) -> typing.Iterator[typing.Tuple[int, str, int]]:
+    """Breaks a Jack source into tokens lazily, a chunk at a time.
+
+    Only complete lines are lexed: line comments, strings, identifiers and
+    numbers all end before a newline. A block comment which is not closed
+    yet is carried over, together with the unfinished line, and only the
+    chunks read after it are searched for its end, so a long comment is
+    scanned in linear time. It is lexed once it is closed. Memory is thus
+    bounded by the longest line (or block comment) rather than by the size of
+    the file.
+
+    Args:
+        input_stream (typing.TextIO): input stream.
+        chunk_size (int): number of bytes (or characters) read at once.
+        max_tokens (typing.Optional[int]): if given, a ValueError is raised
+            once the source turns out to have more tokens.
+
+    Returns:
+        typing.Iterator[typing.Tuple[int, str, int]]: (kind, lexeme, line)
+        triples.
+    """
+    pattern = token_pattern()
+    error_group = pattern.groupindex["error"]
+    end_group = pattern.groupindex["end"]
+    int_group = pattern.groupindex["int"]
+    symbol_group = pattern.groupindex["symbol"]
+    chunks = read_chunks(input_stream, chunk_size)
+    tokens_left = max_tokens if max_tokens is not None else -1
+    line = 1
+    carry = ""
+    # while a block comment is open in the carry, where to search for its
+    # end: what comes before has been searched already
+    comment_search = None  # type: typing.Optional[int]
+    final = False
+    while not final:
+        chunk = next(chunks, None)
+        final = chunk is None
+        buffer = carry + chunk if not final else carry
+        if comment_search is not None and not final:
+            if buffer.find("*/", comment_search) < 0:
+                # the last character may be the '*' of the end
+                comment_search = max(comment_search, len(buffer) - 1)
+                carry = buffer
+                continue
+            comment_search = None
+        limit = len(buffer) if final else buffer.rfind("\n") + 1
+        pos = 0
+        # the newlines before this position are counted in line
+        counted = 0
+        for match in pattern.finditer(buffer, 0, limit):
+            group = match.lastindex
+            end = match.end()
+            if group == end_group:
+                pos = end
+                break
+            lexeme = match.group(group)
+            if not final and group == symbol_group and lexeme == "/" \
+                    and buffer.startswith("*", end):
+                # a block comment which is not closed yet
+                comment_search = end + 1
+                break
+            start = match.start(group)
+            line += buffer.count("\n", counted, start)
+            counted = start
+            if group == error_group or \
+                    (group == int_group and int(lexeme) > INT_MAX):
+                raise ValueError("Unexpected token %r in line %d"
+                                 % (lexeme, line))
+            if tokens_left == 0:
+                raise ValueError("Too many tokens: more than the limit of %d"
+                                 % max_tokens)
+            tokens_left -= 1
+            yield group - 1, lexeme, line
+            pos = end
+        line += buffer.count("\n", counted, pos)
+        carry = buffer[pos:]
+        if comment_search is not None:
+            comment_search -= pos
@@ -0,0 +1,50 @@
+"""
+The parse tree built by the CompilationEngine.
+
+A Node stands for a non-terminal of the Jack grammar and a Terminal for a
+single token. Their kinds are the tag names of the XML output, e.g. "class",
+"letStatement" or "term" for nodes and "keyword", "symbol", "identifier",
+"integerConstant" or "stringConstant" for terminals. Terminals are immutable,
+so the engine shares a single Terminal between all occurrences of the same
+token.
+"""
+import typing
+
+# the kinds of terminals, i.e. of tokens
+TERMINAL_KINDS = ("keyword", "symbol", "identifier", "integerConstant",
+                  "stringConstant")
+
+
+class Node:
+    """A non-terminal, with its terminals and nested non-terminals in source
+    order.
+    """
+    __slots__ = ("kind", "children")
+
+    def __init__(self, kind: str) -> None:
+        self.kind = kind
+        self.children = []  # type: typing.List[typing.Union[Node, Terminal]]
+
+    def __repr__(self) -> str:
+        return "Node(%r, %d children)" % (self.kind, len(self.children))
+
+
+class Terminal:
+    """A single token."""
+    __slots__ = ("kind", "token")
+
+    def __init__(self, kind: str, token: str) -> None:
+        self.kind = kind
+        self.token = token
+
+    def __repr__(self) -> str:
+        return "Terminal(%r, %r)" % (self.kind, self.token)
+
+
+def terminal_tables() -> typing.Dict[str, typing.Dict[str, Terminal]]:
+    """
+    Returns:
+        typing.Dict[str, typing.Dict[str, Terminal]]: empty tables, one per
+        kind of terminal, mapping tokens to their shared Terminal.
+    """
+    return {kind: {} for kind in TERMINAL_KINDS}
@@ -0,0 +1,115 @@
+"""
+Per-phase timings and counters of the analysis of a file, for
+JackAnalyzer --profile.
+
+A FileProfile is only created when profiling, and the engine's backend is
+then wrapped in a ProfilingBackend which times the emission of the tree
+(and counts its nodes), so a build that is not profiled runs exactly the
+same code as before.
+"""
+import time
+import typing
+from ParseTree import Node, Terminal
+
+# the phases of the analysis of a file, in order
+PHASES = ("read", "tokenize", "parse", "emit")
+COUNTERS = ("tokens", "cached_tokens", "nodes", "terminals", "writes")
+
+
+class FileProfile:
+    """The time spent in every phase of the analysis of a file, and counts of
+    what was processed."""
+
+    def __init__(self) -> None:
+        # seconds per phase, None for a phase which cannot be told apart
+        # (the streaming tokenizer reads and lexes while the file is parsed)
+        self.timings = dict.fromkeys(PHASES, 0.0)  # type: typing.Dict[str, typing.Optional[float]]
+        self.counters = dict.fromkeys(COUNTERS, 0)  # type: typing.Dict[str, typing.Optional[int]]
+
+    def add_time(self, phase: str, start: float) -> float:
+        """Adds the time since start to a phase.
+
+        Args:
+            phase (str): one of PHASES.
+            start (float): a time.perf_counter() reading.
+
+        Returns:
+            float: the current time.perf_counter() reading.
+        """
+        now = time.perf_counter()
+        self.timings[phase] += now - start
+        return now
+
+    def as_dict(self) -> typing.Dict[str, typing.Dict]:
+        """
+        Returns:
+            typing.Dict[str, typing.Dict]: the timings and counters, ready to
+            be serialized as JSON.
+        """
+        return {"timings": dict(self.timings),
+                "counters": dict(self.counters)}
+
+
+class ProfilingBackend:
+    """Wraps a backend of the CompilationEngine, timing everything it does
+    and counting the nodes and terminals it is handed."""
+
+    def __init__(self, backend, profile: FileProfile) -> None:
+        """
+        Args:
+            backend: the backend to wrap.
+            profile (FileProfile): where to record the emission.
+        """
+        self.backend = backend
+        self.profile = profile
+
+    def write_class_children(self, tree: Node, children: typing.List[
+            typing.Union[Node, Terminal]]) -> None:
+        self.count(children)
+        start = time.perf_counter()
+        self.backend.write_class_children(tree, children)
+        self.profile.add_time("emit", start)
+
+    def finish_class(self, tree: Node) -> None:
+        start = time.perf_counter()
+        self.backend.finish_class(tree)
+        self.profile.add_time("emit", start)
+
+    def count(self, nodes: typing.List[typing.Union[Node, Terminal]]) -> None:
+        counters = self.profile.counters
+        stack = list(nodes)
+        while stack:
+            node = stack.pop()
+            if type(node) is Terminal:
+                counters["terminals"] += 1
+            else:
+                counters["nodes"] += 1
+                stack.extend(node.children)
+
+
+def summarize(profiles: typing.List[typing.Dict[str, typing.Dict]]
+              ) -> typing.Dict[str, typing.Dict]:
+    """Adds up the profiles of several files.
+
+    Args:
+        profiles (typing.List[typing.Dict[str, typing.Dict]]): profiles, as
+            returned by FileProfile.as_dict().
+
+    Returns:
+        typing.Dict[str, typing.Dict]: the total of every timing and counter
+        (missing values are skipped), and the share of the total time each
+        phase took.
+    """
+    timings = dict.fromkeys(PHASES, 0.0)
+    counters = dict.fromkeys(COUNTERS, 0)
+    for profile in profiles:
+        for phase, seconds in profile["timings"].items():
+            if seconds is not None:
+                timings[phase] += seconds
+        for counter, count in profile["counters"].items():
+            if count is not None:
+                counters[counter] += count
+    total = sum(timings.values())
+    shares = {phase: seconds / total if total else 0.0
+              for phase, seconds in timings.items()}
+    return {"timings": timings, "counters": counters, "shares": shares}
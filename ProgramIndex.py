@@ -0,0 +1,261 @@
+"""
+A whole-program index of the classes of a Jack program: the signature of
+every subroutine and the subroutines it calls.
+
+Jack has no function pointers, so every call names its callee statically,
+and the subroutines reachable from the entry point of the program can be
+found by walking the calls from Sys.init (or from Main.main, when the OS is
+not part of the program). The rest can never run, and need not be compiled
+at all. The calls include those to the OS which the CodeGenerator emits
+implicitly, e.g. Math.multiply for '*' and Memory.alloc in constructors, so
+OS classes compiled with the program keep what it needs of them.
+
+A ClassIndexer is a backend of the CompilationEngine, like the XMLWriter and
+the CodeGenerator, so a class is indexed a declaration at a time, as it is
+parsed (also from a streaming tokenizer, with bounded memory). The entries
+of the classes are small, and are gathered into a ProgramIndex.
+"""
+import typing
+from CodeGenerator import BINARY_CALLS
+from ParseTree import Node, Terminal
+
+# where a Jack program starts running (Sys.init calls it)
+ENTRY_POINT = "Main.main"
+# where the OS starts running the program, when Sys is part of it
+SYS_ENTRY_POINT = "Sys.init"
+# the subroutines which the OS's Sys.init calls before Main.main, roots of the
+# program when Sys is not part of it
+OS_INITS = ("Memory.init", "Math.init", "Screen.init", "Output.init",
+            "Keyboard.init")
+
+
+class Subroutine(typing.NamedTuple):
+    """The signature of a subroutine, and what it calls."""
+    # "constructor", "function" or "method"
+    kind: str
+    return_type: str
+    # (type, name) of every parameter
+    parameters: typing.Tuple[typing.Tuple[str, str], ...]
+    # the full names of the subroutines it calls (e.g. "Math.abs"), in the
+    # order of their first call
+    calls: typing.Tuple[str, ...]
+
+
+class ClassEntry(typing.NamedTuple):
+    """The entry of a class in the ProgramIndex."""
+    name: str
+    # its subroutines, by their (short) names, in source order
+    subroutines: typing.Dict[str, Subroutine]
+
+
+class ClassIndexer:
+    """Indexes the class-level declarations of a parse tree."""
+
+    def __init__(self) -> None:
+        self.class_name = None  # type: typing.Optional[str]
+        # the types of the static and field variables, by their names
+        self.class_types = {}  # type: typing.Dict[str, str]
+        self.subroutines = {}  # type: typing.Dict[str, Subroutine]
+
+    def write_class_children(self, tree: Node, children: typing.List[
+            typing.Union[Node, Terminal]]) -> None:
+        """Indexes the given (newly parsed) children of a class.
+
+        Args:
+            tree (Node): the class.
+            children (typing.List[typing.Union[Node, Terminal]]): its children
+                which were not handed to the indexer before.
+        """
+        for child in children:
+            if type(child) is Terminal:
+                if child.kind == "identifier" and self.class_name is None:
+                    self.class_name = child.token
+            elif child.kind == "classVarDec":
+                add_types(self.class_types, child)
+            elif child.kind == "subroutineDec":
+                self.index_subroutine(child)
+
+    def finish_class(self, tree: Node) -> None:
+        pass
+
+    def entry(self) -> ClassEntry:
+        """
+        Returns:
+            ClassEntry: the entry of the indexed class.
+        """
+        return ClassEntry(self.class_name, self.subroutines)
+
+    def index_subroutine(self, subroutine: Node) -> None:
+        children = subroutine.children
+        parameters = children[4].children
+        body = children[6].children
+        signature = tuple((parameters[ind].token, parameters[ind + 1].token)
+                          for ind in range(0, len(parameters), 3))
+        # the variables of the subroutine hide those of the class
+        types = dict(self.class_types)
+        types.update((name, var_type) for var_type, name in signature)
+        for declaration in body[1:-2]:
+            add_types(types, declaration)
+        calls = {}  # type: typing.Dict[str, None]
+        # the OS is also called implicitly by the code the CodeGenerator
+        # emits: to allocate objects, for * and /, and for string constants
+        if children[0].token == "constructor":
+            calls["Memory.alloc"] = None
+        stack = [body[-2]]  # type: typing.List[typing.Union[Node, Terminal]]
+        while stack:
+            node = stack.pop()
+            if type(node) is Terminal:
+                # an operator which calls the OS
+                calls[BINARY_CALLS[node.token]] = None
+                continue
+            node_children = node.children
+            if node.kind == "doStatement":
+                calls[self.callee(node_children[1:-1], types)] = None
+            elif node.kind == "term":
+                first = node_children[0]
+                if first.kind == "stringConstant":
+                    calls["String.new"] = None
+                    if first.token:
+                        calls["String.appendChar"] = None
+                elif len(node_children) > 1 and \
+                        first.kind == "identifier" and \
+                        node_children[1].token in ("(", "."):
+                    calls[self.callee(node_children, types)] = None
+            elif node.kind == "expression":
+                # an operator is applied after the term following it
+                ordered = node_children[:1]
+                for ind in range(1, len(node_children), 2):
+                    ordered.append(node_children[ind + 1])
+                    if node_children[ind].token in BINARY_CALLS:
+                        ordered.append(node_children[ind])
+                node_children = ordered
+            # children are pushed in reverse, so calls are found in order
+            for child in reversed(node_children):
+                if type(child) is Node or node.kind == "expression":
+                    stack.append(child)
+        self.subroutines[children[2].token] = Subroutine(
+            children[0].token, children[1].token, signature, tuple(calls))
+
+    def callee(self, parts: typing.List[typing.Union[Node, Terminal]],
+               types: typing.Dict[str, str]) -> str:
+        """
+        Args:
+            parts (typing.List[typing.Union[Node, Terminal]]): a subroutine
+                call, as in CodeGenerator.compile_call.
+            types (typing.Dict[str, str]): the types of the variables in
+                scope, by their names.
+
+        Returns:
+            str: the full name of the subroutine it calls, resolved the way
+            the CodeGenerator resolves it.
+        """
+        if parts[1].token == ".":
+            receiver = parts[0].token
+            return types.get(receiver, receiver) + "." + parts[2].token
+        return self.class_name + "." + parts[0].token
+
+
+class ProgramIndex:
+    """The entries of all the classes of a program."""
+
+    def __init__(self) -> None:
+        self.classes = {}  # type: typing.Dict[str, ClassEntry]
+
+    def add(self, entry: ClassEntry) -> None:
+        """Adds (or replaces) the entry of a class."""
+        self.classes[entry.name] = entry
+
+    def subroutine(self, full_name: str) -> typing.Optional[Subroutine]:
+        """
+        Args:
+            full_name (str): e.g. "Main.main".
+
+        Returns:
+            typing.Optional[Subroutine]: the subroutine, or None if it is not
+            part of the program (e.g. it belongs to the OS).
+        """
+        class_name, _, name = full_name.partition(".")
+        entry = self.classes.get(class_name)
+        return entry.subroutines.get(name) if entry is not None else None
+
+    def subroutine_names(self) -> typing.List[str]:
+        """
+        Returns:
+            typing.List[str]: the full names of all the subroutines of the
+            program.
+        """
+        return [class_name + "." + name
+                for class_name, entry in self.classes.items()
+                for name in entry.subroutines]
+
+    def entry_points(self) -> typing.Tuple[str, ...]:
+        """
+        Returns:
+            typing.Tuple[str, ...]: the full names of the subroutines the
+            program starts from: Sys.init if the program has it, otherwise
+            Main.main and the OS initializations which Sys.init would call.
+        """
+        if self.subroutine(SYS_ENTRY_POINT) is not None:
+            return (SYS_ENTRY_POINT,)
+        return (ENTRY_POINT,) + OS_INITS
+
+    def undefined_calls(self) -> typing.List[typing.Tuple[str, str]]:
+        """
+        Returns:
+            typing.List[typing.Tuple[str, str]]: the calls, as (caller,
+            callee) full names, to subroutines of classes of the program
+            which those classes do not define, in index order.
+        """
+        undefined = []
+        for class_name, entry in self.classes.items():
+            for name, subroutine in entry.subroutines.items():
+                for callee in subroutine.calls:
+                    if callee.partition(".")[0] in self.classes and \
+                            self.subroutine(callee) is None:
+                        undefined.append((class_name + "." + name, callee))
+        return undefined
+
+    def reachable(self, roots: typing.Iterable[str] = (ENTRY_POINT,)
+                  ) -> typing.Set[str]:
+        """
+        Args:
+            roots (typing.Iterable[str]): the full names of the subroutines
+                the program starts from.
+
+        Returns:
+            typing.Set[str]: the full names of the subroutines of the program
+            which the roots call, directly or indirectly, and of the roots
+            themselves. Subroutines which are not part of the program are
+            left out.
+        """
+        reached = set()  # type: typing.Set[str]
+        stack = list(roots)
+        while stack:
+            full_name = stack.pop()
+            if full_name in reached:
+                continue
+            subroutine = self.subroutine(full_name)
+            if subroutine is None:
+                continue
+            reached.add(full_name)
+            stack.extend(subroutine.calls)
+        return reached
+
+    def unreachable(self, roots: typing.Iterable[str] = (ENTRY_POINT,)
+                    ) -> typing.List[str]:
+        """
+        Returns:
+            typing.List[str]: the full names of the subroutines of the program
+            which can never be called from the roots, in index order.
+        """
+        reached = self.reachable(roots)
+        return [full_name for full_name in self.subroutine_names()
+                if full_name not in reached]
+
+
+def add_types(types: typing.Dict[str, str], declaration: Node) -> None:
+    """Adds the variables of a classVarDec or a varDec to types."""
+    children = declaration.children
+    var_type = children[1].token
+    for child in children[2::2]:
+        types[child.token] = var_type
@@ -0,0 +1,217 @@
+"""
+A binary on-disk cache of the token tables of Jack sources ("sidecars").
+
+A sidecar holds everything a TokenTable has but the source itself: the kinds,
+spans and lexeme ids of the tokens and the interned lexicon, together with a
+hash of the source and of the tokenizer that lexed it. On a later run the
+sidecar is memory-mapped and the arrays of the table are views of the mapped
+file, so an unchanged source is not lexed again, and nothing is copied but
+the lexicon. A sidecar whose hashes do not match (or which is truncated or
+corrupt) is ignored, and replaced by the sidecar of a fresh scan.
+
+The layout is a fixed header, then the arrays, each starting at a multiple
+of 4 bytes:
+
+    header      HEADER (see below)
+    kinds       num_tokens bytes
+    starts      num_tokens unsigned ints
+    ends        num_tokens unsigned ints
+    lexeme_ids  num_tokens unsigned ints
+    offsets     num_lexemes + 1 unsigned ints, into the lexicon blob
+    lexicon     the lexemes, UTF-8 encoded and concatenated
+
+The unsigned ints are stored in the native byte order and size of array("I"),
+which the header records, so a sidecar written on another platform is
+simply rejected.
+"""
+import array
+import functools
+import hashlib
+import mmap
+import os
+import struct
+import sys
+import tempfile
+import typing
+import zlib
+import JackTokenizer
+from JackTokenizer import TokenTable, scan
+
+MAGIC = b"JTOK"
+FORMAT_VERSION = 1
+# magic, format version, size of an unsigned int, byte order (0 for little
+# endian), tokenizer digest, source digest, number of tokens, number of
+# lexemes, size of the lexicon in bytes, CRC-32 of everything after the header
+HEADER = struct.Struct("<4sHBB32s32sIIII")
+SIDECAR_EXTENSION = ".tok"
+UINT_SIZE = array.array("I").itemsize
+BYTE_ORDER = 0 if sys.byteorder == "little" else 1
+
+
+@functools.lru_cache(maxsize=None)
+def tokenizer_digest() -> bytes:
+    """
+    Returns:
+        bytes: a digest of the tokenizer's source, so that any change to the
+        lexical rules invalidates the sidecars written before it.
+    """
+    with open(JackTokenizer.__file__, 'rb') as tokenizer_file:
+        return hashlib.sha256(tokenizer_file.read()).digest()
+
+
+def source_digest(source: str) -> bytes:
+    """
+    Returns:
+        bytes: the digest a sidecar records of the source it was lexed from.
+    """
+    return hashlib.sha256(source.encode("utf-8", "surrogatepass")).digest()
+
+
+def sidecar_path(input_path: str, sidecar_dir: str) -> str:
+    """
+    Args:
+        input_path (str): path of a .jack file.
+        sidecar_dir (str): the directory holding the sidecars.
+
+    Returns:
+        str: the path of the sidecar of the file. It is named after the file
+        and its absolute path, so files of the same name in different
+        directories do not share it.
+    """
+    location = hashlib.sha1(os.path.abspath(input_path).encode()).hexdigest()
+    return os.path.join(sidecar_dir, "%s-%s%s" % (
+        os.path.basename(input_path), location[:12], SIDECAR_EXTENSION))
+
+
+def save_tokens(table: TokenTable, path: str) -> None:
+    """Writes the sidecar of a token table, atomically: a sidecar which is
+    mapped by another process is replaced, never modified.
+
+    Args:
+        table (TokenTable): the tokens of a source, as returned by scan().
+        path (str): where to write the sidecar.
+    """
+    encoded = [lexeme.encode("utf-8", "surrogatepass")
+               for lexeme in table.lexicon]
+    offsets = array.array("I", [0])
+    for lexeme in encoded:
+        offsets.append(offsets[-1] + len(lexeme))
+    body = [pad(bytes(table.kinds)), array.array("I", table.starts).tobytes(),
+            array.array("I", table.ends).tobytes(),
+            array.array("I", table.lexeme_ids).tobytes(), offsets.tobytes(),
+            b"".join(encoded)]
+    checksum = 0
+    for section in body:
+        checksum = zlib.crc32(section, checksum)
+    header = HEADER.pack(
+        MAGIC, FORMAT_VERSION, UINT_SIZE, BYTE_ORDER, tokenizer_digest(),
+        source_digest(table.source), len(table.kinds), len(table.lexicon),
+        offsets[-1], checksum)
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    descriptor, temp_path = tempfile.mkstemp(dir=directory)
+    try:
+        with os.fdopen(descriptor, 'wb') as sidecar_file:
+            sidecar_file.write(header)
+            sidecar_file.writelines(body)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+
+def load_tokens(path: str, source: str) -> typing.Optional[TokenTable]:
+    """Maps the sidecar of a source into memory.
+
+    Args:
+        path (str): the sidecar.
+        source (str): the source it should have been lexed from.
+
+    Returns:
+        typing.Optional[TokenTable]: the tokens of the source, or None if the
+        sidecar is missing, or does not match the source, the tokenizer or
+        the platform, or fails its checksum.
+    """
+    try:
+        with open(path, 'rb') as sidecar_file:
+            mapped = mmap.mmap(sidecar_file.fileno(), 0,
+                               access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        # missing, or empty (which cannot be mapped)
+        return None
+    if len(mapped) < HEADER.size:
+        return None
+    magic, version, uint_size, byte_order, tokenizer, digest, num_tokens, \
+        num_lexemes, lexicon_size, checksum = HEADER.unpack_from(mapped)
+    if magic != MAGIC or version != FORMAT_VERSION or \
+            uint_size != UINT_SIZE or byte_order != BYTE_ORDER or \
+            tokenizer != tokenizer_digest() or \
+            digest != source_digest(source):
+        return None
+    kinds_start = HEADER.size
+    starts_start = kinds_start + padded_size(num_tokens)
+    ends_start = starts_start + num_tokens * UINT_SIZE
+    ids_start = ends_start + num_tokens * UINT_SIZE
+    offsets_start = ids_start + num_tokens * UINT_SIZE
+    lexicon_start = offsets_start + (num_lexemes + 1) * UINT_SIZE
+    if len(mapped) != lexicon_start + lexicon_size:
+        return None
+    view = memoryview(mapped)
+    if zlib.crc32(view[kinds_start:]) != checksum:
+        return None
+    offsets = view[offsets_start:lexicon_start].cast("I")
+    blob = view[lexicon_start:]
+    table = TokenTable(source)
+    # the arrays are read-only views of the mapped sidecar, which stays
+    # mapped for as long as they are referenced
+    table.kinds = view[kinds_start:kinds_start + num_tokens]
+    table.starts = view[starts_start:ends_start].cast("I")
+    table.ends = view[ends_start:ids_start].cast("I")
+    table.lexeme_ids = view[ids_start:offsets_start].cast("I")
+    try:
+        table.lexicon = [
+            str(blob[offsets[index]:offsets[index + 1]], "utf-8",
+                "surrogatepass") for index in range(num_lexemes)]
+    except (UnicodeDecodeError, IndexError):
+        return None
+    return table
+
+
+def cached_scan(source: str, path: str) -> typing.Tuple[TokenTable, bool]:
+    """Loads the tokens of a source from its sidecar, or scans the source and
+    writes a fresh sidecar for the next run.
+
+    Args:
+        source (str): the full text of a Jack file.
+        path (str): the path of its sidecar.
+
+    Returns:
+        typing.Tuple[TokenTable, bool]: the tokens of the source, and True if
+        they were loaded from the sidecar.
+    """
+    table = load_tokens(path, source)
+    if table is not None:
+        return table, True
+    table = scan(source)
+    try:
+        save_tokens(table, path)
+    except OSError:
+        # the sidecar only saves time, so failing to write it is no error
+        pass
+    return table, False
+
+
+def padded_size(size: int) -> int:
+    """
+    Returns:
+        int: the size rounded up to a multiple of the size of an unsigned int.
+    """
+    return -(-size // UINT_SIZE) * UINT_SIZE
+
+
+def pad(data: bytes) -> bytes:
+    """
+    Returns:
+        bytes: the data padded with zeros to padded_size(len(data)).
+    """
+    return data + bytes(padded_size(len(data)) - len(data))
@@ -0,0 +1,294 @@
+"""
+Optimizes the VM code of a subroutine, as generated by the CodeGenerator.
+
+The optimizer makes a single pass over the commands, rewriting the tail of
+its output as every command is appended, so one rewrite can enable the next
+(e.g. folding "2 * 8" into 16 lets "16 + 1" fold into 17). It
+
+- folds arithmetic on constants, including calls to Math.multiply and
+  Math.divide, with the 16-bit wrap-around of the Hack platform;
+- drops the identities x + 0, x - 0, x | 0, x & -1, x * 1 and x / 1;
+- reduces multiplication by 2^k to k shiftleft commands, and division by 2^k
+  to k shiftright commands when the dividend is known not to be negative
+  (an arithmetic shift rounds negative quotients the wrong way), as long as
+  the shifts are no more commands than the constant and the call they
+  replace (e.g. for x * 4, but not for x * 16384);
+- removes push/pop pairs of the same slot, double neg and double not, jumps
+  to the very next command and conditional jumps on constants.
+
+Expressions never contain control flow, so the operands of a command can be
+found by walking back over the stack effects of the commands before it.
+"""
+import typing
+
+WORD_BITS = 16
+MAX_CONSTANT = 32767
+PUSH_CONSTANT = "push constant "
+
+UNARY_FOLDS = {
+    "neg": lambda x: -x,
+    "not": lambda x: ~x,
+    "shiftleft": lambda x: x << 1,
+    "shiftright": lambda x: x >> 1,
+}  # type: typing.Dict[str, typing.Callable[[int], int]]
+BINARY_FOLDS = {
+    "add": lambda x, y: x + y,
+    "sub": lambda x, y: x - y,
+    "and": lambda x, y: x & y,
+    "or": lambda x, y: x | y,
+    "lt": lambda x, y: -(x < y),
+    "gt": lambda x, y: -(x > y),
+    "eq": lambda x, y: -(x == y),
+    "call Math.multiply 2": lambda x, y: x * y,
+    "call Math.divide 2": lambda x, y: divide(x, y),
+}  # type: typing.Dict[str, typing.Callable[[int, int], typing.Optional[int]]]
+# right operands which leave the left operand as it is
+RIGHT_IDENTITIES = {"add": 0, "sub": 0, "or": 0, "and": -1,
+                    "call Math.multiply 2": 1, "call Math.divide 2": 1}
+# left operands which leave the right operand as it is
+LEFT_IDENTITIES = {"add": 0, "or": 0, "and": -1, "call Math.multiply 2": 1}
+
+
+def optimize(commands: typing.List[str]) -> typing.List[str]:
+    """
+    Args:
+        commands (typing.List[str]): the VM commands of a subroutine.
+
+    Returns:
+        typing.List[str]: equivalent, and usually fewer, commands.
+    """
+    output = []  # type: typing.List[str]
+    for command in commands:
+        append(output, command)
+    return output
+
+
+def append(output: typing.List[str], command: str) -> None:
+    """Appends a command to output, rewriting the end of output with it when
+    possible."""
+    if command in UNARY_FOLDS:
+        constant = top_constant(output, len(output))
+        if constant is not None:
+            value, length = constant
+            replace(output, len(output) - length,
+                    UNARY_FOLDS[command](value))
+            return
+        if command in ("neg", "not") and output and output[-1] == command:
+            output.pop()
+            return
+    elif command in BINARY_FOLDS:
+        if rewrite_binary(output, command):
+            return
+    elif command.startswith("pop "):
+        if output and output[-1] == "push " + command[4:]:
+            output.pop()
+            return
+    elif command.startswith("if-goto "):
+        constant = top_constant(output, len(output))
+        if constant is not None:
+            value, length = constant
+            del output[len(output) - length:]
+            if value != 0:
+                output.append("goto " + command[8:])
+            return
+    elif command.startswith("label "):
+        if output and output[-1] == "goto " + command[6:]:
+            output.pop()
+    output.append(command)
+
+
+def rewrite_binary(output: typing.List[str], command: str) -> bool:
+    """Folds, simplifies or strength-reduces a binary operation on the two
+    values at the end of output.
+
+    Returns:
+        bool: True if the operation was handled, False if it should simply
+        be appended.
+    """
+    end = len(output)
+    right = top_constant(output, end)
+    if right is not None:
+        right_value, right_length = right
+        right_start = end - right_length
+        left = top_constant(output, right_start)
+        if left is not None:
+            result = BINARY_FOLDS[command](left[0], right_value)
+            if result is None:
+                return False
+            replace(output, right_start - left[1], result)
+            return True
+        if RIGHT_IDENTITIES.get(command) == to_word(right_value):
+            del output[right_start:]
+            return True
+        shift = log2(right_value)
+        # the shifts replace the constant and the call
+        if shift is None or shift > right_length + 1:
+            return False
+        if command == "call Math.multiply 2":
+            output[right_start:] = ["shiftleft"] * shift
+            return True
+        left_start = value_start(output, right_start)
+        if command == "call Math.divide 2" and left_start is not None and \
+                is_non_negative(output, left_start, right_start):
+            output[right_start:] = ["shiftright"] * shift
+            return True
+        return False
+    # a constant on the left (pushed before the right operand is computed)
+    right_start = value_start(output, end)
+    if right_start is None:
+        return False
+    left = top_constant(output, right_start)
+    if left is None:
+        return False
+    left_value, left_length = left
+    left_start = right_start - left_length
+    if LEFT_IDENTITIES.get(command) == to_word(left_value):
+        # the constant has no side effects, so it can simply be dropped
+        del output[left_start:right_start]
+        return True
+    if command == "sub" and left_value == 0:
+        del output[left_start:right_start]
+        output.append("neg")
+        return True
+    shift = log2(left_value)
+    if command == "call Math.multiply 2" and shift is not None and \
+            shift <= left_length + 1:
+        del output[left_start:right_start]
+        output.extend(["shiftleft"] * shift)
+        return True
+    return False
+
+
+def top_constant(output: typing.List[str], end: int
+                 ) -> typing.Optional[typing.Tuple[int, int]]:
+    """
+    Returns:
+        typing.Optional[typing.Tuple[int, int]]: if the commands ending at
+        output[end - 1] push a constant (as "push constant n", possibly
+        followed by neg or not), that constant and the number of commands
+        pushing it, otherwise None.
+    """
+    if end < 1:
+        return None
+    last = output[end - 1]
+    if last.startswith(PUSH_CONSTANT):
+        return int(last[len(PUSH_CONSTANT):]), 1
+    if (last == "neg" or last == "not") and end >= 2 and \
+            output[end - 2].startswith(PUSH_CONSTANT):
+        value = int(output[end - 2][len(PUSH_CONSTANT):])
+        return UNARY_FOLDS[last](value), 2
+    return None
+
+
+def value_start(output: typing.List[str], end: int) -> typing.Optional[int]:
+    """
+    Returns:
+        typing.Optional[int]: the index of the first of the commands, ending
+        at output[end - 1], that compute the value on top of the stack, or
+        None if they could not be told apart from control flow.
+    """
+    depth = 0
+    index = end
+    while index > 0:
+        index -= 1
+        effect = stack_effect(output[index])
+        if effect is None:
+            return None
+        depth += effect
+        if depth == 1:
+            return index
+    return None
+
+
+def stack_effect(command: str) -> typing.Optional[int]:
+    """
+    Returns:
+        typing.Optional[int]: how many values the command adds to the stack
+        (negative if it removes values), or None for control flow commands.
+    """
+    if command.startswith("push "):
+        return 1
+    if command.startswith("pop "):
+        return -1
+    if command in UNARY_FOLDS:
+        return 0
+    if command in BINARY_FOLDS and not command.startswith("call "):
+        return -1
+    if command.startswith("call "):
+        return 1 - int(command.rsplit(" ", 1)[1])
+    return None
+
+
+def is_non_negative(output: typing.List[str], start: int, end: int) -> bool:
+    """
+    Returns:
+        bool: True if the value computed by output[start:end] is known not to
+        be negative: a non-negative constant, or the bitwise and of a value
+        with a non-negative constant.
+    """
+    constant = top_constant(output, end)
+    if constant is not None:
+        return end - constant[1] == start and to_word(constant[0]) >= 0
+    if output[end - 1] == "and":
+        right = top_constant(output, end - 1)
+        if right is not None and to_word(right[0]) >= 0:
+            return True
+        right_start = value_start(output, end - 1)
+        if right_start is not None:
+            left = top_constant(output, right_start)
+            return left is not None and to_word(left[0]) >= 0
+    return False
+
+
+def replace(output: typing.List[str], start: int, value: int) -> None:
+    """Replaces output[start:] with commands pushing the given constant."""
+    output[start:] = constant_commands(value)
+
+
+def constant_commands(value: int) -> typing.List[str]:
+    """
+    Returns:
+        typing.List[str]: the shortest commands pushing the given constant
+        (reduced to a 16-bit word).
+    """
+    value = to_word(value)
+    if value >= 0:
+        return [PUSH_CONSTANT + str(value)]
+    if value == -MAX_CONSTANT - 1:
+        return [PUSH_CONSTANT + str(MAX_CONSTANT), "not"]
+    return [PUSH_CONSTANT + str(-value), "neg"]
+
+
+def to_word(value: int) -> int:
+    """
+    Returns:
+        int: the value wrapped around to a signed 16-bit word.
+    """
+    half = 1 << (WORD_BITS - 1)
+    return ((value + half) & ((1 << WORD_BITS) - 1)) - half
+
+
+def divide(dividend: int, divisor: int) -> typing.Optional[int]:
+    """
+    Returns:
+        typing.Optional[int]: the quotient as Math.divide computes it
+        (rounded towards zero), or None for a division by zero, which is left
+        for the program to report.
+    """
+    dividend, divisor = to_word(dividend), to_word(divisor)
+    if divisor == 0:
+        return None
+    quotient = abs(dividend) // abs(divisor)
+    return quotient if (dividend < 0) == (divisor < 0) else -quotient
+
+
+def log2(value: int) -> typing.Optional[int]:
+    """
+    Returns:
+        typing.Optional[int]: k if the value is 2^k for some 0 < k < 15,
+        otherwise None.
+    """
+    value = to_word(value)
+    if value < 2 or value & (value - 1):
+        return None
+    return value.bit_length() - 1
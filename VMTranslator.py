@@ -0,0 +1,534 @@
+"""
+Translates VM code into Hack assembly.
+
+The translation is written for the size of its output, so that whole
+programs (with the OS) fit in the 32K words of the ROM:
+
+- call, return and the comparisons are shared stubs, placed after the
+  program, which a command jumps to with its return address in D. A call is
+  8 instructions instead of about 45, a return 2 instead of about 50, and a
+  comparison 4 instead of about 12;
+- a pushed value passes through D, so a push followed by a pop, a binary
+  command or an if-goto skips the stack, e.g. "push local 2, pop that 0" is
+  a load and a store;
+- small offsets into local, argument, this and that are reached by
+  incrementing A, rather than by an addition through a scratch register.
+
+shiftleft and shiftright use the shift instructions of the extended ALU
+(M=M<< and M=M>>). The stubs keep their state in R13-R15.
+
+The names of VM functions and labels may not contain '$' (as in the VM
+specification), which leaves the assembly labels starting with "$$" (the
+stubs) or containing "$$" (the return addresses) to the translator.
+
+Usage: VMTranslator.py PATH [--bootstrap], where PATH is a .vm file or a
+directory of them, which are translated into a single .asm file named after
+it.
+"""
+import argparse
+import os
+import re
+import sys
+import time
+import typing
+
+# the number of words of the Hack ROM
+ROM_SIZE = 32768
+MAX_CONSTANT = 32767
+# the full name of the subroutine the bootstrap code calls
+BOOTSTRAP_ENTRY = "Sys.init"
+STACK_BASE = 256
+
+# the segments reached through a base pointer
+BASES = {"local": "LCL", "argument": "ARG", "this": "THIS", "that": "THAT"}
+# the segments at fixed addresses, and their sizes
+FIXED = {"pointer": (3, 2), "temp": (5, 8)}
+
+POP_D = ["@SP", "AM=M-1", "D=M"]
+PUSH_D = ["@SP", "AM=M+1", "A=A-1", "M=D"]
+# the binary commands, with y in D and A pointing to x
+BINARY = {"add": "M=D+M", "sub": "M=M-D", "and": "M=D&M", "or": "M=D|M"}
+# the unary commands, with A pointing to their operand
+UNARY = {"neg": "M=-M", "not": "M=!M", "shiftleft": "M=M<<",
+         "shiftright": "M=M>>"}
+COMPARISONS = ("eq", "gt", "lt")
+# the names of VM functions and labels
+NAME = re.compile(r"[A-Za-z_.:][A-Za-z0-9_.:]*\Z")
+
+# a general store through a base pointer, with the value in D
+LONG_STORE = 13
+
+
+class VMTranslator:
+    """
+    Translates the VM files of a program into a single list of assembly
+    lines. The shared stubs which the translated files use are added by
+    finish().
+    """
+
+    def __init__(self) -> None:
+        self.lines = []  # type: typing.List[str]
+        self.add = self.lines.extend
+        # the names of the comparison stubs used, in order of first use
+        self.comparisons = {}  # type: typing.Dict[str, None]
+        # the numbers of arguments of the calls made
+        self.arities = set()  # type: typing.Set[int]
+        self.returns = False
+        self.file_name = ""
+        self.function = ""
+        self.labels = 0
+
+    def write_bootstrap(self) -> int:
+        """Writes the code which sets up the stack and calls Sys.init. It
+        must be written first, as the program starts at address 0.
+
+        Returns:
+            int: the number of instructions written.
+        """
+        start = len(self.lines)
+        self.add(["@%d" % STACK_BASE, "D=A", "@SP", "M=D"])
+        self.function = "$bootstrap"
+        self.call(BOOTSTRAP_ENTRY, 0)
+        return count_instructions(self.lines[start:])
+
+    def translate(self, file_name: str, source: str
+                  ) -> typing.Dict[str, typing.Any]:
+        """Translates a VM file.
+
+        Args:
+            file_name (str): the name of the file without its extension,
+                which names its static variables.
+            source (str): the VM code.
+
+        Returns:
+            typing.Dict[str, typing.Any]: the name of the file ("class"), its
+            number of VM commands and of the instructions they were
+            translated into.
+        """
+        commands = parse(source)
+        self.file_name = file_name
+        self.function = file_name
+        start = len(self.lines)
+        index = 0
+        while index < len(commands):
+            index = self.translate_command(commands, index)
+        return {"class": file_name, "commands": len(commands),
+                "instructions": count_instructions(self.lines[start:])}
+
+    def finish(self) -> int:
+        """Writes the shared stubs which the translated files use.
+
+        Returns:
+            int: the number of instructions written.
+        """
+        start = len(self.lines)
+        if not (self.comparisons or self.arities or self.returns):
+            return 0
+        # a program which ends (instead of looping) must not run into the
+        # stubs
+        self.add(["($$END)", "@$$END", "0;JMP"])
+        arities = sorted(self.arities)
+        for position, arity in enumerate(arities):
+            # pushes the return address, and passes the size of the frame
+            # the caller pushes on to $$CALL, which follows the last arity
+            self.add(["($$CALL.%d)" % arity] + PUSH_D +
+                     ["@%d" % (arity + 5), "D=A"])
+            if position < len(arities) - 1:
+                self.add(["@$$CALL", "0;JMP"])
+        if arities:
+            self.add(["($$CALL)", "@R14", "M=D"])
+            for pointer in ("LCL", "ARG", "THIS", "THAT"):
+                self.add(["@" + pointer, "D=M"] + PUSH_D)
+            self.add(["@R14", "D=M", "@SP", "D=M-D", "@ARG", "M=D",
+                      "@SP", "D=M", "@LCL", "M=D",
+                      "@R13", "A=M", "0;JMP"])
+        if self.returns:
+            # the return address is read first, as the return value
+            # overwrites it when there are no arguments
+            self.add(["($$RETURN)", "@5", "D=A", "@LCL", "A=M-D", "D=M",
+                      "@R14", "M=D"] + POP_D +
+                     ["@ARG", "A=M", "M=D", "D=A+1", "@SP", "M=D"])
+            for pointer in ("THAT", "THIS", "ARG"):
+                self.add(["@LCL", "AM=M-1", "D=M", "@" + pointer, "M=D"])
+            self.add(["@LCL", "A=M-1", "D=M", "@LCL", "M=D",
+                      "@R14", "A=M", "0;JMP"])
+        for name in self.comparisons:
+            self.add(comparison_stub(name))
+        if self.comparisons:
+            self.add(["($$TRUE)", "@SP", "A=M-1", "M=-1", "@R15", "A=M",
+                      "0;JMP",
+                      "($$FALSE)", "@SP", "A=M-1", "M=0", "@R15", "A=M",
+                      "0;JMP"])
+        return count_instructions(self.lines[start:])
+
+    def translate_command(self, commands: typing.List[typing.Tuple[
+            int, typing.List[str]]], index: int) -> int:
+        """Translates the command at the given index, together with the
+        command after it if the two translate better as one.
+
+        Returns:
+            int: the index of the next command to translate.
+        """
+        line, words = commands[index]
+        following = commands[index + 1][1] \
+            if index + 1 < len(commands) else None
+        command = words[0]
+        try:
+            if command == "push":
+                check_arguments(words, 3)
+                load = self.load(words[1], parse_index(words[2]))
+                if following is None:
+                    pass
+                elif following[0] == "pop" and len(following) == 3:
+                    # errors from here on are in the pop
+                    line = commands[index + 1][0]
+                    self.add(load + self.store(following[1],
+                                               parse_index(following[2])))
+                    return index + 2
+                elif following[0] in BINARY and len(following) == 1:
+                    if load == ["D=1"] and following[0] in ("add", "sub"):
+                        self.add(["@SP", "A=M-1", "M=M%s1" % (
+                            "+" if following[0] == "add" else "-")])
+                    else:
+                        self.add(load + ["@SP", "A=M-1",
+                                         BINARY[following[0]]])
+                    return index + 2
+                elif following[0] == "if-goto" and len(following) == 2:
+                    self.add(load + ["@" + self.label(following[1]),
+                                     "D;JNE"])
+                    return index + 2
+                if load[0] in ("D=0", "D=1"):
+                    self.add(["@SP", "AM=M+1", "A=A-1", "M=" + load[0][2:]])
+                else:
+                    self.add(load + PUSH_D)
+            elif command == "pop":
+                check_arguments(words, 3)
+                self.pop(words[1], parse_index(words[2]))
+            elif command in BINARY:
+                check_arguments(words, 1)
+                self.add(POP_D + ["A=A-1", BINARY[command]])
+            elif command in UNARY:
+                check_arguments(words, 1)
+                if command == "not" and following is not None and \
+                        following[0] == "if-goto" and len(following) == 2:
+                    # not(x) is 0 exactly when x is -1
+                    self.add(["@SP", "AM=M-1", "D=M+1",
+                              "@" + self.label(following[1]), "D;JNE"])
+                    return index + 2
+                self.add(["@SP", "A=M-1", UNARY[command]])
+            elif command in COMPARISONS:
+                check_arguments(words, 1)
+                name = "$$" + command.upper()
+                self.comparisons[name] = None
+                self.jump_to_stub(name)
+            elif command == "label":
+                check_arguments(words, 2)
+                self.add(["(%s)" % self.label(words[1])])
+            elif command == "goto":
+                check_arguments(words, 2)
+                self.add(["@" + self.label(words[1]), "0;JMP"])
+            elif command == "if-goto":
+                check_arguments(words, 2)
+                self.add(POP_D + ["@" + self.label(words[1]), "D;JNE"])
+            elif command == "function":
+                check_arguments(words, 3)
+                self.function = check_name(words[1])
+                self.function_entry(words[1], parse_index(words[2]))
+            elif command == "call":
+                check_arguments(words, 3)
+                self.call(check_name(words[1]), parse_index(words[2]))
+            elif command == "return":
+                check_arguments(words, 1)
+                self.returns = True
+                self.add(["@$$RETURN", "0;JMP"])
+            else:
+                raise ValueError("Unknown command '%s'" % command)
+        except ValueError as error:
+            raise ValueError("%s in line %d" % (error, line)) from None
+        return index + 1
+
+    def load(self, segment: str, index: int) -> typing.List[str]:
+        """
+        Returns:
+            typing.List[str]: instructions which load the given slot into D.
+        """
+        if segment == "constant":
+            if index > MAX_CONSTANT:
+                raise ValueError("Constant %d is too large" % index)
+            return ["D=%d" % index] if index <= 1 else ["@%d" % index, "D=A"]
+        if segment in BASES:
+            if index <= 2:
+                return step(BASES[segment], index) + ["D=M"]
+            return ["@%d" % index, "D=A", "@" + BASES[segment], "A=D+M",
+                    "D=M"]
+        return [self.address(segment, index), "D=M"]
+
+    def store(self, segment: str, index: int) -> typing.List[str]:
+        """
+        Returns:
+            typing.List[str]: instructions which store D in the given slot.
+        """
+        if segment in BASES:
+            if len(step(BASES[segment], index)) + 1 <= LONG_STORE:
+                return step(BASES[segment], index) + ["M=D"]
+            return ["@R13", "M=D", "@" + BASES[segment], "D=M",
+                    "@%d" % index, "D=D+A", "@R14", "M=D", "@R13", "D=M",
+                    "@R14", "A=M", "M=D"]
+        return [self.address(segment, index), "M=D"]
+
+    def pop(self, segment: str, index: int) -> None:
+        if segment in BASES and index > 6:
+            # the address is computed before D is taken by the value
+            self.add(["@" + BASES[segment], "D=M", "@%d" % index, "D=D+A",
+                      "@R13", "M=D"] + POP_D + ["@R13", "A=M", "M=D"])
+        else:
+            self.add(POP_D + self.store(segment, index))
+
+    def address(self, segment: str, index: int) -> str:
+        """
+        Returns:
+            str: the A-instruction which addresses a slot of the static,
+            pointer or temp segment.
+        """
+        if segment == "static":
+            return "@%s.%d" % (self.file_name, index)
+        if segment in FIXED:
+            base, size = FIXED[segment]
+            if index >= size:
+                raise ValueError("Index %d is out of the %s segment"
+                                 % (index, segment))
+            return "@R%d" % (base + index)
+        if segment == "constant":
+            raise ValueError("Cannot pop to the constant segment")
+        raise ValueError("Unknown segment '%s'" % segment)
+
+    def label(self, name: str) -> str:
+        """
+        Returns:
+            str: the assembly label of a VM label, which is local to its
+            function.
+        """
+        return "%s$%s" % (self.function, check_name(name))
+
+    def function_entry(self, name: str, num_locals: int) -> None:
+        self.add(["(%s)" % name])
+        if num_locals:
+            self.add(["@SP", "A=M"] + ["M=0", "A=A+1"] * (num_locals - 1) +
+                     ["M=0", "D=A+1", "@SP", "M=D"])
+
+    def call(self, name: str, num_args: int) -> None:
+        self.arities.add(num_args)
+        self.add(["@" + name, "D=A", "@R13", "M=D"])
+        self.jump_to_stub("$$CALL.%d" % num_args)
+
+    def jump_to_stub(self, stub: str) -> None:
+        """Jumps to a stub, with the address of the next instruction in D."""
+        self.labels += 1
+        # "$$" keeps it apart from the labels of the function
+        return_label = "%s$$ret.%d" % (self.function, self.labels)
+        self.add(["@" + return_label, "D=A", "@" + stub, "0;JMP",
+                  "(%s)" % return_label])
+
+
+def comparison_stub(name: str) -> typing.List[str]:
+    """
+    Args:
+        name (str): "$$EQ", "$$GT" or "$$LT".
+
+    Returns:
+        typing.List[str]: the stub which pops y and replaces x with x = y,
+        x > y or x < y, and jumps to the address in D. x - y overflows when
+        x and y have different signs, so such operands are told apart by
+        their signs alone.
+    """
+    if name == "$$EQ":
+        return ["($$EQ)", "@R15", "M=D"] + POP_D + \
+            ["A=A-1", "D=M-D", "@$$TRUE", "D;JEQ", "@$$FALSE", "0;JMP"]
+    greater = name == "$$GT"
+    return ["(%s)" % name, "@R15", "M=D"] + POP_D + \
+        ["@R14", "M=D", "@SP", "A=M-1", "D=M",
+         "@%s.XNEG" % name, "D;JLT",
+         # x >= 0, so x - y can only overflow when y < 0
+         "@R14", "D=M", "@" + ("$$TRUE" if greater else "$$FALSE"), "D;JLT",
+         "@%s.SAME" % name, "0;JMP",
+         "(%s.XNEG)" % name,
+         "@R14", "D=M", "@" + ("$$FALSE" if greater else "$$TRUE"), "D;JGE",
+         "(%s.SAME)" % name,
+         "@R14", "D=M", "@SP", "A=M-1", "D=M-D",
+         "@$$TRUE", "D;JGT" if greater else "D;JLT",
+         "@$$FALSE", "0;JMP"]
+
+
+def step(base: str, index: int) -> typing.List[str]:
+    """
+    Returns:
+        typing.List[str]: instructions which point A to the given offset from
+        a base pointer, by incrementing it.
+    """
+    if index == 0:
+        return ["@" + base, "A=M"]
+    return ["@" + base, "A=M+1"] + ["A=A+1"] * (index - 1)
+
+
+def parse(source: str) -> typing.List[typing.Tuple[int, typing.List[str]]]:
+    """
+    Returns:
+        typing.List[typing.Tuple[int, typing.List[str]]]: the line number and
+        the words of every command of a VM file.
+    """
+    commands = []
+    for line, text in enumerate(source.splitlines(), 1):
+        words = text.split("//", 1)[0].split()
+        if words:
+            commands.append((line, words))
+    return commands
+
+
+def parse_index(word: str) -> int:
+    if not word.isdigit():
+        raise ValueError("Expected a non-negative number, not '%s'" % word)
+    return int(word)
+
+
+def check_name(word: str) -> str:
+    """
+    Returns:
+        str: the word, if it is a valid name of a VM function or label: a
+        sequence of letters, digits, '_', '.' and ':' which does not start
+        with a digit.
+    """
+    if NAME.match(word) is None:
+        raise ValueError("Malformed name '%s'" % word)
+    return word
+
+
+def check_arguments(words: typing.List[str], length: int) -> None:
+    if len(words) != length:
+        raise ValueError("'%s' takes %d arguments, not %d"
+                         % (words[0], length - 1, len(words) - 1))
+
+
+def count_instructions(lines: typing.List[str]) -> int:
+    """
+    Returns:
+        int: the number of words of ROM the assembly lines take, i.e. the
+        number of lines which are not labels.
+    """
+    return sum(1 for line in lines if line[0] != "(")
+
+
+def list_vm_files(argument_path: str) -> typing.List[str]:
+    """
+    Args:
+        argument_path (str): a .vm file or a directory.
+
+    Returns:
+        typing.List[str]: the .vm files the path refers to, sorted.
+    """
+    if os.path.isdir(argument_path):
+        paths = [os.path.join(argument_path, filename)
+                 for filename in os.listdir(argument_path)]
+    else:
+        paths = [argument_path]
+    return sorted(path for path in paths
+                  if os.path.splitext(path)[1].lower() == ".vm")
+
+
+def asm_path_for(argument_path: str) -> str:
+    """
+    Returns:
+        str: where the program a .vm file or a directory holds is written:
+        next to the file, or inside the directory, named after it.
+    """
+    if os.path.isdir(argument_path):
+        return os.path.join(argument_path, os.path.basename(
+            os.path.normpath(argument_path)) + ".asm")
+    return os.path.splitext(argument_path)[0] + ".asm"
+
+
+def translate_paths(vm_paths: typing.List[str], output_path: str,
+                    bootstrap: bool = False
+                    ) -> typing.List[typing.Dict[str, typing.Any]]:
+    """Translates VM files into a single assembly file.
+
+    Args:
+        vm_paths (typing.List[str]): the files, in the order their code is
+            laid out in.
+        output_path (str): the .asm file.
+        bootstrap (bool): whether to start the program with the bootstrap
+            code, rather than with the first command of the first file.
+
+    Returns:
+        typing.List[typing.Dict[str, typing.Any]]: the report of every file
+        (see VMTranslator.translate), followed by those of the bootstrap code
+        (if any) and of the stubs.
+    """
+    translator = VMTranslator()
+    extra = []
+    if bootstrap:
+        extra.append({"class": "(bootstrap)", "commands": 0,
+                      "instructions": translator.write_bootstrap()})
+    reports = []
+    for vm_path in vm_paths:
+        with open(vm_path, 'r') as vm_file:
+            source = vm_file.read()
+        file_name = os.path.splitext(os.path.basename(vm_path))[0]
+        try:
+            reports.append(translator.translate(file_name, source))
+        except ValueError as error:
+            raise ValueError("%s: %s" % (vm_path, error)) from None
+    extra.append({"class": "(stubs)", "commands": 0,
+                  "instructions": translator.finish()})
+    with open(output_path, 'w') as output_file:
+        output_file.write("\n".join(translator.lines) + "\n")
+    return reports + extra
+
+
+def print_sizes(reports: typing.List[typing.Dict[str, typing.Any]]) -> bool:
+    """Prints the number of VM commands and of instructions of every class,
+    and in total, with the share of the ROM the program takes.
+
+    Args:
+        reports (typing.List[typing.Dict[str, typing.Any]]): as returned by
+            translate_paths.
+
+    Returns:
+        bool: True if the program fits in the ROM.
+    """
+    rows = [(report["class"], report["commands"], report["instructions"])
+            for report in reports]
+    rows.append(("total", sum(row[1] for row in rows),
+                 sum(row[2] for row in rows)))
+    width = max(len(str(row[0])) for row in rows)
+    for name, commands, instructions in rows:
+        print("%-*s %7d commands -> %7d instructions" % (
+            width, name, commands, instructions) + (
+            " (%.1f%% of the ROM)" % (100.0 * instructions / ROM_SIZE)
+            if name == "total" else ""))
+    return rows[-1][2] <= ROM_SIZE
+
+
+if "__main__" == __name__:
+    parser = argparse.ArgumentParser(
+        prog="VMTranslator",
+        description="Translates VM files into Hack assembly.")
+    parser.add_argument("input_path", help="a .vm file or a directory")
+    parser.add_argument("--bootstrap", action="store_true",
+                        help="start the program by calling %s"
+                             % BOOTSTRAP_ENTRY)
+    parser.add_argument("-o", "--output",
+                        help="the .asm file (default: named after the input)")
+    args = parser.parse_args()
+    argument_path = os.path.abspath(args.input_path)
+    start = time.perf_counter()
+    try:
+        sizes = translate_paths(list_vm_files(argument_path),
+                                args.output or asm_path_for(argument_path),
+                                args.bootstrap)
+    except (OSError, ValueError) as error:
+        sys.exit(str(error))
+    fits = print_sizes(sizes)
+    print("translated in %.1f ms" % ((time.perf_counter() - start) * 1000))
+    if not fits:
+        sys.exit("the program does not fit in the %d words of the ROM"
+                 % ROM_SIZE)
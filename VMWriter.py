@@ -0,0 +1,110 @@
+"""
+This file is part of nand2tetris, as taught in The Hebrew University, and
+was written by Aviv Yaish. It is an extension to the specifications given
+[here](https://www.nand2tetris.org) (Shimon Schocken and Noam Nisan, 2017),
+as allowed by the Creative Common Attribution-NonCommercial-ShareAlike 3.0
+Unported [License](https://creativecommons.org/licenses/by-nc-sa/3.0/).
+"""
+import typing
+
+SEGMENTS = {"CONST": "constant", "ARG": "argument", "LOCAL": "local",
+            "STATIC": "static", "THIS": "this", "THAT": "that",
+            "POINTER": "pointer", "TEMP": "temp"}
+
+
+class VMWriter:
+    """
+    Writes VM commands into a file. Encapsulates the VM command syntax.
+    Commands are collected in a list and written out in a single block by
+    flush(), so a subroutine can be inspected (or rewritten) before it is
+    written.
+    """
+
+    def __init__(self, output_stream: typing.TextIO) -> None:
+        """Creates a new file and prepares it for writing VM commands."""
+        self.output_stream = output_stream
+        self.commands = []  # type: typing.List[str]
+        self.add = self.commands.append
+        self.write_calls = 0
+
+    def write_push(self, segment: str, index: int) -> None:
+        """Writes a VM push command.
+
+        Args:
+            segment (str): the segment to push to, can be "CONST", "ARG",
+            "LOCAL", "STATIC", "THIS", "THAT", "POINTER", "TEMP"
+            index (int): the index to push to.
+        """
+        self.add("push %s %d" % (SEGMENTS[segment], index))
+
+    def write_pop(self, segment: str, index: int) -> None:
+        """Writes a VM pop command.
+
+        Args:
+            segment (str): the segment to pop from, can be "CONST", "ARG",
+            "LOCAL", "STATIC", "THIS", "THAT", "POINTER", "TEMP".
+            index (int): the index to pop from.
+        """
+        self.add("pop %s %d" % (SEGMENTS[segment], index))
+
+    def write_arithmetic(self, command: str) -> None:
+        """Writes a VM arithmetic command.
+
+        Args:
+            command (str): the command to write, can be "ADD", "SUB", "NEG",
+            "EQ", "GT", "LT", "AND", "OR", "NOT", "SHIFTLEFT", "SHIFTRIGHT".
+        """
+        self.add(command.lower())
+
+    def write_label(self, label: str) -> None:
+        """Writes a VM label command.
+
+        Args:
+            label (str): the label to write.
+        """
+        self.add("label " + label)
+
+    def write_goto(self, label: str) -> None:
+        """Writes a VM goto command.
+
+        Args:
+            label (str): the label to go to.
+        """
+        self.add("goto " + label)
+
+    def write_if(self, label: str) -> None:
+        """Writes a VM if-goto command.
+
+        Args:
+            label (str): the label to go to.
+        """
+        self.add("if-goto " + label)
+
+    def write_call(self, name: str, n_args: int) -> None:
+        """Writes a VM call command.
+
+        Args:
+            name (str): the name of the function to call.
+            n_args (int): the number of arguments the function receives.
+        """
+        self.add("call %s %d" % (name, n_args))
+
+    def write_function(self, name: str, n_locals: int) -> None:
+        """Writes a VM function command.
+
+        Args:
+            name (str): the name of the function.
+            n_locals (int): the number of local variables the function uses.
+        """
+        self.add("function %s %d" % (name, n_locals))
+
+    def write_return(self) -> None:
+        """Writes a VM return command."""
+        self.add("return")
+
+    def flush(self) -> None:
+        """Writes out the collected commands."""
+        if self.commands:
+            self.output_stream.write("\n".join(self.commands) + "\n")
+            self.write_calls += 1
+            self.commands.clear()
@@ -0,0 +1,378 @@
+"""
+Compares XML outputs of the analyzer with reference XML files, e.g. those of
+a regression suite.
+
+Files are compared token by token rather than line by line: tags and the
+text between them are read as a stream, in large blocks, and the text is
+stripped of surrounding whitespace. Indentation, line endings and the
+padding of escaped symbols (the XMLWriter writes " &amp;" and " &gt;") then
+make no difference, and a comparison stops at the first token which does.
+The files of directories are compared in parallel worker processes.
+
+Usage: XMLCompare.py ACTUAL EXPECTED, where both are .xml files, or
+directories whose .xml files are paired by their paths relative to them.
+"""
+import argparse
+import concurrent.futures
+import itertools
+import os
+import re
+import sys
+import time
+import typing
+
+# how much of a file is read at a time
+BLOCK_SIZE = 1 << 16
+# A token starts at a '<' or right after a '>', and ends right before a '<'
+# or after a '>': it is a tag, a text, or a malformed mix of the two.
+XML_TOKEN = re.compile(r"<?[^<>]*>?")
+# whitespace inside the brackets of a tag
+TAG_SPACES = ("< ", "</ ", " >", "<\t", "\t>", "\n>")
+ENTITIES = {"&amp;": "&", "&lt;": "<", "&gt;": ">", "&quot;": '"',
+            "&apos;": "'"}
+ENTITY = re.compile("|".join(ENTITIES))
+
+
+class Divergence(typing.NamedTuple):
+    """The first token at which two files differ. A token is None (and its
+    line 0) where its file ended."""
+    index: int
+    actual: typing.Optional[str]
+    actual_line: int
+    expected: typing.Optional[str]
+    expected_line: int
+
+    def describe(self) -> str:
+        """
+        Returns:
+            str: a one line description of the difference.
+        """
+        return "token %d: got %s, expected %s" % (
+            self.index, describe_token(self.actual, self.actual_line),
+            describe_token(self.expected, self.expected_line))
+
+
+class Comparison(typing.NamedTuple):
+    """The outcome of comparing an output with its reference."""
+    actual: str
+    expected: str
+    # the first difference, None if the files match
+    divergence: typing.Optional[Divergence] = None
+    # why the files could not be compared (e.g. one is missing)
+    error: typing.Optional[str] = None
+    # the number of tokens compared (and found equal), and how long it took
+    tokens: int = 0
+    seconds: float = 0.0
+
+    @property
+    def matches(self) -> bool:
+        return self.divergence is None and self.error is None
+
+
+def read_blocks(input_stream: typing.TextIO, block_size: int = BLOCK_SIZE
+                ) -> typing.Iterator[str]:
+    """Reads a file in blocks which end right after a tag (but for the last
+    one), so that no token is split between two blocks.
+
+    Args:
+        input_stream (typing.TextIO): the file.
+        block_size (int): number of characters read at once.
+
+    Returns:
+        typing.Iterator[str]: the blocks.
+    """
+    carry = ""
+    while True:
+        block = input_stream.read(block_size)
+        if not block:
+            if carry:
+                yield carry
+            return
+        buffer = carry + block
+        limit = buffer.rfind(">") + 1
+        carry = buffer[limit:]
+        if limit:
+            yield buffer[:limit]
+
+
+def normalize(token: str) -> str:
+    """
+    Returns:
+        str: the token stripped of whitespace, and of the whitespace inside
+        its brackets if it is a tag, or with its entities replaced if it is
+        a text.
+    """
+    token = token.strip()
+    if token.startswith("<") and token.endswith(">"):
+        return "<" + "".join(token[1:-1].split()) + ">"
+    return unescape(token) if "&" in token else token
+
+
+def unescape(text: str) -> str:
+    """
+    Returns:
+        str: the text with its entities replaced by the characters they
+        stand for.
+    """
+    return ENTITY.sub(lambda entity: ENTITIES[entity.group()], text)
+
+
+def block_tokens(block: str) -> typing.List[str]:
+    """
+    Returns:
+        typing.List[str]: the normalized tokens of a block, leaving out the
+        texts which are only whitespace. Most tokens need nothing but
+        stripping, so normalize() is only called for blocks with whitespace
+        inside tags.
+    """
+    if "\0" in block:
+        pieces = XML_TOKEN.findall(block)
+    else:
+        # splits the block as XML_TOKEN does, but faster
+        pieces = block.replace("<", "\0<").replace(">", ">\0").split("\0")
+    tokens = [token for token in map(str.strip, pieces) if token]
+    if any(space in block for space in TAG_SPACES):
+        return [normalize(token) for token in tokens]
+    if "&" in block:
+        return [unescape(token) if "&" in token else token
+                for token in tokens]
+    return tokens
+
+
+def xml_tokens(input_stream: typing.TextIO, block_size: int = BLOCK_SIZE
+               ) -> typing.Iterator[typing.Tuple[str, int]]:
+    """Breaks an XML file into the same tokens as block_tokens(), lazily,
+    with their lines. It is slower, so it is only used to find the lines of
+    a difference.
+
+    Args:
+        input_stream (typing.TextIO): the file.
+        block_size (int): number of characters read at once.
+
+    Returns:
+        typing.Iterator[typing.Tuple[str, int]]: every tag (e.g. "<symbol>"
+        or "</symbol>") and every text which is not only whitespace, with
+        its line.
+    """
+    line = 1
+    for block in read_blocks(input_stream, block_size):
+        counted = 0
+        for match in XML_TOKEN.finditer(block):
+            raw = match.group()
+            token = normalize(raw)
+            if token:
+                # the line of the first character which is not whitespace
+                start = match.start() + len(raw) - len(raw.lstrip())
+                line += block.count("\n", counted, start)
+                counted = start
+                yield token, line
+        line += block.count("\n", counted)
+
+
+def first_difference(actual_blocks: typing.Iterator[str],
+                     expected_blocks: typing.Iterator[str]
+                     ) -> typing.Tuple[bool, int]:
+    """Compares the tokens of two files, a block at a time: the tokens which
+    both files have read so far are compared as lists, and only the lists
+    which differ are searched for the token which does.
+
+    Args:
+        actual_blocks (typing.Iterator[str]): the blocks of a file.
+        expected_blocks (typing.Iterator[str]): the blocks of the other.
+
+    Returns:
+        typing.Tuple[bool, int]: whether the files differ, and the number of
+        equal tokens they start with (so, if they differ, the index of the
+        first token which differs, or which only one of them has).
+    """
+    actual = []  # type: typing.List[str]
+    expected = []  # type: typing.List[str]
+    compared = 0
+    actual_left = expected_left = True
+    while actual_left or expected_left:
+        # read on in the file which is behind
+        if actual_left and (len(actual) <= len(expected) or
+                            not expected_left):
+            block = next(actual_blocks, None)
+            if block is None:
+                actual_left = False
+            else:
+                actual += block_tokens(block)
+        else:
+            block = next(expected_blocks, None)
+            if block is None:
+                expected_left = False
+            else:
+                expected += block_tokens(block)
+        common = min(len(actual), len(expected))
+        if common:
+            if actual[:common] != expected[:common]:
+                return True, compared + next(
+                    index for index in range(common)
+                    if actual[index] != expected[index])
+            del actual[:common]
+            del expected[:common]
+            compared += common
+        if (not actual_left and not actual and expected) or \
+                (not expected_left and not expected and actual):
+            # one file ended before the other
+            return True, compared
+    return False, compared
+
+
+def token_at(path: str, index: int, block_size: int = BLOCK_SIZE
+             ) -> typing.Tuple[typing.Optional[str], int]:
+    """
+    Returns:
+        typing.Tuple[typing.Optional[str], int]: the token of a file at an
+        index, and its line, or (None, 0) if the file has fewer tokens.
+    """
+    with open(path, 'r') as input_file:
+        return next(itertools.islice(xml_tokens(input_file, block_size),
+                                     index, None), (None, 0))
+
+
+def compare_files(actual_path: str, expected_path: str,
+                  block_size: int = BLOCK_SIZE) -> Comparison:
+    """Compares two XML files, token by token.
+
+    Args:
+        actual_path (str): the output to check.
+        expected_path (str): its reference.
+        block_size (int): number of characters read at once.
+
+    Returns:
+        Comparison: the outcome.
+    """
+    start = time.perf_counter()
+    try:
+        with open(actual_path, 'r') as actual_file, \
+                open(expected_path, 'r') as expected_file:
+            differ, compared = first_difference(
+                read_blocks(actual_file, block_size),
+                read_blocks(expected_file, block_size))
+        divergence = None
+        if differ:
+            divergence = Divergence(
+                compared, *token_at(actual_path, compared, block_size),
+                *token_at(expected_path, compared, block_size))
+    except (OSError, UnicodeDecodeError) as error:
+        return Comparison(actual_path, expected_path, error=str(error),
+                          seconds=time.perf_counter() - start)
+    return Comparison(actual_path, expected_path, divergence, tokens=compared,
+                      seconds=time.perf_counter() - start)
+
+
+def compare_pairs(pairs: typing.List[typing.Tuple[str, str]], jobs: int = 1,
+                  block_size: int = BLOCK_SIZE) -> typing.List[Comparison]:
+    """Compares several outputs with their references, in worker processes
+    if jobs > 1.
+
+    Args:
+        pairs (typing.List[typing.Tuple[str, str]]): (actual, expected)
+            paths.
+        jobs (int): number of worker processes to use.
+        block_size (int): number of characters read at once.
+
+    Returns:
+        typing.List[Comparison]: the outcome of every pair, in order.
+    """
+    actual_paths = [pair[0] for pair in pairs]
+    expected_paths = [pair[1] for pair in pairs]
+    sizes = itertools.repeat(block_size)
+    if jobs <= 1 or len(pairs) <= 1:
+        return list(map(compare_files, actual_paths, expected_paths, sizes))
+    workers = min(jobs, len(pairs))
+    # comparing a single small file takes less than sending it to a worker,
+    # so every worker is sent its files in batches
+    chunk_size = max(1, len(pairs) // (workers * 8))
+    with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+        return list(pool.map(compare_files, actual_paths, expected_paths,
+                             sizes, chunksize=chunk_size))
+
+
+def pair_files(actual_path: str, expected_path: str
+               ) -> typing.List[typing.Tuple[str, str]]:
+    """
+    Args:
+        actual_path (str): an .xml file, or a directory of outputs.
+        expected_path (str): the reference file, or a directory of them.
+
+    Returns:
+        typing.List[typing.Tuple[str, str]]: the .xml files under
+        actual_path (recursively, sorted), each with the reference of the
+        same relative path under expected_path.
+    """
+    if not os.path.isdir(actual_path):
+        return [(actual_path, expected_path)]
+    pairs = []
+    for directory, subdirectories, filenames in os.walk(actual_path):
+        subdirectories.sort()
+        for filename in sorted(filenames):
+            if os.path.splitext(filename)[1].lower() != ".xml":
+                continue
+            path = os.path.join(directory, filename)
+            pairs.append((path, os.path.join(
+                expected_path, os.path.relpath(path, actual_path))))
+    return pairs
+
+
+def print_comparisons(comparisons: typing.List[Comparison],
+                      verbose: bool = False) -> int:
+    """Prints the files which differ (or every file, if verbose), with the
+    first difference of each, and a summary.
+
+    Returns:
+        int: the number of files which do not match.
+    """
+    failed = 0
+    for comparison in comparisons:
+        if comparison.error is not None:
+            outcome = "ERROR %s" % comparison.error
+        elif comparison.divergence is not None:
+            outcome = "DIFF %s" % comparison.divergence.describe()
+        elif verbose:
+            outcome = "OK"
+        else:
+            continue
+        if not comparison.matches:
+            failed += 1
+        print("%s: %s (%d tokens, %.2f ms)" % (
+            comparison.actual, outcome, comparison.tokens,
+            comparison.seconds * 1000))
+    tokens = sum(comparison.tokens for comparison in comparisons)
+    print("%d of %d files match, %d tokens compared"
+          % (len(comparisons) - failed, len(comparisons), tokens))
+    return failed
+
+
+def describe_token(token: typing.Optional[str], line: int) -> str:
+    if token is None:
+        return "end of file"
+    return "%r in line %d" % (token, line)
+
+
+if "__main__" == __name__:
+    parser = argparse.ArgumentParser(
+        prog="XMLCompare",
+        description="Compares XML outputs with reference files, token by "
+                    "token.")
+    parser.add_argument("actual", help="an .xml file or a directory")
+    parser.add_argument("expected",
+                        help="the reference file, or a directory of "
+                             "reference files with the same relative paths")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1,
+                        help="number of worker processes (default: the "
+                             "number of CPUs)")
+    parser.add_argument("--block-size", type=int, default=BLOCK_SIZE,
+                        help="characters read at a time")
+    parser.add_argument("-v", "--verbose", action="store_true",
+                        help="list the files which match too")
+    args = parser.parse_args()
+    start = time.perf_counter()
+    results = compare_pairs(pair_files(args.actual, args.expected),
+                            args.jobs, args.block_size)
+    failed = print_comparisons(results, args.verbose)
+    print("compared in %.1f ms" % ((time.perf_counter() - start) * 1000))
+    if failed:
+        sys.exit(1)
@@ -0,0 +1,173 @@
+"""
+Serializes the parse tree built by the CompilationEngine into XML. Pieces of
+output are collected in a list and written to the output stream in large
+blocks, and the lines for symbols (with their XML escaping) and keywords are
+precomputed.
+"""
+import typing
+from JackTokenizer import KEYWORDS, SYMBOLS
+from ParseTree import Node, Terminal
+
+# How the symbols which are special in XML are written out. The padding of
+# '&' and '>' is part of the established output format.
+SYMBOL_ESCAPES = {"&": " &amp;", "<": "&lt;", ">": " &gt;"}
+SYMBOL_LINES = {
+    symbol: "<symbol> " + SYMBOL_ESCAPES.get(symbol, symbol) + " </symbol>\n"
+    for symbol in SYMBOLS}
+KEYWORD_LINES = {
+    keyword: "<keyword> " + keyword + " </keyword>\n" for keyword in KEYWORDS}
+
+# Number of buffered pieces of output after which flush_if_full() flushes.
+FLUSH_THRESHOLD = 1 << 13
+# How deeply write_nodes() recurses into a tree, before the rest of the tree
+# is written with an explicit stack (see write_deep_nodes).
+MAX_RECURSION = 100
+
+
+class XMLWriter:
+    """Writes parse trees as XML, buffering the output and writing it to the
+    output stream in large blocks.
+
+    write() only appends to the buffer (it is the buffer's own append), so it
+    costs no more than a list append. flush_if_full() writes the buffer out
+    once it is large enough, and flush() writes out whatever is left.
+    """
+
+    def __init__(self, output_stream: typing.TextIO,
+                 flush_threshold: int = FLUSH_THRESHOLD,
+                 terminal_lines: typing.Optional[
+                     typing.Dict[Terminal, str]] = None) -> None:
+        """Creates a new XML writer buffering output for the given stream.
+
+        Args:
+            output_stream (typing.TextIO): the stream to write to.
+            flush_threshold (int): number of buffered pieces of output after
+                which flush_if_full() flushes.
+            terminal_lines (typing.Optional[typing.Dict[Terminal, str]]): a
+                cache of the lines of terminals, to share it between writers.
+        """
+        self.output_stream = output_stream
+        self.flush_threshold = flush_threshold
+        self.buffer = []  # type: typing.List[str]
+        # buffers a piece of output
+        self.write = self.buffer.append
+        self.write_calls = 0
+        # the line of every terminal written so far (terminals are shared)
+        if terminal_lines is None:
+            terminal_lines = {}
+        self.terminal_lines = terminal_lines
+        self.started_class = False
+
+    def write_open_tag(self, tag: str) -> None:
+        """Writes the opening tag of a non-terminal."""
+        self.write("<" + tag + ">\n")
+
+    def write_close_tag(self, tag: str) -> None:
+        """Writes the closing tag of a non-terminal."""
+        self.write("</" + tag + ">\n")
+
+    def write_class_children(self, tree: Node, children: typing.List[
+            typing.Union[Node, Terminal]]) -> None:
+        """Writes the given (newly parsed) children of a class, after the
+        opening tag of the class if they are its first ones.
+
+        Args:
+            tree (Node): the class.
+            children (typing.List[typing.Union[Node, Terminal]]): its children
+                which were not written before.
+        """
+        if not self.started_class:
+            self.write_open_tag(tree.kind)
+            self.started_class = True
+        self.write_nodes(children)
+        self.flush_if_full()
+
+    def finish_class(self, tree: Node) -> None:
+        """Closes the class and writes out everything that is buffered."""
+        self.write_close_tag(tree.kind)
+        self.started_class = False
+        self.flush()
+
+    def write_tree(self, tree: Node) -> None:
+        """Writes a complete parse tree (or subtree)."""
+        self.write_nodes([tree])
+
+    def write_nodes(self, nodes: typing.List[typing.Union[Node, Terminal]],
+                    depth: int = 0) -> None:
+        """Writes a sequence of sibling nodes and terminals.
+
+        Args:
+            nodes (typing.List[typing.Union[Node, Terminal]]): the nodes.
+            depth (int): how deeply they are nested in the tree being
+                written. Nodes nested deeper than MAX_RECURSION are written
+                by write_deep_nodes() instead of recursively.
+        """
+        write = self.write
+        lines = self.terminal_lines
+        for node in nodes:
+            if type(node) is Terminal:
+                line = lines.get(node)
+                if line is None:
+                    line = lines[node] = terminal_line(node)
+                write(line)
+            elif depth < MAX_RECURSION:
+                write("<" + node.kind + ">\n")
+                self.write_nodes(node.children, depth + 1)
+                write("</" + node.kind + ">\n")
+            else:
+                self.write_deep_nodes([node])
+
+    def write_deep_nodes(self, nodes: typing.List[typing.Union[
+            Node, Terminal]]) -> None:
+        """Writes a sequence of sibling nodes and terminals like
+        write_nodes(), walking the tree with an explicit stack (which is
+        slower), so its depth is not bounded by the recursion limit."""
+        write = self.write
+        lines = self.terminal_lines
+        # what is left to write, the next item last: nodes, terminals, and
+        # the closing tags of the nodes being written
+        stack = list(reversed(nodes))  # type: typing.List[typing.Any]
+        push = stack.append
+        pop = stack.pop
+        while stack:
+            node = pop()
+            node_type = type(node)
+            if node_type is Terminal:
+                line = lines.get(node)
+                if line is None:
+                    line = lines[node] = terminal_line(node)
+                write(line)
+            elif node_type is str:
+                write(node)
+            else:
+                write("<" + node.kind + ">\n")
+                push("</" + node.kind + ">\n")
+                stack.extend(reversed(node.children))
+
+    def flush_if_full(self) -> None:
+        """Flushes the buffer if it holds enough output."""
+        if len(self.buffer) >= self.flush_threshold:
+            self.flush()
+
+    def flush(self) -> None:
+        """Writes out everything that is buffered, in a single write."""
+        if self.buffer:
+            self.output_stream.write("".join(self.buffer))
+            self.write_calls += 1
+            self.buffer.clear()
+
+
+def terminal_line(terminal: Terminal) -> str:
+    """
+    Returns:
+        str: the XML line of a terminal.
+    """
+    kind = terminal.kind
+    token = terminal.token
+    if kind == "symbol":
+        line = SYMBOL_LINES.get(token)
+    elif kind == "keyword":
+        line = KEYWORD_LINES.get(token)
+    else:
+        line = None
+    return line or "<" + kind + "> " + token + " </" + kind + ">\n"
@@ -1,26 +1,284 @@
+"""
+Strips the indentation and trailing whitespace of every line of XML files,
+and drops the lines left empty, e.g. to normalize reference files before
+they are compared with the analyzer's output line by line.
+
+Files are read and written in large blocks. Every output is written to a
+temporary file which then replaces the output, so an input is never
+truncated, even when it is its own output. Outputs which are newer than
+their inputs are skipped, outputs which would not change are left as they
+are, and the files of a directory are processed in parallel.
+
+Usage: remove_spaces.py PATH [-o OUTPUT_DIR | -i] [-j JOBS], where PATH is
+an .xml file or a directory of them (searched recursively). The normalized
+files are written under OUTPUT_DIR, or over themselves with -i/--in-place,
+and printed otherwise.
+"""
+import argparse
+import concurrent.futures
+import filecmp
+import itertools
 import os
+import shutil
 import sys
+import tempfile
+import time
+import typing
+
+# how much of a file is read at a time
+BLOCK_SIZE = 1 << 16
+# what normalize_file() did with a file
+WRITTEN, UNCHANGED, UP_TO_DATE = "written", "unchanged", "up to date"
+
+
+def normalize_stream(input_stream: typing.TextIO,
+                     output_stream: typing.TextIO,
+                     block_size: int = BLOCK_SIZE) -> bool:
+    """Writes the lines of the input stream, stripped, to the output stream,
+    leaving out the empty ones.
+
+    Args:
+        input_stream (typing.TextIO): the input, opened with newline="" so
+            that carriage returns are stripped too.
+        output_stream (typing.TextIO): the output, opened with newline="".
+        block_size (int): number of characters read at once.
+
+    Returns:
+        bool: True if anything was stripped or left out, i.e. the output
+        differs from the input.
+    """
+    changed = False
+    # a line which may go on in the next block
+    carry = ""
+    first = True
+    while True:
+        block = input_stream.read(block_size)
+        buffer = carry + block
+        end = len(buffer) if not block else buffer.rfind("\n") + 1
+        if end:
+            lines = buffer[:end].split("\n")
+            if block:
+                # the block ends with a newline, which leaves an empty piece
+                lines.pop()
+            kept = [line for line in map(str.strip, lines) if line]
+            text = "\n".join(kept)
+            if text != "\n".join(lines):
+                changed = True
+            if text:
+                if not first:
+                    output_stream.write("\n")
+                output_stream.write(text)
+                first = False
+        if not block:
+            if not first:
+                output_stream.write("\n")
+            # an unfinished last line is finished in the output
+            return changed or bool(buffer)
+        carry = buffer[end:]
+
+
+def normalize_file(input_path: str, output_path: str,
+                   block_size: int = BLOCK_SIZE) -> str:
+    """Normalizes an XML file (see normalize_stream), atomically.
+
+    Args:
+        input_path (str): the file.
+        output_path (str): where to write the normalized file, input_path
+            itself to normalize it in place.
+        block_size (int): number of characters read at once.
+
+    Returns:
+        str: WRITTEN, or UNCHANGED if the output already was what it would
+        have been written as, or UP_TO_DATE if the output was newer than the
+        input and the input was not even read.
+    """
+    in_place = os.path.abspath(output_path) == os.path.abspath(input_path)
+    if not in_place and is_up_to_date(input_path, output_path):
+        return UP_TO_DATE
+    directory = os.path.dirname(os.path.abspath(output_path))
+    os.makedirs(directory, exist_ok=True)
+    descriptor, temp_path = tempfile.mkstemp(dir=directory)
+    try:
+        with open(input_path, 'r', newline="") as input_file, \
+                os.fdopen(descriptor, 'w', newline="") as output_file:
+            changed = normalize_stream(input_file, output_file, block_size)
+        if not changed if in_place else \
+                os.path.exists(output_path) and \
+                filecmp.cmp(temp_path, output_path, shallow=False):
+            # left as it is, so it stays up to date for later runs
+            os.remove(temp_path)
+            return UNCHANGED
+        shutil.copymode(input_path, temp_path)
+        os.replace(temp_path, output_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    return WRITTEN
+
+
+def is_up_to_date(input_path: str, output_path: str) -> bool:
+    """
+    Returns:
+        bool: True if the output exists and was modified after the input.
+    """
+    try:
+        return os.stat(output_path).st_mtime_ns >= \
+            os.stat(input_path).st_mtime_ns
+    except OSError:
+        return False
+
+
+def normalize_task(input_path: str, output_path: str,
+                   block_size: int) -> str:
+    """normalize_file(), with failures described rather than raised, so a
+    file which fails does not stop the rest of a batch."""
+    try:
+        return normalize_file(input_path, output_path, block_size)
+    except (OSError, UnicodeDecodeError) as error:
+        return "failed: %s" % error
 
-if "__main__" == __name__:
-    argument_path = os.path.abspath(sys.argv[1])
-    if os.path.isdir(argument_path):
-        files_to_assemble = [
-            os.path.join(argument_path, filename)
-            for filename in os.listdir(argument_path)]
-    else:
-        files_to_assemble = [argument_path]
-    for input_path in files_to_assemble:
-        filename, extension = os.path.splitext(input_path)
-
-        output_path = filename + ".xml"
-        with open(input_path, 'r') as input_file, \
-                open(output_path, 'w') as output_file:
-            input = input_file.read().splitlines()
-            a=[]
-            for line in input:
-                b=line.strip(" ")
-                a.append(b)
-                print(b)
-            input_file=a
 
+def normalize_paths(pairs: typing.List[typing.Tuple[str, str]],
+                    jobs: int = 1, block_size: int = BLOCK_SIZE
+                    ) -> typing.Dict[str, str]:
+    """Normalizes several files, in worker processes if jobs > 1.
 
+    Args:
+        pairs (typing.List[typing.Tuple[str, str]]): (input, output) paths,
+            see normalize_file.
+        jobs (int): number of worker processes to use.
+        block_size (int): number of characters read at once.
+
+    Returns:
+        typing.Dict[str, str]: maps every input path, in order, to what was
+        done with it (see normalize_file), or a description of its failure.
+    """
+    input_paths = [pair[0] for pair in pairs]
+    output_paths = [pair[1] for pair in pairs]
+    sizes = itertools.repeat(block_size)
+    if jobs <= 1 or len(pairs) <= 1:
+        return dict(zip(input_paths, map(normalize_task, input_paths,
+                                         output_paths, sizes)))
+    workers = min(jobs, len(pairs))
+    # normalizing a small file takes less than sending it to a worker, so
+    # every worker is sent its files in batches
+    chunk_size = max(1, len(pairs) // (workers * 8))
+    with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+        return dict(zip(input_paths, pool.map(
+            normalize_task, input_paths, output_paths, sizes,
+            chunksize=chunk_size)))
+
+
+def list_xml_files(argument_path: str) -> typing.List[str]:
+    """
+    Args:
+        argument_path (str): an .xml file, or a directory of them.
+
+    Returns:
+        typing.List[str]: the .xml files (recursively, sorted).
+    """
+    if not os.path.isdir(argument_path):
+        return [argument_path]
+    input_paths = []
+    for directory, subdirectories, filenames in os.walk(argument_path):
+        subdirectories.sort()
+        input_paths.extend(
+            os.path.join(directory, filename)
+            for filename in sorted(filenames)
+            if os.path.splitext(filename)[1].lower() == ".xml")
+    return input_paths
+
+
+def pair_files(argument_path: str, output_dir: str
+               ) -> typing.List[typing.Tuple[str, str]]:
+    """
+    Args:
+        argument_path (str): an .xml file, or a directory of them.
+        output_dir (str): where to write the normalized files, under their
+            paths relative to argument_path (or its directory).
+
+    Returns:
+        typing.List[typing.Tuple[str, str]]: the .xml files (see
+        list_xml_files), each with its output path.
+    """
+    root = argument_path if os.path.isdir(argument_path) \
+        else os.path.dirname(argument_path)
+    return [(input_path,
+             os.path.join(output_dir, os.path.relpath(input_path, root)))
+            for input_path in list_xml_files(argument_path)]
+
+
+def print_normalized(input_paths: typing.List[str],
+                     block_size: int = BLOCK_SIZE) -> int:
+    """Prints several files, normalized, and their failures to stderr.
+
+    Returns:
+        int: the number of files which failed.
+    """
+    failed = 0
+    for input_path in input_paths:
+        try:
+            with open(input_path, 'r', newline="") as input_file:
+                normalize_stream(input_file, sys.stdout, block_size)
+        except (OSError, UnicodeDecodeError) as error:
+            print("%s: failed: %s" % (input_path, error), file=sys.stderr)
+            failed += 1
+    return failed
+
+
+def print_statuses(statuses: typing.Dict[str, str]) -> int:
+    """Prints the failures of a batch to stderr, and how many files were
+    written, unchanged and up to date.
+
+    Returns:
+        int: the number of files which failed.
+    """
+    counts = dict.fromkeys((WRITTEN, UNCHANGED, UP_TO_DATE), 0)
+    failed = 0
+    for input_path, status in statuses.items():
+        if status in counts:
+            counts[status] += 1
+        else:
+            print("%s: %s" % (input_path, status), file=sys.stderr)
+            failed += 1
+    print("normalized %d files: %s" % (len(statuses), ", ".join(
+        "%d %s" % (count, status) for status, count in counts.items())) +
+        (", %d failed" % failed if failed else ""))
+    return failed
+
+
+if "__main__" == __name__:
+    parser = argparse.ArgumentParser(
+        prog="remove_spaces",
+        description="Strips the whitespace around every line of XML files.")
+    parser.add_argument("input_path", help="an .xml file or a directory")
+    parser.add_argument("-o", "--output-dir",
+                        help="where to write the normalized files (default: "
+                             "print them)")
+    parser.add_argument("-i", "--in-place", action="store_true",
+                        help="write the normalized files over themselves")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1,
+                        help="number of worker processes (default: the "
+                             "number of CPUs)")
+    parser.add_argument("--block-size", type=int, default=BLOCK_SIZE,
+                        help="characters read at a time")
+    args = parser.parse_args()
+    if args.in_place and args.output_dir is not None:
+        parser.error("--in-place cannot be combined with --output-dir")
+    argument_path = os.path.abspath(args.input_path)
+    if args.output_dir is None and not args.in_place:
+        failed = print_normalized(list_xml_files(argument_path),
+                                  args.block_size)
+    else:
+        start = time.perf_counter()
+        if args.in_place:
+            pairs = [(input_path, input_path)
+                     for input_path in list_xml_files(argument_path)]
+        else:
+            pairs = pair_files(argument_path, args.output_dir)
+        failed = print_statuses(normalize_paths(pairs, args.jobs,
+                                                args.block_size))
+        print("in %.1f ms" % ((time.perf_counter() - start) * 1000))
+    if failed:
+        sys.exit(1)
@@ -0,0 +1,8 @@
+"""
+The modules of the analyzer live in the root of the repository, next to
+this directory, and are imported by their names.
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,89 @@
+import os
+import subprocess
+import sys
+import JackAnalyzer
+from BuildCache import BuildCache
+from JackAnalyzer import AnalyzerOptions, analyze_paths, analyzer_version, \
+    output_path_for
+
+SOURCE = """class Main {
+    function void main() {
+        var int x;
+        let x = 1 + 2;
+        return;
+    }
+}
+"""
+
+
+def write_program(directory):
+    path = os.path.join(str(directory), "Main.jack")
+    with open(path, 'w') as source_file:
+        source_file.write(SOURCE)
+    return path
+
+
+def test_cache_mode_includes_the_token_budget():
+    modes = {AnalyzerOptions().cache_mode(),
+             AnalyzerOptions(max_tokens=10).cache_mode(),
+             AnalyzerOptions(max_tokens=20).cache_mode()}
+    assert len(modes) == 3
+
+
+def test_cached_output_is_restored(tmp_path):
+    path = write_program(tmp_path)
+    cache = BuildCache(str(tmp_path / "cache"))
+    first = analyze_paths([path], options=AnalyzerOptions(), cache=cache)
+    output_path = output_path_for(path)
+    with open(output_path) as output_file:
+        expected = output_file.read()
+    os.remove(output_path)
+    cache = BuildCache(str(tmp_path / "cache"))
+    second = analyze_paths([path], options=AnalyzerOptions(), cache=cache)
+    assert not first[path].cached
+    assert second[path].cached
+    with open(output_path) as output_file:
+        assert output_file.read() == expected
+
+
+def test_token_budget_is_not_bypassed_by_the_cache(tmp_path):
+    path = write_program(tmp_path)
+    cache_dir = str(tmp_path / "cache")
+    results = analyze_paths([path], cache=BuildCache(cache_dir))
+    assert results[path].error is None
+    results = analyze_paths([path], options=AnalyzerOptions(max_tokens=5),
+                            cache=BuildCache(cache_dir))
+    assert not results[path].cached
+    assert results[path].error is not None
+
+
+def test_version_does_not_depend_on_the_loaded_modules():
+    version = analyzer_version()
+    analyzer_version.cache_clear()
+    import CompileServer
+    import HackEmulator
+    import XMLCompare
+    assert analyzer_version() == version
+
+
+def test_version_covers_the_listed_modules(monkeypatch):
+    version = analyzer_version()
+    monkeypatch.setattr(JackAnalyzer, "ANALYZER_MODULES",
+                        JackAnalyzer.ANALYZER_MODULES[:-1])
+    analyzer_version.cache_clear()
+    try:
+        assert analyzer_version() != version
+    finally:
+        analyzer_version.cache_clear()
+
+
+def test_cli_does_not_cache_unless_asked(tmp_path):
+    analyzer = os.path.join(os.path.dirname(JackAnalyzer.__file__),
+                            "JackAnalyzer.py")
+    write_program(tmp_path)
+    subprocess.run([sys.executable, analyzer, str(tmp_path)], check=True,
+                   stdout=subprocess.DEVNULL)
+    assert not os.path.exists(tmp_path / ".jackcache")
+    subprocess.run([sys.executable, analyzer, "--cache", str(tmp_path)],
+                   check=True, stdout=subprocess.DEVNULL)
+    assert os.path.isdir(tmp_path / ".jackcache")
@@ -0,0 +1,121 @@
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+import pytest
+import CompileServer
+from CompileServer import MAX_IN_FLIGHT, CompileClient, remove_stale_socket
+from JackAnalyzer import AnalyzerOptions, analyze_sources
+
+SOURCE = """class Main {
+    function void main() {
+        do Output.printInt(1 + 2);
+        return;
+    }
+}
+"""
+
+
+@pytest.fixture
+def server(tmp_path):
+    """A server with two workers, and the path of its socket."""
+    socket_path = str(tmp_path / "server.sock")
+    process = subprocess.Popen([sys.executable, CompileServer.__file__,
+                                "serve", "--socket", socket_path, "-j", "2"])
+    try:
+        deadline = time.monotonic() + 30
+        while not os.path.exists(socket_path):
+            assert process.poll() is None, "the server did not start"
+            assert time.monotonic() < deadline, "the server did not start"
+            time.sleep(0.01)
+        yield process, socket_path
+    finally:
+        process.terminate()
+        process.wait(10)
+
+
+def worker_pids(pid):
+    """The processes whose parent is the given one (Linux only)."""
+    children = []
+    for entry in os.listdir("/proc"):
+        if entry.isdigit():
+            try:
+                with open("/proc/%s/stat" % entry) as stat_file:
+                    fields = stat_file.read().rsplit(")", 1)[1].split()
+            except OSError:
+                continue
+            if int(fields[1]) == pid:
+                children.append(int(entry))
+    return children
+
+
+def test_compile(server):
+    _, socket_path = server
+    expected = analyze_sources([SOURCE], AnalyzerOptions(target="vm"))[0]
+    with CompileClient(socket_path) as client:
+        response = client.compile(SOURCE, target="vm")
+    assert response == {"id": 0, "output": expected.output,
+                        "report": expected.report}
+
+
+@pytest.mark.parametrize("options, error", [
+    ({"target": "asm"}, "Bad request: Unknown target 'asm'"),
+    ({"optimize": True}, "Bad request: optimize only applies to target vm"),
+])
+def test_bad_requests(server, options, error):
+    _, socket_path = server
+    with CompileClient(socket_path) as client:
+        assert client.compile(SOURCE, **options)["error"] == error
+
+
+def test_pipelined_requests_are_answered_in_order(server):
+    _, socket_path = server
+    sources = [SOURCE.replace("1 + 2", "%d + 2" % index)
+               for index in range(MAX_IN_FLIGHT * 3)]
+    with CompileClient(socket_path) as client:
+        responses = client.compile_many(sources, target="vm")
+    assert [response["id"] for response in responses] == \
+        list(range(len(sources)))
+    assert all("push constant %d" % index in response["output"]
+               for index, response in enumerate(responses))
+
+
+@pytest.mark.skipif(not os.path.isdir("/proc"), reason="needs /proc")
+def test_server_survives_a_dead_worker(server):
+    process, socket_path = server
+    with CompileClient(socket_path) as client:
+        assert "output" in client.compile(SOURCE)
+        workers = worker_pids(process.pid)
+        assert workers
+        os.kill(workers[0], signal.SIGKILL)
+        for _ in range(3):
+            assert "output" in client.compile(SOURCE)
+    assert process.poll() is None
+    assert not set(workers) & set(worker_pids(process.pid))
+
+
+def test_stale_socket_is_removed(tmp_path):
+    socket_path = str(tmp_path / "stale.sock")
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    listener.bind(socket_path)
+    listener.listen()
+    try:
+        with pytest.raises(OSError):
+            remove_stale_socket(socket_path)
+    finally:
+        listener.close()
+    # nothing listens on it any more
+    remove_stale_socket(socket_path)
+    assert not os.path.exists(socket_path)
+
+
+def test_oversized_message_is_refused(server):
+    _, socket_path = server
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.connect(socket_path)
+        client.sendall(CompileServer.LENGTH.pack(
+            CompileServer.MAX_MESSAGE_SIZE + 1))
+        reply = client.makefile('rb').read()
+    assert b"Message of" in reply
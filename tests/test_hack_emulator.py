@@ -0,0 +1,189 @@
+import random
+import pytest
+from HackEmulator import HackMachine, assemble, read_hack
+
+COMPUTATIONS = ["0", "1", "-1", "D", "A", "!D", "!A", "-D", "-A", "D+1",
+                "A+1", "D-1", "A-1", "D+A", "D-A", "A-D", "D&A", "D|A"]
+COMPUTATIONS += [computation.replace("A", "M") for computation in
+                 COMPUTATIONS if "A" in computation]
+DESTINATIONS = ["", "M", "D", "MD", "A", "AM", "AD", "AMD"]
+JUMPS = ["JGT", "JEQ", "JGE", "JLT", "JNE", "JLE", "JMP"]
+
+
+def reference(rom, max_steps=100000):
+    """Runs machine code an instruction at a time, decoding the ALU's
+    control bits as the Hack CPU does, until it reaches an end loop.
+
+    Returns:
+        tuple: the D register and the RAM.
+    """
+    ram = [0] * 65536
+    a_register = d_register = pc = 0
+    for _ in range(max_steps):
+        word = rom[pc]
+        if word < 0x8000:
+            a_register = word
+            pc += 1
+            continue
+        if word & 0x3F == 7 and a_register == pc - 1 and \
+                rom[pc - 1] == pc - 1:
+            return d_register, ram
+        x = d_register
+        y = ram[a_register] if word & 0x1000 else a_register
+        if word & 0x800:
+            x = 0
+        if word & 0x400:
+            x ^= 0xFFFF
+        if word & 0x200:
+            y = 0
+        if word & 0x100:
+            y ^= 0xFFFF
+        out = (x + y if word & 0x80 else x & y) & 0xFFFF
+        if word & 0x40:
+            out ^= 0xFFFF
+        if word & 0x8:
+            ram[a_register] = out
+        if word & 0x10:
+            d_register = out
+        jump = (word & 4 and out >= 0x8000) or (word & 2 and out == 0) or \
+            (word & 1 and 0 < out < 0x8000)
+        if word & 0x20:
+            a_register = out
+        pc = a_register if jump else pc + 1
+    raise AssertionError("The program did not halt")
+
+
+def random_program(generator, length):
+    """A program which only jumps forwards, so it halts."""
+    lines = []
+    for index in range(length):
+        if generator.random() < 0.15:
+            # jumps go to labels placed later on
+            target = generator.randrange(index + 1, length + 1)
+            lines.append("@L%d" % target)
+            lines.append("%s;%s" % (generator.choice(["D", "M", "0", "D-1"]),
+                                    generator.choice(JUMPS)))
+        elif generator.random() < 0.4:
+            lines.append("@%d" % generator.choice(
+                [0, 1, 2, 100, generator.randrange(32768)]))
+        else:
+            destination = generator.choice(DESTINATIONS)
+            computation = generator.choice(COMPUTATIONS)
+            lines.append((destination + "=" if destination else "") +
+                         computation)
+        lines.append("(L%d)" % (index + 1))
+    lines += ["(END)", "@END", "0;JMP"]
+    return "\n".join(lines)
+
+
+def test_random_programs_run_as_on_the_cpu():
+    generator = random.Random(7)
+    for _ in range(300):
+        program = assemble(random_program(generator, 60))
+        machine = HackMachine(program)
+        machine.run(10 ** 5)
+        assert machine.halted
+        d_register, ram = reference(program.rom)
+        assert machine.d_register == d_register
+        assert machine.ram == ram
+
+
+@pytest.mark.parametrize("source, word", [
+    ("@5", 5),
+    ("D=A", 0b1110110000010000),
+    ("M=M+1", 0b1111110111001000),
+    ("AMD=D|M;JLE", 0b1111010101111110),
+    ("0;JMP", 0b1110101010000111),
+])
+def test_assemble(source, word):
+    assert assemble(source).rom == [word]
+
+
+def test_labels_and_variables():
+    program = assemble("@x\nM=1\n(LOOP)\n@y\nM=0\n@LOOP\n@x\n@R13\n@SCREEN")
+    assert program.labels == {"LOOP": 2}
+    assert program.rom == [16, 0b1110111111001000, 17, 0b1110101010001000,
+                           2, 16, 13, 16384]
+
+
+@pytest.mark.parametrize("source, message", [
+    ("@32768", "Constant 32768 is too large in line 1"),
+    ("D=X", "Malformed instruction 'D=X' in line 1"),
+    ("DD=A", "Malformed instruction 'DD=A' in line 1"),
+    ("D;JXX", "Malformed instruction 'D;JXX' in line 1"),
+    ("\n(LOOP", "Malformed label '(LOOP' in line 2"),
+])
+def test_assemble_errors(source, message):
+    with pytest.raises(ValueError) as error:
+        assemble(source)
+    assert str(error.value) == message
+
+
+def test_read_hack():
+    source = "@7\nD=A\n@3\nM=D"
+    rom = assemble(source).rom
+    assert read_hack("\n".join(format(word, "016b") for word in rom)).rom == \
+        rom
+    with pytest.raises(ValueError):
+        read_hack("0101")
+
+
+@pytest.mark.parametrize("value, left, right", [
+    (3, 6, 1),
+    (0x4001, 0x8002, 0x2000),
+    # the right shift is arithmetic
+    (0x8004, 0x0008, 0xC002),
+    (0xFFFF, 0xFFFE, 0xFFFF),
+])
+def test_shifts(value, left, right):
+    machine = HackMachine(assemble(
+        "@0\nD=M\n@1\nM=D<<\n@0\nD=M>>\n@2\nM=D\n(END)\n@END\n0;JMP"))
+    machine.ram[0] = value
+    machine.run()
+    assert machine.halted
+    assert machine.ram[1:3] == [left, right]
+
+
+def test_halts():
+    # at Sys.halt, and when the program runs out of the ROM
+    for source in ("@5\nD=A\n(Sys.halt)\n@Sys.halt\nD=D+1;JMP",
+                   "@5\nD=A\n@100\nM=D"):
+        machine = HackMachine(assemble(source))
+        machine.run(1000)
+        assert machine.halted
+    # a loop which changes something runs out of cycles
+    machine = HackMachine(assemble("(LOOP)\n@0\nM=M+1\n@LOOP\n0;JMP"))
+    cycles = machine.run(1000)
+    assert not machine.halted
+    assert 1000 <= cycles < 1010
+
+
+def test_profile():
+    machine = HackMachine(assemble("""
+        @Main.main
+        0;JMP
+        (Main.f)
+        @3
+        D=A
+        (Main.f$LOOP)
+        D=D-1
+        @Main.f$LOOP
+        D;JGT
+        @END
+        0;JMP
+        (Main.main)
+        @Main.f
+        0;JMP
+        (END)
+        @END
+        0;JMP
+    """))
+    machine.run()
+    profile = machine.profile()
+    assert profile["halted"]
+    functions = profile["functions"]
+    # labels inside a function (with a '$') belong to it
+    assert set(functions) == {"(unlabeled)", "Main.f", "Main.main", "END"}
+    assert functions["Main.f"]["cycles"] == 2 + 3 * 3 + 2
+    assert sum(function["cycles"] for function in functions.values()) == \
+        profile["cycles"]
@@ -0,0 +1,65 @@
+import itertools
+import pytest
+from JackAnalyzer import AnalyzerOptions, analyze_sources
+
+# every way of parsing must fail the same way
+MODES = [dict(streaming=streaming, iterative=iterative)
+         for streaming, iterative in itertools.product((False, True),
+                                                       repeat=2)]
+# sources which end in the middle of a loop of the parser
+UNTERMINATED = [
+    "",
+    "class Main {",
+    "class Main { field int x",
+    "class Main { function void main(int x",
+    "class Main { function void main() { var int x",
+    "class Main { function void main() { let x = 1",
+    "class Main { function void main() { do f(1, 2",
+    "class Main { function void main() { while (true) {",
+    "class Main { function void main() { return; }",
+]
+# sources which only the strict mode rejects, with its diagnostics
+STRICT_ERRORS = [
+    ("class Main { function void main(int x { return; } }",
+     "Expected ')' but got '{' (a symbol) in line 1"),
+    ("class Main {\n    field int x y z\n}",
+     "Expected ';' but got 'y' (an identifier) in line 2"),
+    ("class Main {\n    function void main() {\n        + + +\n    }\n}",
+     "Expected '}' but got '+' (a symbol) in line 3"),
+    ("class Main { function void main() { return; } } extra",
+     "Expected end of input but got 'extra' (an identifier) in line 1"),
+]
+
+
+def error_of(source, **options):
+    # a parser loop which stops making progress fails rather than hangs
+    options.setdefault("timeout", 5.0)
+    return analyze_sources([source], AnalyzerOptions(**options))[0].error
+
+
+@pytest.mark.parametrize("mode", MODES)
+@pytest.mark.parametrize("source", UNTERMINATED)
+def test_unterminated_input_fails(source, mode):
+    assert error_of(source, **mode) == \
+        "ValueError: Unexpected end of input in line 1"
+
+
+@pytest.mark.parametrize("mode", MODES)
+@pytest.mark.parametrize("source", UNTERMINATED)
+def test_unterminated_input_fails_in_strict_mode(source, mode):
+    assert "but got end of input in line 1" in \
+        error_of(source, strict=True, **mode)
+
+
+@pytest.mark.parametrize("mode", MODES)
+@pytest.mark.parametrize("source, message", STRICT_ERRORS)
+def test_strict_diagnostics(source, message, mode):
+    assert error_of(source, strict=True, **mode) == "ValueError: " + message
+
+
+@pytest.mark.parametrize("target", ["xml", "vm"])
+def test_token_budget(target):
+    source = "class Main { function void main() { return; } }"
+    assert error_of(source, target=target, max_tokens=13) is None
+    assert error_of(source, target=target, max_tokens=12) == \
+        "ValueError: Too many tokens: 13, the limit is 12"
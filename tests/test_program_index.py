@@ -0,0 +1,53 @@
+import io
+from JackAnalyzer import index_file
+from ProgramIndex import OS_INITS, ProgramIndex
+
+FOO = """class Foo {
+    field int x;
+    constructor Foo new() { let x = 1; return this; }
+    method int f(int a) { var String s; let s = "hi"; return (a * x) / 3; }
+    function void g() { do Foo.h(); do Bar.k(); return; }
+}
+"""
+
+
+def index_of(*sources):
+    index = ProgramIndex()
+    for source in sources:
+        index.add(index_file(io.StringIO(source)))
+    return index
+
+
+def test_implicit_os_calls_are_indexed():
+    subroutines = index_file(io.StringIO(FOO)).subroutines
+    assert subroutines["new"].calls == ("Memory.alloc",)
+    assert subroutines["f"].calls == ("String.new", "String.appendChar",
+                                      "Math.multiply", "Math.divide")
+    assert subroutines["g"].calls == ("Foo.h", "Bar.k")
+
+
+def test_entry_points():
+    main = "class Main { function void main() { return; } }"
+    sys_class = "class Sys { function void init() { do Main.main(); " \
+                "return; } }"
+    assert index_of(main).entry_points() == ("Main.main",) + OS_INITS
+    assert index_of(main, sys_class).entry_points() == ("Sys.init",)
+
+
+def test_reachable_subroutines():
+    index = index_of(
+        "class Main { function void main() { do Main.used(); return; }\n"
+        "function void used() { return 2 * 3; }\n"
+        "function void unused() { do Main.used(); return; } }",
+        "class Math { function int multiply(int x, int y) { return 0; }\n"
+        "function int divide(int x, int y) { return 0; } }")
+    roots = index.entry_points()
+    assert index.reachable(roots) == {"Main.main", "Main.used",
+                                      "Math.multiply"}
+    assert index.unreachable(roots) == ["Main.unused", "Math.divide"]
+
+
+def test_undefined_calls():
+    index = index_of(FOO, "class Bar { function void j() { return; } }")
+    # Foo.h and Bar.k are missing, calls into the OS are not reported
+    assert index.undefined_calls() == [("Foo.g", "Foo.h"), ("Foo.g", "Bar.k")]
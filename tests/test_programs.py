@@ -0,0 +1,82 @@
+import os
+import shutil
+import pytest
+from HackEmulator import HackMachine, load_program
+from JackAnalyzer import AnalyzerOptions, analyze_paths, analyze_program, \
+    list_jack_files
+
+PROGRAMS = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        "programs")
+# where Main.main of the Sample program stores its results
+RESULTS = 8000
+EXPECTED = [144, -1, -1, 0, 0, -1, 40, 25, 2470, 13, 2, 19, -3, -1, 42, -1,
+            30000, 80, -160]
+
+
+def build(directory, tmp_path, options, extra=None, prune=False):
+    """Compiles a program of tests/programs into VM code in tmp_path.
+
+    Args:
+        extra (dict): maps the names of more .jack files to their sources.
+        prune (bool): compile it with analyze_program, as for --prune.
+
+    Returns:
+        tuple: the directory of the VM files, and the results of the
+        analysis.
+    """
+    build_dir = str(tmp_path / directory)
+    shutil.copytree(os.path.join(PROGRAMS, directory), build_dir)
+    for name, source in (extra or {}).items():
+        with open(os.path.join(build_dir, name), 'w') as source_file:
+            source_file.write(source)
+    analyze = analyze_program if prune else analyze_paths
+    results = analyze(list_jack_files(build_dir), options=options)
+    assert [result.error for result in results.values()] == \
+        [None] * len(results)
+    return build_dir, results
+
+
+def run(build_dir, count):
+    """Runs a compiled program until it halts.
+
+    Returns:
+        list: the signed words of its results.
+    """
+    machine = HackMachine(load_program(build_dir))
+    machine.run()
+    assert machine.halted
+    return [word - 0x10000 if word & 0x8000 else word
+            for word in machine.ram[RESULTS:RESULTS + count]]
+
+
+@pytest.mark.parametrize("optimizing", [False, True])
+def test_sample_program(tmp_path, optimizing):
+    build_dir, _ = build("Sample", tmp_path,
+                         AnalyzerOptions(target="vm", optimizing=optimizing))
+    assert run(build_dir, len(EXPECTED)) == EXPECTED
+
+
+def test_optimized_sample_program_is_smaller(tmp_path):
+    sizes = []
+    for optimizing in (False, True):
+        build_dir, _ = build(
+            "Sample", tmp_path / str(optimizing),
+            AnalyzerOptions(target="vm", optimizing=optimizing))
+        with open(os.path.join(build_dir, "Main.vm")) as vm_file:
+            sizes.append(len(vm_file.read().splitlines()))
+    assert sizes[1] < sizes[0]
+
+
+@pytest.mark.parametrize("optimizing", [False, True])
+def test_pruned_sample_program(tmp_path, optimizing):
+    # Math.multiply and Memory.alloc are only called implicitly, for '*' and
+    # in a constructor, and Sys.init only by the bootstrap code
+    unused = "class Unused { function int f() { return Main.fib(3); } }"
+    build_dir, results = build(
+        "Sample", tmp_path, AnalyzerOptions(target="vm",
+                                            optimizing=optimizing),
+        extra={"Unused.jack": unused}, prune=True)
+    eliminated = [name for result in results.values()
+                  for name in result.report["eliminated"]]
+    assert eliminated == ["Unused.f"]
+    assert run(build_dir, len(EXPECTED)) == EXPECTED
@@ -0,0 +1,93 @@
+import os
+import pytest
+from JackAnalyzer import AnalyzerOptions, analyze_path, output_path_for
+from JackTokenizer import scan
+from TokenCache import HEADER, cached_scan, load_tokens, sidecar_path
+
+SOURCE = """// a class with every kind of token
+class Main {
+    function void main() {
+        var String s;
+        let s = "café";  /* a comment */
+        do Output.printInt(-32767 + 12);
+        return;
+    }
+}
+"""
+
+
+def table_lists(table):
+    return (list(table.kinds), list(table.starts), list(table.ends),
+            list(table.lexeme_ids), list(table.lexicon))
+
+
+@pytest.fixture
+def sidecar(tmp_path):
+    """The path of a freshly written sidecar of SOURCE."""
+    path = str(tmp_path / "Main.jack.tok")
+    table, loaded = cached_scan(SOURCE, path)
+    assert not loaded
+    assert os.path.exists(path)
+    return path
+
+
+def corrupt(path, offset, data=None):
+    """Overwrites (or, with no data, truncates) a sidecar at an offset."""
+    with open(path, 'r+b') as sidecar_file:
+        if data is None:
+            sidecar_file.truncate(offset)
+        else:
+            sidecar_file.seek(offset)
+            sidecar_file.write(data)
+
+
+def test_sidecar_is_loaded(sidecar):
+    table, loaded = cached_scan(SOURCE, sidecar)
+    assert loaded
+    assert table_lists(table) == table_lists(scan(SOURCE))
+
+
+def test_changed_source_is_scanned_again(sidecar):
+    source = SOURCE.replace("12", "13")
+    table, loaded = cached_scan(source, sidecar)
+    assert not loaded
+    assert table_lists(table) == table_lists(scan(source))
+    # and the sidecar now matches the new source
+    assert cached_scan(source, sidecar)[1]
+
+
+@pytest.mark.parametrize("damage", [
+    # a flipped byte in the body fails the checksum
+    lambda path: corrupt(path, os.path.getsize(path) - 1, b"\xff"),
+    lambda path: corrupt(path, HEADER.size, b"\x7f"),
+    # truncated, in the body or in the header
+    lambda path: corrupt(path, os.path.getsize(path) - 4),
+    lambda path: corrupt(path, HEADER.size - 1),
+    lambda path: corrupt(path, 0),
+    # bad magic, and the digest of another tokenizer
+    lambda path: corrupt(path, 0, b"XTOK"),
+    lambda path: corrupt(path, 8, bytes(32)),
+])
+def test_damaged_sidecar_is_rebuilt(sidecar, damage):
+    damage(sidecar)
+    assert load_tokens(sidecar, SOURCE) is None
+    table, loaded = cached_scan(SOURCE, sidecar)
+    assert not loaded
+    assert table_lists(table) == table_lists(scan(SOURCE))
+    assert cached_scan(SOURCE, sidecar)[1]
+
+
+def test_analysis_from_sidecars_is_the_same(tmp_path):
+    input_path = str(tmp_path / "Main.jack")
+    with open(input_path, 'w') as input_file:
+        input_file.write(SOURCE)
+    token_dir = str(tmp_path / "tokens")
+    outputs = []
+    # lexed, then lexed into a sidecar, then loaded from it
+    for directory in (None, token_dir, token_dir):
+        options = AnalyzerOptions(target="vm", token_dir=directory)
+        assert analyze_path(input_path, options).error is None
+        with open(output_path_for(input_path, "vm")) as output_file:
+            outputs.append(output_file.read())
+    assert os.path.exists(sidecar_path(input_path, token_dir))
+    assert outputs[1] == outputs[2] == outputs[0]
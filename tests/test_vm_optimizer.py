@@ -0,0 +1,132 @@
+import random
+import pytest
+from VMOptimizer import optimize, to_word
+
+
+@pytest.mark.parametrize("commands, expected", [
+    # folding, also across rewrites and with the 16-bit wrap-around
+    (["push constant 2", "push constant 8", "call Math.multiply 2",
+      "push constant 1", "add"], ["push constant 17"]),
+    (["push constant 32767", "push constant 1", "add"],
+     ["push constant 32767", "not"]),
+    (["push constant 300", "push constant 300", "call Math.multiply 2"],
+     ["push constant 24464"]),
+    (["push constant 7", "neg", "push constant 2", "call Math.divide 2"],
+     ["push constant 3", "neg"]),
+    (["push constant 1", "neg", "push constant 1", "gt"],
+     ["push constant 0"]),
+    # a division by zero is left for the program to report
+    (["push constant 1", "push constant 0", "call Math.divide 2"],
+     ["push constant 1", "push constant 0", "call Math.divide 2"]),
+    # identities
+    (["push local 0", "push constant 0", "add"], ["push local 0"]),
+    (["push local 0", "push constant 1", "neg", "and"], ["push local 0"]),
+    (["push constant 1", "push local 0", "call Math.multiply 2"],
+     ["push local 0"]),
+    (["push constant 0", "push local 0", "sub"], ["push local 0", "neg"]),
+    # peepholes
+    (["push local 0", "pop local 0"], []),
+    (["push local 0", "neg", "neg"], ["push local 0"]),
+    (["goto L", "label L"], ["label L"]),
+    (["push constant 0", "if-goto L", "push constant 1", "if-goto M"],
+     ["goto M"]),
+])
+def test_rewrites(commands, expected):
+    assert optimize(commands) == expected
+
+
+@pytest.mark.parametrize("commands, expected", [
+    (["push local 0", "push constant 4", "call Math.multiply 2"],
+     ["push local 0", "shiftleft", "shiftleft"]),
+    (["push constant 4", "push local 0", "call Math.multiply 2"],
+     ["push local 0", "shiftleft", "shiftleft"]),
+    (["push local 0", "push constant 255", "and", "push constant 4",
+      "call Math.divide 2"],
+     ["push local 0", "push constant 255", "and", "shiftright",
+      "shiftright"]),
+])
+def test_strength_reduction(commands, expected):
+    assert optimize(commands) == expected
+
+
+@pytest.mark.parametrize("commands", [
+    # more shifts than the constant and the call they would replace
+    ["push local 0", "push constant 8", "call Math.multiply 2"],
+    ["push local 0", "push constant 16384", "call Math.multiply 2"],
+    ["push constant 8", "push local 0", "call Math.multiply 2"],
+    # the dividend may be negative, which a shift rounds the wrong way
+    ["push local 0", "push constant 4", "call Math.divide 2"],
+    ["push local 0", "push constant 2", "call Math.divide 2"],
+    ["push local 0", "push local 1", "and", "push constant 2",
+     "call Math.divide 2"],
+])
+def test_no_strength_reduction(commands):
+    assert optimize(commands) == commands
+
+
+def evaluate(commands, local):
+    """Runs straight-line VM code on 16-bit words, the way the Hack platform
+    (with the OS's Math.multiply and Math.divide) does."""
+    stack = []
+    binary = {
+        "add": lambda x, y: x + y,
+        "sub": lambda x, y: x - y,
+        "and": lambda x, y: x & y,
+        "or": lambda x, y: x | y,
+        "lt": lambda x, y: -(x < y),
+        "gt": lambda x, y: -(x > y),
+        "eq": lambda x, y: -(x == y),
+        "call Math.multiply 2": lambda x, y: x * y,
+        "call Math.divide 2":
+            lambda x, y: abs(x) // abs(y) * (1 if (x < 0) == (y < 0) else -1),
+    }
+    for command in commands:
+        words = command.split()
+        if words[0] == "push":
+            stack.append(int(words[2]) if words[1] == "constant"
+                         else local[int(words[2])])
+        elif command == "neg":
+            stack.append(to_word(-stack.pop()))
+        elif command == "not":
+            stack.append(to_word(~stack.pop()))
+        elif command == "shiftleft":
+            stack.append(to_word(stack.pop() << 1))
+        elif command == "shiftright":
+            stack.append(stack.pop() >> 1)
+        else:
+            y = stack.pop()
+            stack.append(to_word(binary[command](stack.pop(), y)))
+    return stack
+
+
+def random_expression(generator, depth):
+    if depth == 0 or generator.random() < 0.3:
+        if generator.random() < 0.6:
+            value = generator.choice(
+                [0, 1, 2, 3, 4, 8, 255, 1024, 16384, 32767,
+                 generator.randrange(32768)])
+            return ["push constant %d" % value]
+        return ["push local %d" % generator.randrange(3)]
+    if generator.random() < 0.2:
+        return random_expression(generator, depth - 1) + \
+            [generator.choice(["neg", "not"])]
+    operator = generator.choice(["add", "sub", "and", "or", "lt", "gt", "eq",
+                                 "call Math.multiply 2",
+                                 "call Math.divide 2"])
+    return random_expression(generator, depth - 1) + \
+        random_expression(generator, depth - 1) + [operator]
+
+
+def test_optimized_expressions_compute_the_same():
+    generator = random.Random(2024)
+    checked = 0
+    while checked < 2000:
+        commands = random_expression(generator, 4)
+        local = [to_word(generator.randrange(-40000, 40000))
+                 for _ in range(3)]
+        try:
+            expected = evaluate(commands, local)
+        except ZeroDivisionError:
+            continue
+        assert evaluate(optimize(commands), local) == expected, commands
+        checked += 1
@@ -0,0 +1,176 @@
+import pytest
+from HackEmulator import HackMachine, assemble
+from VMTranslator import STACK_BASE, VMTranslator
+
+# where the test programs store their results, through THAT
+RESULTS = 3000
+
+
+def translate(files, bootstrap=True):
+    """Translates VM files, given as (name, source) pairs.
+
+    Returns:
+        typing.List[str]: the assembly lines.
+    """
+    translator = VMTranslator()
+    if bootstrap:
+        translator.write_bootstrap()
+    for name, source in files:
+        translator.translate(name, source)
+    translator.finish()
+    return translator.lines
+
+
+def run(lines, count):
+    """Runs a program until it halts.
+
+    Returns:
+        list: its stack pointer, and the signed words of its results.
+    """
+    machine = HackMachine(assemble("\n".join(lines)))
+    machine.run(10 ** 6)
+    assert machine.halted
+    return machine.ram[0], [word - 0x10000 if word & 0x8000 else word
+                            for word in machine.ram[RESULTS:RESULTS + count]]
+
+
+def push(value):
+    if value >= 0:
+        return "push constant %d\n" % value
+    if value == -32768:
+        return "push constant 32767\nnot\n"
+    return "push constant %d\nneg\n" % -value
+
+
+def program(body):
+    """Sys.init, which stores results through THAT and then halts."""
+    return ("function Sys.init 0\npush constant %d\npop pointer 1\n"
+            % RESULTS) + body + "label END\ngoto END\n"
+
+
+# operands whose difference overflows a 16-bit word, among others
+OPERANDS = [(32767, -32768), (-32768, 32767), (20000, -20000),
+            (-20000, 20000), (0, 0), (-1, -1), (5, 3), (3, 5), (-3, -5),
+            (0, -32768)]
+
+
+@pytest.mark.parametrize("command, compare", [
+    ("eq", lambda x, y: x == y),
+    ("gt", lambda x, y: x > y),
+    ("lt", lambda x, y: x < y),
+])
+def test_comparisons(command, compare):
+    body = "".join(push(x) + push(y) + "%s\npop that %d\n" % (command, index)
+                   for index, (x, y) in enumerate(OPERANDS))
+    _, results = run(translate([("Sys", program(body))]), len(OPERANDS))
+    assert results == [-compare(x, y) for x, y in OPERANDS]
+
+
+CALLS = program("""call Main.seven 0
+pop that 0
+push constant 10
+push constant 20
+push constant 30
+call Main.sum 3
+pop that 1
+push constant 5
+call Main.triangle 1
+pop that 2
+call Main.locals 0
+pop that 3
+""") + """function Main.seven 0
+push constant 7
+return
+function Main.sum 0
+push argument 0
+push argument 1
+add
+push argument 2
+add
+return
+function Main.triangle 0
+push argument 0
+if-goto RECURSE
+push constant 0
+return
+label RECURSE
+push argument 0
+push argument 0
+push constant 1
+sub
+call Main.triangle 1
+add
+return
+function Main.locals 3
+push local 0
+push local 1
+or
+push local 2
+or
+return
+"""
+
+
+def test_calls_and_returns():
+    stack_pointer, results = run(translate([("Sys", CALLS)]), 4)
+    # a function without arguments returns where its return address was
+    assert results == [7, 60, 15, 0]
+    # Sys.init's frame is all that is left on the stack
+    assert stack_pointer == STACK_BASE + 5
+
+
+# a function whose own labels look like the return addresses of its calls
+RETURN_LABELS = program("call Main.labels 0\npop that 0\n") + \
+    "function Main.labels 0\n" + \
+    "call Main.one 0\npop temp 0\n" * 5 + \
+    "goto ret.3\npush constant 99\nreturn\n" + \
+    "".join("label ret.%d\n" % index for index in range(1, 6)) + \
+    "push constant 42\nreturn\n" + \
+    "function Main.one 0\npush constant 1\nreturn\n"
+
+
+def test_return_labels_do_not_clash_with_vm_labels():
+    lines = translate([("Sys", RETURN_LABELS)])
+    labels = [line for line in lines if line.startswith("(")]
+    assert len(labels) == len(set(labels))
+    assert run(lines, 1)[1] == [42]
+
+
+@pytest.mark.parametrize("source, message", [
+    ("function Foo$bar 0", "Malformed name 'Foo$bar' in line 1"),
+    ("function Foo.bar 0\nlabel a$b", "Malformed name 'a$b' in line 2"),
+    ("call 1abc 0", "Malformed name '1abc' in line 1"),
+    ("pop constant 0", "Cannot pop to the constant segment in line 1"),
+    ("push local x", "Expected a non-negative number, not 'x' in line 1"),
+    ("push heap 0", "Unknown segment 'heap' in line 1"),
+    ("add 1", "'add' takes 0 arguments, not 1 in line 1"),
+    ("frobnicate", "Unknown command 'frobnicate' in line 1"),
+])
+def test_errors(source, message):
+    with pytest.raises(ValueError) as error:
+        VMTranslator().translate("Foo", source)
+    assert str(error.value) == message
+
+
+@pytest.mark.parametrize("source, instructions", [
+    ("call Foo.bar 2", 8),
+    ("return", 2),
+    ("eq", 4),
+    ("lt", 4),
+])
+def test_shared_stubs_keep_commands_short(source, instructions):
+    report = VMTranslator().translate("Foo", source)
+    assert report["instructions"] == instructions
+
+
+def test_stubs_are_only_written_when_used():
+    translator = VMTranslator()
+    translator.translate("Foo", "push constant 1\npop temp 0")
+    assert translator.finish() == 0
+    for source, present, absent in [
+            ("eq", ["($$EQ)"], ["($$CALL)", "($$RETURN)", "($$LT)"]),
+            ("call Foo.bar 1\ncall Foo.bar 3", ["($$CALL.1)", "($$CALL.3)"],
+             ["($$CALL.0)", "($$RETURN)", "($$EQ)"])]:
+        lines = translate([("Foo", source)], bootstrap=False)
+        assert all(label in lines for label in present)
+        assert not any(label in lines for label in absent)